@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import db
+import archive
+import query_cache
+from columnar import fetch_table, read_table
+from database_setup import CHANGE_TABLES
+
+OUTLIER_Z = 3.5  # robust z-score beyond which a harvest's yield is flagged
+
+LATE_DEVIATION = 0.2  # a cycle this much longer than Crop.GrowthDuration counts as late
+
+# Ghana's growing seasons; SEASON_CODES maps harvest month - 1 to a season
+SEASON_NAMES = ["Dry", "Major", "Minor"]
+SEASON_CODES = np.array([0, 0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 0], dtype=np.int8)
+
+SOURCE_TABLES = ("harvest", "planting", "plot", "crop")
+
+# The large sources are kept between recomputes and patched with the rows the
+# change log lists as changed since; past DELTA_LIMIT changed rows of a table
+# they are loaded again in full
+LOGGED_SOURCES = {
+    "Harvest": "SELECT HarvestID, CropID, PlotID, HarvestDate, Quantity FROM Harvest",
+    "Planting": "SELECT PlantingID, CropID, PlotID, PlantingDate, Quantity AS Planted FROM Planting",
+}
+DELTA_LIMIT = 50000
+
+_results = {}  # db_path -> (table versions, results)
+_sources = {}  # db_path -> (change log sequence, archive files, {table: frame})
+_locks = {}    # db_path -> lock held while that database's results are recomputed
+_lock = threading.Lock()
+
+
+def _load_plots_and_crops():
+    plots = fetch_table("SELECT PlotID, Location, Size FROM Plot").to_pandas()
+    crops = fetch_table("SELECT CropID, Name AS Crop, GrowthDuration FROM Crop").to_pandas()
+    return plots, crops
+
+
+def load_sources():
+    # Harvests of archived years are read from their archive files as well
+    harvests = archive.fetch_frame(LOGGED_SOURCES["Harvest"])
+    plantings = fetch_table(LOGGED_SOURCES["Planting"]).to_pandas()
+    return (harvests, plantings, *_load_plots_and_crops())
+
+
+def _archive_files(db_path):
+    # Archiving moves rows without logging them, so a change here means a full load
+    return tuple((year, os.path.getmtime(archive.archive_path(year, db_path)))
+                 for year in archive.archived_years(db_path=db_path))
+
+
+# The logged sources' rows changed after change log sequence since: the
+# sequence now and, per table, the changed keys with the current rows of
+# those not deleted. None instead of the changes when there are too many, or
+# when the log is behind since because the database was restored.
+def _read_changes(db_path, since):
+    with db.get_connection(db_path) as conn:
+        conn.execute("BEGIN")
+        last = conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM ChangeLog").fetchone()[0]
+        if last < since:
+            return last, None
+        changes = {}
+        for table, query in LOGGED_SOURCES.items():
+            keys = [row[0] for row in conn.execute("SELECT DISTINCT RowID FROM ChangeLog "
+                                                   "WHERE Seq > ? AND Seq <= ? AND TableName = ?",
+                                                   (since, last, table))]
+            if len(keys) > DELTA_LIMIT:
+                return last, None
+            if keys:
+                rows = read_table(conn, f"{query} WHERE {CHANGE_TABLES[table]} IN (SELECT value FROM json_each(?))",
+                                  (json.dumps(keys),)).to_pandas()
+                changes[table] = (keys, rows)
+    return last, changes
+
+
+def _update_sources(db_path):
+    previous = _sources.get(db_path)
+    archives = _archive_files(db_path)
+    changes = None
+    if previous is not None and previous[1] == archives:
+        sequence, changes = _read_changes(db_path, previous[0])
+    if changes is None:
+        with db.get_connection(db_path) as conn:
+            # Read first: changes made while loading are patched in again next time
+            sequence = conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM ChangeLog").fetchone()[0]
+        harvests, plantings, plots, crops = load_sources()
+        frames = {"Harvest": harvests, "Planting": plantings}
+    else:
+        frames = dict(previous[2])
+        for table, (keys, rows) in changes.items():
+            frame = frames[table]
+            kept = frame[~frame[CHANGE_TABLES[table]].isin(keys)]
+            frames[table] = pd.concat([kept, rows], ignore_index=True) if len(rows) else kept
+        plots, crops = _load_plots_and_crops()
+    _sources[db_path] = (sequence, archives, frames)
+    return frames["Harvest"], frames["Planting"], plots, crops
+
+
+def _robust_z(values, groups):
+    # Distance from the group median in units of the median absolute deviation
+    median = values.groupby(groups, observed=True).transform("median")
+    mad = (values - median).abs().groupby(groups, observed=True).transform("median")
+    return 0.6745 * (values - median) / mad.replace(0, np.nan)
+
+
+def compute(harvests, plantings, plots, crops):
+    # Dates that did not parse as ISO text in columnar arrive as strings; both
+    # sides are brought to one unit, as merge_asof will not match s against ns
+    harvests = harvests.assign(
+        HarvestDate=pd.to_datetime(harvests["HarvestDate"], errors="coerce").astype("datetime64[ns]"))
+    plantings = plantings.assign(
+        PlantingDate=pd.to_datetime(plantings["PlantingDate"], errors="coerce").astype("datetime64[ns]"))
+    harvests = harvests.dropna(subset=["HarvestDate"])
+    plantings = plantings.dropna(subset=["PlantingDate"])
+    if not harvests["HarvestDate"].is_monotonic_increasing:
+        harvests = harvests.sort_values("HarvestDate", kind="stable")
+    if not plantings["PlantingDate"].is_monotonic_increasing:
+        plantings = plantings.sort_values("PlantingDate", kind="stable")
+
+    # Each harvest is matched to the latest planting of the same crop on the
+    # same plot on or before the harvest date
+    df = pd.merge_asof(harvests, plantings, left_on="HarvestDate", right_on="PlantingDate",
+                       by=["CropID", "PlotID"], direction="backward")
+
+    # Plot sizes and growth durations are looked up by ID; names are only
+    # attached to the aggregated results, so the per-harvest work stays numeric
+    plots = plots.set_index("PlotID")
+    crops = crops.set_index("CropID")
+    size = plots["Size"].reindex(df["PlotID"]).to_numpy(dtype=float)
+    growth = crops["GrowthDuration"].reindex(df["CropID"]).to_numpy(dtype=float)
+    quantity = df["Quantity"].to_numpy(dtype=float)
+    planted = df["Planted"].to_numpy(dtype=float)
+    cycle = (df["HarvestDate"] - df["PlantingDate"]).dt.days.to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["YieldPerHectare"] = np.where(size > 0, quantity / size, np.nan)
+        df["Conversion"] = np.where(planted > 0, quantity / planted, np.nan)
+        df["CycleDays"] = cycle
+        df["CycleDeviation"] = cycle / growth - 1
+    df["Year"] = df["HarvestDate"].dt.year
+    df["Season"] = pd.Categorical.from_codes(SEASON_CODES[df["HarvestDate"].dt.month.to_numpy() - 1], SEASON_NAMES)
+    df["YieldZ"] = _robust_z(df["YieldPerHectare"], df["CropID"])
+    df["Late"] = df["CycleDeviation"] > LATE_DEVIATION
+
+    def summarise(keys):
+        return (df.groupby(keys, observed=True, sort=True)
+                .agg(Harvests=("HarvestID", "size"), TotalQuantity=("Quantity", "sum"),
+                     YieldPerHectare=("YieldPerHectare", "mean"), Conversion=("Conversion", "mean"),
+                     MeanCycleDays=("CycleDays", "mean"))
+                .reset_index())
+
+    def crop_names(frame):
+        frame.insert(frame.columns.get_loc("CropID") + 1, "Crop",
+                     crops["Crop"].astype(object).reindex(frame["CropID"]).fillna("Unknown").to_numpy())
+        return frame
+
+    by_plot = summarise(["PlotID"])
+    by_plot.insert(1, "Location", plots["Location"].astype(object).reindex(by_plot["PlotID"]).fillna("Unknown")
+                   .to_numpy())
+    by_plot.insert(2, "Size", plots["Size"].reindex(by_plot["PlotID"]).to_numpy())
+
+    cycles = (df[df["CycleDays"].notna()].groupby("CropID", observed=True)
+              .agg(Harvests=("HarvestID", "size"), MedianCycleDays=("CycleDays", "median"),
+                   MeanCycleDays=("CycleDays", "mean"), MeanDeviation=("CycleDeviation", "mean"),
+                   LateShare=("Late", "mean"))
+              .reset_index())
+    cycles.insert(1, "GrowthDuration", crops["GrowthDuration"].reindex(cycles["CropID"]).to_numpy())
+
+    outliers = df[df["YieldZ"].abs() > OUTLIER_Z]
+    outliers = outliers.iloc[np.argsort(-outliers["YieldZ"].abs().to_numpy(), kind="stable")]
+    outliers = outliers[["HarvestID", "CropID", "PlotID", "HarvestDate", "Quantity", "YieldPerHectare", "YieldZ"]]
+    return {
+        "harvests": len(df),
+        "matched": int(df["PlantingDate"].notna().sum()),
+        "median_yield": float(df["YieldPerHectare"].median()) if len(df) else float("nan"),
+        "by_crop": crop_names(summarise(["CropID"])),
+        "by_plot": by_plot,
+        "by_season": crop_names(summarise(["Year", "Season", "CropID"])),
+        "cycles": crop_names(cycles),
+        "outliers": crop_names(outliers.reset_index(drop=True)),
+    }
+
+
+# Yield metrics for the current database, recomputed only after a write to
+# Harvest, Planting, Plot or Crop has bumped one of their cache versions.
+# Sessions of one farm wait for a single recompute; other farms do not wait.
+def yield_analytics():
+    db_path = db.current_path()
+    db.check_external_writes(db_path)
+    versions = query_cache.table_versions(db_path, SOURCE_TABLES)
+    cached = _results.get(db_path)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+    with _lock:
+        database_lock = _locks.setdefault(db_path, threading.Lock())
+    with database_lock:
+        cached = _results.get(db_path)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        results = compute(*_update_sources(db_path))
+        # Store under the versions read before loading, so a write made in
+        # between makes the next call compute again
+        _results[db_path] = (versions, results)
+    return results
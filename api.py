@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import tornado.ioloop
+import tornado.web
+import db
+import shards
+import sync
+from bulk_import import IMPORT_TABLES, MAX_REPORTED_ERRORS, validate_chunk
+
+# A headless JSON API for field devices (tablets, weighing scales), served
+# next to the Streamlit app. Each batch POST carries an array of rows; they
+# are validated off the event loop and handed to the farm's writer thread as
+# one executemany, which commits them together with whatever other requests
+# and form submits arrived in the same window. The API runs as its own
+# process; the app notices its commits through PRAGMA data_version (see
+# db.check_external_writes). Offline clients sync through /api/changes and
+# /api/sync (see sync.py).
+API_TABLES = ["Harvest", "InventoryUsage", "MarketInfo"]
+API_ADDRESS = os.environ.get("FARMFLOW_API_ADDRESS", "127.0.0.1")
+API_PORT = int(os.environ.get("FARMFLOW_API_PORT", "8502"))
+API_TOKEN = os.environ.get("FARMFLOW_API_TOKEN")   # when set, required as "Authorization: Bearer <token>"
+MAX_BATCH_ROWS = 10000          # rows accepted in one request
+MAX_BODY_BYTES = 16 * 2 ** 20
+
+
+def _valid_keys(foreign_keys):
+    # Read through fetch_data, so the key lists stay cached until the parent
+    # table is written to
+    return {column: np.array([row[0] for row in db.fetch_data(f"SELECT {key} FROM {table}")], dtype=np.int64)
+            for column, (table, key) in foreign_keys.items()}
+
+
+# Runs on an executor thread: the JSON rows as validated insert parameters,
+# sorted like a bulk import, and the rejected rows with their reasons
+def prepare_rows(db_path, table, records):
+    db.use_database(db_path)
+    spec = IMPORT_TABLES[table]
+    columns = list(spec["columns"])
+    df = pd.DataFrame.from_records(records, columns=columns)
+    clean, rejected, reasons = validate_chunk(df, spec, _valid_keys(spec["foreign_keys"]))
+    clean = clean.sort_values(spec["sort_by"], kind="stable")
+    rows = list(zip(*(clean[column].tolist() for column in columns)))
+    errors = [{"row": int(row_number), "error": reason} for row_number, reason in reasons[rejected].items()]
+    return columns, rows, errors
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        if API_TOKEN:
+            supplied = self.request.headers.get("Authorization", "")
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {API_TOKEN}".encode()):
+                raise tornado.web.HTTPError(401, reason="Missing or wrong API token")
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({"error": self._reason})
+
+    def database_path(self):
+        farm = self.get_query_argument("farm", shards.MAIN_FARM)
+        if farm not in shards.farm_names():
+            raise tornado.web.HTTPError(404, reason=f"Unknown farm: {farm}")
+        return shards.farm_path(farm)
+
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write({"status": "ok", "tables": API_TABLES, "farms": shards.farm_names()})
+
+
+# POST /api/<table>?farm=<name>&on_error=skip|abort with a JSON array of rows.
+# Row numbers in errors count from 0 in the posted array. With on_error=abort
+# a single invalid row rejects the whole batch.
+class BatchHandler(BaseHandler):
+    async def post(self, table):
+        if table not in API_TABLES:
+            raise tornado.web.HTTPError(404, reason=f"Unknown table: {table}")
+        db_path = self.database_path()
+        on_error = self.get_query_argument("on_error", "skip")
+        try:
+            records = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="The body is not valid JSON")
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise tornado.web.HTTPError(400, reason="The body must be a JSON array of objects")
+        if len(records) > MAX_BATCH_ROWS:
+            raise tornado.web.HTTPError(413, reason=f"At most {MAX_BATCH_ROWS} rows per request")
+
+        loop = tornado.ioloop.IOLoop.current()
+        columns, rows, errors = await loop.run_in_executor(None, prepare_rows, db_path, table, records)
+        report = {"table": table, "received": len(records), "inserted": 0, "rejected": len(errors),
+                  "errors": errors[:MAX_REPORTED_ERRORS]}
+        if errors and on_error == "abort":
+            self.set_status(422)
+            self.finish(report)
+            return
+        if rows:
+            insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            try:
+                report["inserted"] = await asyncio.wrap_future(
+                    db.submit_write(table, [(insert, rows, None)], (), db_path))
+            except sqlite3.IntegrityError as error:
+                raise tornado.web.HTTPError(422, reason=f"Nothing was saved: {error}")
+            except sqlite3.Error as error:
+                # Busy or locked: the device should retry the batch later
+                raise tornado.web.HTTPError(503, reason=f"Nothing was saved: {error}")
+        self.set_status(201 if report["inserted"] else 200)
+        self.finish(report)
+
+
+def _pull(db_path, since, limit):
+    db.use_database(db_path)
+    return sync.changes_since(since, limit)
+
+
+# GET /api/changes?since=<sequence>&limit=<entries>&farm=<name>: the changes
+# after the client's last sequence number. A client whose number is ahead of
+# the log (after a restore) gets 409 and starts again from 0.
+class ChangesHandler(BaseHandler):
+    async def get(self):
+        db_path = self.database_path()
+        try:
+            since = int(self.get_query_argument("since", "0"))
+            limit = min(max(int(self.get_query_argument("limit", str(sync.PULL_LIMIT))), 1), sync.PULL_LIMIT)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="since and limit must be integers")
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            changes = await loop.run_in_executor(None, _pull, db_path, since, limit)
+        except sync.SyncReset as error:
+            self.set_status(409)
+            self.finish({"error": str(error), "reset": True})
+            return
+        self.finish(changes)
+
+
+# POST /api/sync?farm=<name> with a JSON array of offline edits; see
+# sync.apply_edits. Conflicts are reported per table in the 200 response, and
+# edits with invalid values under "rejected".
+class SyncHandler(BaseHandler):
+    async def post(self):
+        db_path = self.database_path()
+        try:
+            edits = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="The body is not valid JSON")
+        if not isinstance(edits, list):
+            raise tornado.web.HTTPError(400, reason="The body must be a JSON array of edits")
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            result = await loop.run_in_executor(None, sync.apply_edits, edits, db_path)
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, reason=str(error))
+        except sqlite3.Error as error:
+            raise tornado.web.HTTPError(503, reason=f"Nothing was saved: {error}")
+        self.finish(result)
+
+
+def make_app():
+    # Change feeds are mostly repeated column values, so responses are gzipped
+    # for clients that accept it
+    return tornado.web.Application([
+        (r"/api/health", HealthHandler),
+        (r"/api/changes", ChangesHandler),
+        (r"/api/sync", SyncHandler),
+        (r"/api/(\w+)", BatchHandler),
+    ], compress_response=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the FarmFlow batch ingestion API")
+    parser.add_argument("--address", default=API_ADDRESS)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--database", help="main farm database (default: the app's)")
+    args = parser.parse_args(argv)
+    if args.database:
+        db.DB_PATH = args.database
+
+    make_app().listen(args.port, args.address, max_body_size=MAX_BODY_BYTES)
+    print(f"FarmFlow API listening on http://{args.address}:{args.port}/api/")
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
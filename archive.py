@@ -0,0 +1,210 @@
+import datetime
+import os
+import re
+import sqlite3
+import pyarrow as pa
+import db
+import query_cache
+from columnar import BATCH_SIZE, fetch_table as fetch_live_table, read_table
+
+# Closed years move out of the live database into one SQLite file per year,
+# kept next to it: farm_management.db archives to farm_management.archive/2019.db.
+# The trigger-maintained summaries keep the archived years' totals, so the
+# report charts and consolidated reports need no archive reads at all.
+ARCHIVED_TABLES = {
+    "Harvest": "HarvestDate",
+    "HarvestValuation": "HarvestDate",
+    "FinancialRecord": "RecordDate",
+    "MarketInfo": "MarketDate",
+    "Task": "TaskDate",
+    "PestControl": "ControlDate",
+}
+HOT_YEARS = int(os.environ.get("FARMFLOW_HOT_YEARS", "2"))  # the current year and the one before stay live
+PREVIEW_ROWS = 1000  # archived rows listed under a filtered table
+
+# Harvests entered later are valued at the latest price on or before their
+# date, which is looked up in the live MarketInfo table only; the last price
+# of each crop in every archived year therefore stays live
+LATEST_PRICES = '''
+    SELECT MarketInfoID FROM (
+        SELECT MarketInfoID, ROW_NUMBER() OVER (
+            PARTITION BY CropID, strftime('%Y', MarketDate) ORDER BY MarketDate DESC, MarketInfoID DESC) AS Newest
+        FROM main.MarketInfo)
+    WHERE Newest = 1'''
+KEPT_LIVE = {"MarketInfo": f"MarketInfoID NOT IN ({LATEST_PRICES})"}
+
+_ARCHIVED_REFERENCE = re.compile(r'\b(FROM|JOIN)\s+(' + '|'.join(ARCHIVED_TABLES) + r')\b', re.IGNORECASE)
+
+
+def archive_dir(db_path=None):
+    return os.path.splitext(db_path or db.current_path())[0] + ".archive"
+
+
+def archive_path(year, db_path=None):
+    return os.path.join(archive_dir(db_path), f"{year}.db")
+
+
+# Archived years of the database, optionally only those overlapping start..end
+def archived_years(start=None, end=None, db_path=None):
+    directory = archive_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    years = sorted(int(name[:-3]) for name in os.listdir(directory) if re.fullmatch(r"\d{4}\.db", name))
+    return [year for year in years if (start is None or year >= start.year) and (end is None or year <= end.year)]
+
+
+def closed_years(db_path=None):
+    # Years with live rows that have ended more than HOT_YEARS - 1 years ago
+    last_closed = datetime.date.today().year - HOT_YEARS
+    selects = ' UNION '.join(f"SELECT DISTINCT CAST(strftime('%Y', {column}) AS INTEGER) AS Year FROM {table}"
+                             + (f" WHERE {KEPT_LIVE[table]}" if table in KEPT_LIVE else "")
+                             for table, column in ARCHIVED_TABLES.items())
+    with db.get_connection(db_path) as conn:
+        rows = conn.execute(f"SELECT Year FROM ({selects}) WHERE Year <= ? ORDER BY Year", (last_closed,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def _prepare_archive(conn, alias):
+    # Archive tables copy the live definitions; columns added to the live
+    # tables since an archive was made are added to it as well
+    for table in ARCHIVED_TABLES:
+        live_columns = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        archived = {row[1] for row in conn.execute(f"PRAGMA {alias}.table_info({table})")}
+        if not archived:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(re.sub(rf'^CREATE TABLE (IF NOT EXISTS )?"?{table}\b"?', f"CREATE TABLE {alias}.{table}",
+                                sql))
+            conn.execute(f"CREATE INDEX {alias}.idx_{table.lower()}_date ON {table} ({ARCHIVED_TABLES[table]})")
+            continue
+        for _, name, declared, *_ in live_columns:
+            if name not in archived:
+                conn.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {name} {declared}")
+
+
+# Move every row dated in year, except the rows KEPT_LIVE, to its archive
+# file and delete it from the live database. The summaries are left as they
+# are (the delete triggers are deferred), so they still cover the archived
+# year. Copying uses INSERT OR
+# IGNORE, so an archive interrupted between the two files can be run again.
+def archive_year(year, db_path=None):
+    db_path = db_path or db.current_path()
+    if year > datetime.date.today().year - HOT_YEARS:
+        raise ValueError(f"{year} is not closed yet; the last {HOT_YEARS} years stay live.")
+    os.makedirs(archive_dir(db_path), exist_ok=True)
+    alias = f"archive_{year}"
+    bounds = (f"{year:04d}-01-01", f"{year + 1:04d}-01-01")
+    moved = {}
+
+    # On the writer thread, so form writes wait their turn instead of failing
+    # on the lock while the year is moved
+    def move(conn):
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (archive_path(year, db_path),))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            _prepare_archive(conn, alias)
+            conn.execute("UPDATE RollupControl SET Deferred = 1")
+            last_change = conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM main.ChangeLog").fetchone()[0]
+            for table, column in ARCHIVED_TABLES.items():
+                columns = ', '.join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+                condition = f"{column} >= ? AND {column} < ?"
+                if table in KEPT_LIVE:
+                    condition += f" AND {KEPT_LIVE[table]}"
+                conn.execute(f"INSERT OR IGNORE INTO {alias}.{table} ({columns}) "
+                             f"SELECT {columns} FROM main.{table} WHERE {condition}", bounds)
+                moved[table] = conn.execute(f"DELETE FROM main.{table} WHERE {condition}", bounds).rowcount
+            # Archived rows were not deleted, so sync clients keep them: the
+            # rows leave the change log instead of being logged as deletes
+            conn.execute("DELETE FROM main.ChangeLog WHERE (TableName, RowID) IN "
+                         "(SELECT TableName, RowID FROM main.ChangeLog WHERE Seq > ?)", (last_change,))
+            conn.execute("UPDATE RollupControl SET Deferred = 0")
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute(f"DETACH DATABASE {alias}")
+
+    try:
+        db.run_exclusive(move, db_path)
+    finally:
+        for table in ARCHIVED_TABLES:
+            query_cache.invalidate_table(db_path, table)
+    return moved
+
+
+def _read_archive(query, params, year, db_path, batch_size):
+    # The query runs on a live connection with the archive attached, its
+    # archived tables pointed at the archive and every other table at main
+    alias = f"archive_{year}"
+    archived_query = _ARCHIVED_REFERENCE.sub(lambda match: f"{match[1]} {alias}.{match[2]}", query)
+    db.check_external_writes(db_path)
+    key, table = query_cache.get(db_path, archived_query, params, kind="arrow")
+    if table is not None:
+        return table
+    tables = query_cache.tables_in(query)
+    versions = query_cache.table_versions(db_path, tables)
+    with db.get_connection(db_path) as conn:
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (archive_path(year, db_path),))
+        try:
+            table = read_table(conn, archived_query, params, batch_size)
+        finally:
+            conn.execute(f"DETACH DATABASE {alias}")
+    query_cache.put(key, tables, versions, table)
+    return table
+
+
+def _concat(tables):
+    # Each part settles its own column types (dictionary or plain text,
+    # timestamps or text), so plain types are used wherever the parts differ
+    names = tables[0].column_names
+    target = {}
+    for index, name in enumerate(names):
+        types = {table.schema.field(index).type for table in tables}
+        if len(types) > 1:
+            types = {kind.value_type if pa.types.is_dictionary(kind) else kind for kind in types}
+            types.discard(pa.null())
+            if len(types) == 1:
+                target[name] = types.pop()
+            elif all(pa.types.is_integer(kind) or pa.types.is_floating(kind) for kind in types):
+                target[name] = pa.float64()
+            else:
+                target[name] = pa.string()
+    if target:
+        tables = [table.cast(pa.schema([pa.field(name, target.get(name, table.schema.field(name).type))
+                                        for name in names])) for table in tables]
+    return pa.concat_tables(tables)
+
+
+# fetch_table over the live database and the archives of the years between
+# start and end (all of them by default). The query may only read archived
+# tables with FROM or JOIN; other tables are read from the live database.
+def fetch_table(query, params=(), start=None, end=None, include_live=True, sort_by=None, batch_size=BATCH_SIZE):
+    db_path = db.current_path()
+    parts = [fetch_live_table(query, params, batch_size)] if include_live else []
+    for year in archived_years(start, end, db_path):
+        parts.append(_read_archive(query, params, year, db_path, batch_size))
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    table = _concat(parts)
+    return table.sort_by(sort_by) if sort_by else table
+
+
+def fetch_frame(query, params=(), start=None, end=None, include_live=True, sort_by=None):
+    table = fetch_table(query, params, start, end, include_live, sort_by)
+    return None if table is None else table.to_pandas()
+
+
+def archive_summary(db_path=None):
+    # Rows per archived table in every archive file
+    results = []
+    for year in archived_years(db_path=db_path):
+        conn = sqlite3.connect(f"file:{archive_path(year, db_path)}?mode=ro", uri=True)
+        try:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ARCHIVED_TABLES}
+        finally:
+            conn.close()
+        results.append({"Year": year, **counts,
+                        "Size (MB)": os.path.getsize(archive_path(year, db_path)) / 2 ** 20})
+    return results
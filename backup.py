@@ -0,0 +1,259 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+import zlib
+import db
+import query_cache
+from database_setup import MIGRATIONS, migrate
+
+# Point-in-time snapshots of a farm's database, made with SQLite's online
+# backup API a few pages at a time and stored gzip-compressed with a JSON
+# manifest next to each: backups/farm_management/farm_management-20240601-010000.db.gz
+# Snapshots are taken every night before maintenance, and on demand.
+BACKUP_DIR = os.environ.get("FARMFLOW_BACKUP_DIR", "backups")
+WORKING_HOURS = (7, 19)         # local hours when users are about; copying is throttled then
+PAGES_PER_STEP = 1024           # pages copied per backup step off-peak...
+WORKING_PAGES_PER_STEP = 64     # ...and during working hours
+WORKING_STEP_PAUSE = 0.02       # seconds between steps during working hours
+COMPRESS_CHUNK = 2 ** 20        # bytes compressed between pauses
+KEEP_DAILY = int(os.environ.get("FARMFLOW_KEEP_DAILY", "7"))       # newest snapshot of each of the last 7 days,
+KEEP_WEEKLY = int(os.environ.get("FARMFLOW_KEEP_WEEKLY", "4"))     # of the last 4 weeks
+KEEP_MONTHLY = int(os.environ.get("FARMFLOW_KEEP_MONTHLY", "12"))  # and of the last 12 months
+
+_SNAPSHOT_NAME = re.compile(r"^(?P<stem>.+)-(?P<stamp>\d{8}-\d{6})\.db\.gz$")
+
+
+def backup_dir(db_path=None):
+    stem = os.path.splitext(os.path.basename(db_path or db.current_path()))[0]
+    return os.path.join(BACKUP_DIR, stem)
+
+
+def _throttled():
+    return WORKING_HOURS[0] <= datetime.datetime.now().hour < WORKING_HOURS[1]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(COMPRESS_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compress(source, target, pause):
+    with open(source, "rb") as raw, gzip.open(target, "wb", compresslevel=6) as packed:
+        for chunk in iter(lambda: raw.read(COMPRESS_CHUNK), b""):
+            packed.write(chunk)
+            if pause:
+                time.sleep(pause)
+
+
+def _check(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA quick_check").fetchone()[0], conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Copy the database to a compressed snapshot. The source holds one read
+# transaction for the whole copy, so the snapshot is the database as of its
+# start: in WAL mode that blocks no writer, and later commits do not make the
+# backup start over, as they would between steps otherwise. Returns the
+# snapshot's manifest.
+def snapshot(db_path=None, throttle=None):
+    db_path = db_path or db.current_path()
+    throttle = _throttled() if throttle is None else throttle
+    pages = WORKING_PAGES_PER_STEP if throttle else PAGES_PER_STEP
+    pause = WORKING_STEP_PAUSE if throttle else 0
+    directory = backup_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    created = datetime.datetime.now()
+    name = f"{os.path.basename(directory)}-{created:%Y%m%d-%H%M%S}.db.gz"
+    partial = os.path.join(directory, name[:-3] + ".partial")
+
+    started = time.perf_counter()
+    target = sqlite3.connect(partial)
+    try:
+        with db.get_connection(db_path) as conn:
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            conn.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+            conn.rollback()
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+    try:
+        check, version = _check(partial)
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"The snapshot failed its integrity check: {check}")
+        manifest = {"file": name, "database": db_path, "created": created.isoformat(timespec="seconds"),
+                    "schema_version": version, "bytes": os.path.getsize(partial), "sha256": _sha256(partial)}
+        _compress(partial, os.path.join(directory, name), pause)
+    finally:
+        os.remove(partial)
+    manifest["compressed_bytes"] = os.path.getsize(os.path.join(directory, name))
+    manifest["seconds"] = time.perf_counter() - started
+    with open(os.path.join(directory, name + ".json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+# Manifests of the database's snapshots, newest first
+def list_snapshots(db_path=None):
+    directory = backup_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in os.listdir(directory):
+        if _SNAPSHOT_NAME.match(entry) and os.path.exists(os.path.join(directory, entry + ".json")):
+            with open(os.path.join(directory, entry + ".json")) as file:
+                manifests.append(json.load(file))
+    return sorted(manifests, key=lambda manifest: manifest["created"], reverse=True)
+
+
+def _retained(manifests):
+    # Grandfather-father-son: the newest snapshot of each recent day, week and month
+    keep = set()
+    for count, period in ((KEEP_DAILY, "%Y-%m-%d"), (KEEP_WEEKLY, "%G-%V"), (KEEP_MONTHLY, "%Y-%m")):
+        periods = set()
+        for manifest in manifests:
+            label = datetime.datetime.fromisoformat(manifest["created"]).strftime(period)
+            if label not in periods:
+                if len(periods) == count:
+                    break
+                periods.add(label)
+                keep.add(manifest["file"])
+    return keep
+
+
+def prune(db_path=None):
+    # Delete the snapshots the retention policy no longer keeps; returns their names
+    manifests = list_snapshots(db_path)
+    keep = _retained(manifests)
+    removed = []
+    for manifest in manifests:
+        if manifest["file"] not in keep:
+            path = os.path.join(backup_dir(db_path), manifest["file"])
+            os.remove(path)
+            os.remove(path + ".json")
+            removed.append(manifest["file"])
+    return removed
+
+
+def _find(name, db_path):
+    path = name if os.path.exists(name) else os.path.join(backup_dir(db_path), name)
+    if not os.path.exists(path + ".json"):
+        raise FileNotFoundError(f"No snapshot {name} in {backup_dir(db_path)}")
+    with open(path + ".json") as file:
+        return path, json.load(file)
+
+
+def _unpack(path, manifest, target):
+    # Decompress a snapshot to target and check it against its manifest
+    try:
+        with gzip.open(path, "rb") as packed, open(target, "wb") as raw:
+            shutil.copyfileobj(packed, raw, COMPRESS_CHUNK)
+    except (gzip.BadGzipFile, EOFError, zlib.error) as error:
+        raise ValueError(f"{manifest['file']} is damaged: {error}")
+    if _sha256(target) != manifest["sha256"]:
+        raise ValueError(f"{manifest['file']} does not match its checksum")
+    check, version = _check(target)
+    if check != "ok":
+        raise ValueError(f"{manifest['file']} failed its integrity check: {check}")
+    if version > len(MIGRATIONS):
+        raise ValueError(f"{manifest['file']} has schema version {version}, newer than this FarmFlow "
+                         f"({len(MIGRATIONS)})")
+
+
+def verify(name, db_path=None):
+    path, manifest = _find(name, db_path)
+    scratch = path[:-3] + ".verify"
+    try:
+        _unpack(path, manifest, scratch)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    return manifest
+
+
+def _copy_into(scratch, conn):
+    source = sqlite3.connect(f"file:{scratch}?mode=ro", uri=True)
+    try:
+        source.backup(conn)
+    finally:
+        source.close()
+
+
+# Replace the database's contents with a snapshot, after checking the
+# snapshot's checksum and integrity. The current contents are snapshotted
+# first. The copy goes through the backup API into the live file, so open
+# connections see the restored data on their next transaction, and a running
+# app drops its cached results when it notices the commit (see
+# db.check_external_writes); no restart is needed. The copy runs on the
+# writer thread, so this process's form writes wait for it; other processes
+# hold off on the lock, so restore when nobody is entering data.
+def restore(name, db_path=None, keep_current=True):
+    db_path = db_path or db.current_path()
+    path, manifest = _find(name, db_path)
+    scratch = os.path.join(backup_dir(db_path), manifest["file"][:-3] + ".restore")
+    try:
+        _unpack(path, manifest, scratch)
+        previous = snapshot(db_path, throttle=False) if keep_current else None
+        db.run_exclusive(lambda conn: _copy_into(scratch, conn), db_path)
+        # An older snapshot is brought up to this version's schema
+        migrate(db_path)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    query_cache.invalidate_database(db_path)
+    return {"restored": manifest["file"], "previous": previous["file"] if previous else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up and restore a FarmFlow database")
+    parser.add_argument("--database", default=db.DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="take a snapshot now")
+    commands.add_parser("list", help="list snapshots, newest first")
+    commands.add_parser("prune", help="delete snapshots past the retention policy")
+    for command in ("verify", "restore"):
+        subparser = commands.add_parser(command, help=f"{command} a snapshot")
+        subparser.add_argument("snapshot", help="snapshot file name or path")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        manifest = snapshot(args.database)
+        print(f"{manifest['file']}: {manifest['bytes'] / 2 ** 20:,.1f} MB, "
+              f"{manifest['compressed_bytes'] / 2 ** 20:,.1f} MB compressed in {manifest['seconds']:.1f}s")
+    elif args.command == "list":
+        for manifest in list_snapshots(args.database):
+            print(f"{manifest['created']}  {manifest['compressed_bytes'] / 2 ** 20:8,.1f} MB  {manifest['file']}")
+    elif args.command == "prune":
+        for name in prune(args.database):
+            print(f"deleted {name}")
+    elif args.command == "verify":
+        try:
+            verify(args.snapshot, args.database)
+        except (ValueError, FileNotFoundError) as error:
+            sys.exit(str(error))
+        print(f"{args.snapshot} is intact")
+    elif args.command == "restore":
+        try:
+            result = restore(args.snapshot, args.database)
+        except (ValueError, FileNotFoundError) as error:
+            sys.exit(str(error))
+        print(f"Restored {result['restored']}; the previous contents are in {result['previous']}")
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
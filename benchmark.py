@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from tornado.httpclient import AsyncHTTPClient, HTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop
+import analytics
+import bulk_import
+import columnar
+import db
+import query_cache
+from datagen import create_synthetic_database
+from filters import crop_filter, id_filter, date_range_filter, text_search, combine_filters
+from pagination import fetch_page, fetch_ranked_page, estimate_count
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+REPEATS = 5
+CRUD_OPERATIONS = 200
+WRITER_SESSIONS = 16
+DATAFRAME_ROWS = 100000
+API_CLIENTS = 8                 # devices posting at once
+API_BATCHES = 25                # requests per device
+API_BATCH_ROWS = 200            # harvest rows per request
+IMPORT_ROWS = 200000            # harvest rows per bulk import
+
+LAST_YEAR = (datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))
+
+
+def _time(function, repeats, cached=False):
+    timings = []
+    for _ in range(repeats):
+        if not cached:
+            query_cache.clear()
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"min_ms": min(timings), "median_ms": statistics.median(timings), "max_ms": max(timings),
+            "repeats": repeats}
+
+
+def _page(table, key_column, *filters):
+    where, params = combine_filters(*filters)
+    return lambda: fetch_page(table, key_column, where, params, None, 26)
+
+
+# The queries each page issues on a rerun, read through fetch_data with the
+# result cache emptied first so the numbers reflect SQLite work
+def page_benchmarks():
+    last_harvest = db.fetch_data("SELECT MAX(HarvestID) FROM Harvest")[0][0] or 0
+    return {
+        "crop_planning.first_page": _page("Crop", "CropID"),
+        "crop_planning.search": lambda: fetch_ranked_page("Crop", "CropID", text_search("Crop", "ma"), None, 26),
+        "inventory.first_page": _page("Inventory", "InventoryID"),
+        "inventory.search": lambda: fetch_ranked_page("Inventory", "InventoryID",
+                                                      text_search("Inventory", "fert"), None, 26),
+        "financial_records.first_page": _page("FinancialRecord", "RecordID"),
+        "financial_records.date_range": _page("FinancialRecord", "RecordID",
+                                              date_range_filter("RecordDate", LAST_YEAR)),
+        "harvest_tracking.first_page": _page("Harvest", "HarvestID"),
+        "harvest_tracking.crop_id": _page("Harvest", "HarvestID", crop_filter("3")),
+        "harvest_tracking.crop_name_date_range": _page("Harvest", "HarvestID", crop_filter("Maize"),
+                                                       date_range_filter("HarvestDate", LAST_YEAR)),
+        "harvest_tracking.plot": _page("Harvest", "HarvestID", id_filter("PlotID", 7)),
+        "harvest_tracking.last_page": lambda: fetch_page("Harvest", "HarvestID", "1 = 1", (),
+                                                         max(last_harvest - 25, 0), 26),
+        "harvest_tracking.count": lambda: estimate_count("Harvest", "1 = 1", ()),
+        "market_info.crop_date_range": _page("MarketInfo", "MarketInfoID", crop_filter("Maize"),
+                                             date_range_filter("MarketDate", LAST_YEAR)),
+        "employee_management.search": lambda: fetch_ranked_page("Employee", "EmployeeID",
+                                                                text_search("Employee", "kw"), None, 26),
+        "report.monthly_summary": lambda: db.fetch_data(
+            "SELECT Month, TotalIncome, TotalExpenses FROM MonthlyFinancialSummary ORDER BY Month"),
+        "report.harvest_summary": lambda: db.fetch_data(
+            "SELECT s.Month, c.Name, s.TotalQuantity FROM MonthlyHarvestSummary s "
+            "JOIN Crop c ON c.CropID = s.CropID ORDER BY s.Month"),
+        "report.full_group_by": lambda: db.fetch_data(
+            "SELECT strftime('%Y-%m', RecordDate) as Month, SUM(Income), SUM(Expenses) "
+            "FROM FinancialRecord GROUP BY Month ORDER BY Month"),
+    }
+
+
+def crud_benchmark(operations=CRUD_OPERATIONS):
+    results = {}
+    started = time.perf_counter()
+    for index in range(operations):
+        db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-06-01", "Quantity": index + 1})
+    results["add_per_second"] = operations / (time.perf_counter() - started)
+
+    ids = [row[0] for row in db.fetch_data("SELECT HarvestID FROM Harvest ORDER BY HarvestID DESC LIMIT ?",
+                                           (operations,))]
+    started = time.perf_counter()
+    for harvest_id in ids:
+        db.update_record("Harvest", {"Quantity": 5}, {"HarvestID": harvest_id})
+    results["update_per_second"] = len(ids) / (time.perf_counter() - started)
+
+    # The same rows corrected together from the edit grid, in one transaction
+    started = time.perf_counter()
+    versions = db.fetch_data(f"SELECT HarvestID, RowVersion FROM Harvest WHERE HarvestID IN "
+                             f"({', '.join('?' * len(ids))})", ids)
+    db.apply_changes("Harvest", "HarvestID", updates=[(harvest_id, version, {"Quantity": 7})
+                                                       for harvest_id, version in versions])
+    results["grid_update_per_second"] = len(ids) / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for harvest_id in ids:
+        db.delete_record("Harvest", {"HarvestID": harvest_id})
+    results["delete_per_second"] = len(ids) / (time.perf_counter() - started)
+
+    # Many sessions submitting forms at once, which the writer thread batches
+    def session(index):
+        for _ in range(operations // WRITER_SESSIONS):
+            db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-06-01", "Quantity": index + 1})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(WRITER_SESSIONS) as executor:
+        list(executor.map(session, range(WRITER_SESSIONS)))
+    written = operations // WRITER_SESSIONS * WRITER_SESSIONS
+    results["concurrent_add_per_second"] = written / (time.perf_counter() - started)
+    return results
+
+
+def dataframe_benchmark(rows=DATAFRAME_ROWS, repeats=REPEATS):
+    query = "SELECT * FROM Harvest ORDER BY HarvestID LIMIT ?"
+    data = db.fetch_data(query, (rows,))
+    return {
+        "fetch": _time(lambda: db.fetch_data(query, (rows,)), repeats),
+        "construct": _time(lambda: pd.DataFrame(data, columns=["HarvestID", "CropID", "PlotID", "HarvestDate",
+                                                               "Quantity", "RowVersion"]), repeats, cached=True),
+        "columnar_fetch": _time(lambda: columnar.fetch_frame(query, (rows,)), repeats),
+        "rows": len(data),
+    }
+
+
+def analytics_benchmark(repeats=REPEATS):
+    sources = analytics.load_sources()
+    return {
+        "load": _time(analytics.load_sources, repeats),
+        "compute": _time(lambda: analytics.compute(*sources), repeats, cached=True),
+        "harvests": len(sources[0]),
+    }
+
+
+# A harvest sheet imported once invalid rows are skipped and once all or
+# nothing, into the benchmark database's already filled Harvest table
+def import_benchmark(workdir, rows=IMPORT_ROWS, seed=0):
+    crops = [row[0] for row in db.fetch_data("SELECT CropID FROM Crop")]
+    plots = [row[0] for row in db.fetch_data("SELECT PlotID FROM Plot")]
+    rng = np.random.default_rng(seed)
+    days = np.datetime64("2020-01-01") + rng.integers(0, 1800, rows).astype("timedelta64[D]")
+    path = os.path.join(workdir, f"farm_bench_import_{rows}.csv")
+    pd.DataFrame({"CropID": rng.choice(crops, rows), "PlotID": rng.choice(plots, rows),
+                  "HarvestDate": np.datetime_as_string(days), "Quantity": rng.integers(1, 500, rows)}
+                 ).to_csv(path, index=False)
+    try:
+        return {on_error: {key: bulk_import.import_file(path, "Harvest", on_error=on_error)[key]
+                           for key in ("rows_inserted", "seconds", "rows_per_second")}
+                for on_error in ("skip", "abort")}
+    finally:
+        os.remove(path)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Field devices posting harvest batches to a local API server, started as its
+# own process on the benchmark database
+def api_benchmark(db_path, clients=API_CLIENTS, batches=API_BATCHES, batch_rows=API_BATCH_ROWS):
+    crop_id, plot_id = db.fetch_data("SELECT (SELECT MIN(CropID) FROM Crop), (SELECT MIN(PlotID) FROM Plot)")[0]
+    body = json.dumps([{"CropID": crop_id, "PlotID": plot_id, "HarvestDate": "2024-06-01", "Quantity": index + 1}
+                       for index in range(batch_rows)])
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/api/Harvest"
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py"),
+                               "--port", str(port), "--database", db_path], stdout=subprocess.DEVNULL)
+    try:
+        client = HTTPClient()
+        for _ in range(100):
+            try:
+                client.fetch(f"http://127.0.0.1:{port}/api/health")
+                break
+            except (ConnectionError, HTTPClientError):
+                time.sleep(0.1)
+        client.close()
+
+        latencies = []
+
+        async def device():
+            http = AsyncHTTPClient()
+            for _ in range(batches):
+                started = time.perf_counter()
+                await http.fetch(url, method="POST", body=body, request_timeout=60)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        async def run():
+            AsyncHTTPClient.configure(None, max_clients=clients)
+            await asyncio.gather(*(device() for _ in range(clients)))
+
+        started = time.perf_counter()
+        IOLoop.current().run_sync(run)
+        seconds = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    return {"clients": clients, "requests": len(latencies), "batch_rows": batch_rows,
+            "rows_per_second": len(latencies) * batch_rows / seconds,
+            "requests_per_second": len(latencies) / seconds,
+            "median_ms": statistics.median(latencies), "p95_ms": latencies[int(len(latencies) * 0.95) - 1]}
+
+
+def run_scale(total_rows, workdir, repeats=REPEATS, seed=0, keep=False):
+    db_path = os.path.join(workdir, f"farm_bench_{total_rows}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    started = time.perf_counter()
+    counts = create_synthetic_database(db_path, total_rows, seed)
+    generate_seconds = time.perf_counter() - started
+
+    previous_path = db.DB_PATH
+    db.close_connections()
+    db.DB_PATH = db_path
+    try:
+        result = {
+            "scale": total_rows,
+            "rows": counts,
+            "generate_seconds": generate_seconds,
+            "database_bytes": os.path.getsize(db_path),
+            "queries": {name: _time(function, repeats) for name, function in page_benchmarks().items()},
+            "cache_hit": _time(lambda: db.fetch_data("SELECT COUNT(*) FROM Harvest"), repeats, cached=True),
+            "dataframe": dataframe_benchmark(repeats=repeats),
+            "analytics": analytics_benchmark(repeats),
+            "crud": crud_benchmark(),
+            "import": import_benchmark(workdir),
+            "api": api_benchmark(db_path),
+        }
+    finally:
+        db.close_connections()
+        db.DB_PATH = previous_path
+        if not keep:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark FarmFlow queries on synthetic databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--workdir", default=tempfile.gettempdir())
+    parser.add_argument("--keep", action="store_true", help="keep the generated databases")
+    parser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": [run_scale(scale, args.workdir, args.repeats, keep=args.keep) for scale in args.scales],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
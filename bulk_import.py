@@ -0,0 +1,254 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import db
+from database_setup import ROLLUP_BATCH_REFRESH, defer_rollups, refresh_deferred_rollups
+
+CHUNK_SIZE = 65536        # rows validated and inserted per batch
+MAX_REPORTED_ERRORS = 20
+
+_imports = itertools.count(1)   # numbers the staging tables of concurrent imports
+
+# Column types and foreign keys for the tables that accept bulk imports. Each
+# chunk is sorted on sort_by before inserting so the secondary indexes are
+# appended to in order instead of being updated at random positions.
+IMPORT_TABLES = {
+    "Harvest": {
+        "columns": {"CropID": "int", "PlotID": "int", "HarvestDate": "date", "Quantity": "int"},
+        "foreign_keys": {"CropID": ("Crop", "CropID"), "PlotID": ("Plot", "PlotID")},
+        "sort_by": ["HarvestDate", "CropID"],
+    },
+    "MarketInfo": {
+        "columns": {"CropID": "int", "MarketDate": "date", "PricePerUnit": "float"},
+        "foreign_keys": {"CropID": ("Crop", "CropID")},
+        "sort_by": ["MarketDate", "CropID"],
+    },
+    "FinancialRecord": {
+        "columns": {"RecordDate": "date", "Income": "float", "Expenses": "float"},
+        "foreign_keys": {},
+        "sort_by": ["RecordDate"],
+    },
+    "InventoryUsage": {
+        "columns": {"InventoryID": "int", "UsageDate": "date", "QuantityUsed": "int"},
+        "foreign_keys": {"InventoryID": ("Inventory", "InventoryID")},
+        "sort_by": ["UsageDate", "InventoryID"],
+    },
+}
+
+
+def _detect_format(source, file_format):
+    if file_format:
+        return file_format
+    name = source if isinstance(source, str) else getattr(source, "name", "")
+    return "parquet" if str(name).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def _iter_batches(source, file_format, columns, chunk_size, malformed_rows):
+    # Stream the file in record batches; only one chunk is held in memory at a time
+    if file_format == "parquet":
+        parquet_file = pq.ParquetFile(source)
+        yield parquet_file.metadata.num_rows
+        yield from parquet_file.iter_batches(batch_size=chunk_size, columns=columns)
+    else:
+        yield None
+
+        def skip_row(row):
+            malformed_rows.append(row)
+            return "skip"
+
+        read_options = pa_csv.ReadOptions(block_size=chunk_size * 64)
+        parse_options = pa_csv.ParseOptions(invalid_row_handler=skip_row)
+        convert_options = pa_csv.ConvertOptions(include_columns=columns,
+                                                column_types={col: "string" for col in columns})
+        # A block holds chunk_size rows only if they average 64 bytes, so
+        # blocks are cut back to chunk_size; each chunk is one write request
+        for batch in pa_csv.open_csv(source, read_options=read_options, parse_options=parse_options,
+                                     convert_options=convert_options):
+            for offset in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(offset, chunk_size)
+
+
+def _load_keys(conn, foreign_keys):
+    return {column: np.array([row[0] for row in conn.execute(f"SELECT {key} FROM {table}")], dtype=np.int64)
+            for column, (table, key) in foreign_keys.items()}
+
+
+# Vectorized validation of one chunk. Returns the clean frame and a boolean
+# mask of rejected rows with the reason for the first failing check.
+def validate_chunk(df, spec, valid_keys):
+    clean = pd.DataFrame(index=df.index)
+    reasons = pd.Series(None, index=df.index, dtype=object)
+    for column, kind in spec["columns"].items():
+        values = df[column]
+        if kind == "date":
+            parsed = pd.to_datetime(values, format="ISO8601", errors="coerce")
+            bad = parsed.isna()
+            clean[column] = np.datetime_as_string(parsed.to_numpy().astype("datetime64[D]"))
+        else:
+            try:
+                # Several times faster than to_numeric, which is kept for
+                # chunks with values that are not numbers
+                parsed = values.astype(np.float64)
+            except (TypeError, ValueError):
+                parsed = pd.to_numeric(values, errors="coerce")
+            bad = ~np.isfinite(parsed) | (parsed < 0)
+            if kind == "int":
+                bad |= parsed.notna() & (parsed != np.floor(parsed))
+                clean[column] = parsed.where(~bad, 0).astype(np.int64)
+            else:
+                clean[column] = parsed.astype(np.float64)
+        reasons = reasons.mask(bad & reasons.isna(), f"invalid {column}")
+    for column, keys in valid_keys.items():
+        missing = ~clean[column].isin(keys)
+        reasons = reasons.mask(missing & reasons.isna(), f"unknown {column}")
+    rejected = reasons.notna()
+    return clean[~rejected], rejected, reasons
+
+
+# Move the rows staged in temp.staging into table, with the rollups and
+# change log brought up to date in a few set statements (see defer_rollups)
+def _move_staged(conn, table, staging, column_list):
+    deferred = defer_rollups(conn, table) if table in ROLLUP_BATCH_REFRESH else None
+    moved = conn.execute(f"INSERT INTO main.{table} ({column_list}) "
+                         f"SELECT {column_list} FROM temp.{staging} ORDER BY rowid").rowcount
+    if deferred is not None:
+        refresh_deferred_rollups(conn, table, deferred)
+    conn.execute(f"DROP TABLE temp.{staging}")
+    return moved
+
+
+# Stream a CSV or Parquet file into one of IMPORT_TABLES. Rows that fail
+# validation are skipped and counted in the returned report. Each chunk is
+# one request to the writer thread, committed on its own, so form writes get
+# in between chunks instead of waiting out the import. With on_error="abort"
+# the chunks are staged in a temporary table on the writer's connection and
+# moved into the table by one last request, so an invalid row raises
+# ValueError with nothing imported. progress is called after every chunk
+# with the running report and, when it can be known, the fraction done.
+def import_file(source, table, file_format=None, chunk_size=CHUNK_SIZE, progress=None, on_error="skip"):
+    spec = IMPORT_TABLES.get(table)
+    if spec is None:
+        raise ValueError(f"Bulk import is not supported for table {table}")
+    columns = list(spec["columns"])
+    file_format = _detect_format(source, file_format)
+    source_size = getattr(source, "size", None)
+    if source_size is None and isinstance(source, str):
+        source_size = os.path.getsize(source)
+    db_path = db.current_path()
+    # Rows are staged in memory (temp_store=MEMORY) on the writer's connection,
+    # the only one that sees them; an executemany into an unindexed temporary
+    # table plus one INSERT ... SELECT is faster than inserting row by row
+    staging = f"import_{table.lower()}_{next(_imports)}"
+    column_list = ", ".join(columns)
+    stage = f"INSERT INTO temp.{staging} ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+
+    def load(rows):
+        def write(conn):
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ({column_list})")
+            conn.executemany(stage, rows)
+            if on_error != "abort":
+                return _move_staged(conn, table, staging, column_list)
+            return len(rows)
+        return db.submit_write(table, write, (), db_path)
+
+    report = {"table": table, "rows_read": 0, "rows_inserted": 0, "rows_rejected": 0, "errors": [],
+              "seconds": 0.0, "rows_per_second": 0.0}
+    started = time.perf_counter()
+    malformed_rows = []
+    batches = _iter_batches(source, file_format, columns, chunk_size, malformed_rows)
+    total_rows = next(batches)
+
+    with db.get_connection(db_path) as conn:
+        valid_keys = _load_keys(conn, spec["foreign_keys"])
+    # The next chunk is validated while the writer inserts the previous one
+    pending = None
+    staged = 0
+    try:
+        for batch in batches:
+            df = batch.to_pandas()
+            missing_columns = [col for col in columns if col not in df.columns]
+            if missing_columns:
+                raise ValueError(f"Missing columns: {', '.join(missing_columns)}")
+            df.index += report["rows_read"]
+            clean, rejected, reasons = validate_chunk(df, spec, valid_keys)
+            if rejected.any():
+                if on_error == "abort":
+                    first = reasons[rejected].index[0]
+                    raise ValueError(f"Row {first + 1}: {reasons[first]}")
+                room = MAX_REPORTED_ERRORS - len(report["errors"])
+                for row_number, reason in reasons[rejected].head(max(room, 0)).items():
+                    report["errors"].append({"row": int(row_number) + 1, "error": reason})
+
+            clean = clean.sort_values(spec["sort_by"], kind="stable")
+            rows = list(zip(*(clean[col].tolist() for col in columns)))
+            if pending is not None:
+                staged += pending.result()
+            pending = load(rows) if rows else None
+
+            report["rows_read"] += len(df)
+            if on_error != "abort":
+                report["rows_inserted"] = staged
+            report["rows_rejected"] += int(rejected.sum())
+            if malformed_rows:
+                # Rows the CSV parser could not split into the expected columns
+                if on_error == "abort":
+                    raise ValueError(f"Malformed row: {malformed_rows[0].text}")
+                report["rows_read"] += len(malformed_rows)
+                report["rows_rejected"] += len(malformed_rows)
+                for row in malformed_rows[:max(MAX_REPORTED_ERRORS - len(report["errors"]), 0)]:
+                    # row.number counts the header line
+                    row_number = row.number - 1 if row.number else None
+                    report["errors"].append({"row": row_number, "error": "malformed row"})
+                malformed_rows.clear()
+            if progress is not None:
+                if total_rows:
+                    fraction = report["rows_read"] / total_rows
+                elif source_size and hasattr(source, "tell"):
+                    fraction = source.tell() / source_size
+                else:
+                    fraction = None
+                progress(report, None if fraction is None else min(fraction, 1.0))
+        if pending is not None:
+            staged += pending.result()
+            pending = None
+        if on_error == "abort" and staged:
+            staged = db.submit_write(table, lambda conn: _move_staged(conn, table, staging, column_list), (),
+                                     db_path).result()
+        report["rows_inserted"] = staged
+    finally:
+        if pending is not None:
+            pending.exception()
+        if on_error == "abort":
+            # Gone already if the rows were moved
+            db.submit_write(table, f"DROP TABLE IF EXISTS temp.{staging}", (), db_path).exception()
+
+    report["seconds"] = time.perf_counter() - started
+    report["rows_per_second"] = report["rows_inserted"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import a CSV or Parquet file into FarmFlow")
+    parser.add_argument("table", choices=sorted(IMPORT_TABLES))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "parquet"])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--abort-on-error", action="store_true", help="import nothing if any row is invalid")
+    args = parser.parse_args(argv)
+
+    report = import_file(args.path, args.table, args.format, args.chunk_size,
+                         on_error="abort" if args.abort_on_error else "skip")
+    print(f"Imported {report['rows_inserted']:,} of {report['rows_read']:,} rows into {args.table} "
+          f"in {report['seconds']:.2f}s ({report['rows_per_second']:,.0f} rows/s)")
+    for error in report["errors"]:
+        print(f"  row {error['row']}: {error['error']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
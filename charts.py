@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from columnar import fetch_frame
+
+MAX_POINTS = 1000  # points per series sent to the browser
+
+GRANULARITIES = ["Daily", "Weekly", "Monthly", "Yearly"]
+
+# Income and expenses per period, read from the trigger-maintained summaries:
+# daily and weekly from DailyFinancialSummary, monthly and yearly from
+# MonthlyFinancialSummary, so no query touches FinancialRecord itself
+FINANCE_QUERIES = {
+    "Daily": """
+        SELECT Day AS Period, TotalIncome, TotalExpenses FROM DailyFinancialSummary
+        WHERE Day BETWEEN ? AND ? ORDER BY Day
+    """,
+    "Weekly": """
+        SELECT date(Day, '-6 days', 'weekday 1') AS Period, SUM(TotalIncome) AS TotalIncome,
+               SUM(TotalExpenses) AS TotalExpenses
+        FROM DailyFinancialSummary
+        WHERE Day BETWEEN ? AND ? GROUP BY Period ORDER BY Period
+    """,
+    "Monthly": """
+        SELECT Month || '-01' AS Period, TotalIncome, TotalExpenses FROM MonthlyFinancialSummary
+        WHERE Month BETWEEN substr(?, 1, 7) AND substr(?, 1, 7) ORDER BY Month
+    """,
+    "Yearly": """
+        SELECT substr(Month, 1, 4) || '-01-01' AS Period, SUM(TotalIncome) AS TotalIncome,
+               SUM(TotalExpenses) AS TotalExpenses
+        FROM MonthlyFinancialSummary
+        WHERE Month BETWEEN substr(?, 1, 7) AND substr(?, 1, 7) GROUP BY Period ORDER BY Period
+    """,
+}
+
+HARVEST_QUERIES = {
+    "Monthly": """
+        SELECT s.Month || '-01' AS Period, c.Name AS Crop, SUM(s.TotalQuantity) AS TotalQuantity
+        FROM MonthlyHarvestSummary s JOIN Crop c ON c.CropID = s.CropID
+        WHERE s.Month BETWEEN substr(?, 1, 7) AND substr(?, 1, 7)
+        GROUP BY Period, c.Name ORDER BY Period, c.Name
+    """,
+    "Yearly": """
+        SELECT substr(s.Month, 1, 4) || '-01-01' AS Period, c.Name AS Crop, SUM(s.TotalQuantity) AS TotalQuantity
+        FROM MonthlyHarvestSummary s JOIN Crop c ON c.CropID = s.CropID
+        WHERE s.Month BETWEEN substr(?, 1, 7) AND substr(?, 1, 7)
+        GROUP BY Period, c.Name ORDER BY Period, c.Name
+    """,
+}
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, from
+    # each bucket in between, the point forming the largest triangle with the
+    # point kept before it and the average of the next bucket. Returns indices.
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return indices
+
+
+def downsample(df, x, columns, max_points=MAX_POINTS):
+    # Long-form (x, Series, Value) rows, each series reduced with LTTB on its own
+    positions = df[x].astype("int64").to_numpy() if np.issubdtype(df[x].dtype, np.datetime64) \
+        else np.arange(len(df))
+    frames = []
+    for column in columns:
+        values = df[column].fillna(0).to_numpy(dtype=float)
+        keep = lttb(positions, values, max_points)
+        frames.append(pd.DataFrame({x: df[x].to_numpy()[keep], "Series": column, "Value": values[keep]}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _periods(df):
+    if not df.empty:
+        df["Period"] = pd.to_datetime(df["Period"])
+    return df
+
+
+def finance_series(granularity, start, end):
+    return _periods(fetch_frame(FINANCE_QUERIES[granularity], (start.isoformat(), end.isoformat())))
+
+
+def harvest_series(granularity, start, end):
+    return _periods(fetch_frame(HARVEST_QUERIES[granularity], (start.isoformat(), end.isoformat())))
+
+
+def report_date_bounds():
+    # First and last day covered by the finance and harvest summaries
+    row = fetch_frame("""
+        SELECT MIN(Day) AS First, MAX(Day) AS Last FROM (
+            SELECT MIN(Day) AS Day FROM DailyFinancialSummary WHERE Day <> 'Unknown'
+            UNION ALL SELECT MAX(Day) FROM DailyFinancialSummary WHERE Day <> 'Unknown'
+            UNION ALL SELECT MIN(Month) || '-01' FROM MonthlyHarvestSummary WHERE Month <> 'Unknown'
+            UNION ALL SELECT date(MAX(Month) || '-01', '+1 month', '-1 day') FROM MonthlyHarvestSummary
+            WHERE Month <> 'Unknown')
+    """)
+    if pd.isna(row["First"].iloc[0]):
+        return None
+    return pd.Timestamp(row["First"].iloc[0]).date(), pd.Timestamp(row["Last"].iloc[0]).date()
@@ -0,0 +1,102 @@
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import db
+import diagnostics
+import query_cache
+
+BATCH_SIZE = 50000          # rows converted to Arrow at a time
+DICTIONARY_RATIO = 0.5      # dictionary-encode text with fewer distinct values than this share of rows
+
+_ISO_DATE = r"^\d{4}-\d{2}-\d{2}$"
+
+
+def _to_array(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # SQLite columns may mix types; fall back to text
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def _combine(chunks):
+    # Batches can infer different types for one column (all NULL, or integers
+    # in one batch and reals in the next), so settle on one before combining
+    types = {chunk.type for chunk in chunks if not pa.types.is_null(chunk.type)}
+    if not types:
+        target = pa.string()
+    elif len(types) == 1:
+        target = types.pop()
+    elif all(pa.types.is_integer(kind) or pa.types.is_floating(kind) for kind in types):
+        target = pa.float64()
+    else:
+        target = pa.string()
+    converted = []
+    for chunk in chunks:
+        if chunk.type == target:
+            converted.append(chunk)
+        elif target == pa.string() and not pa.types.is_null(chunk.type):
+            converted.append(pa.array([None if value is None else str(value) for value in chunk.to_pylist()],
+                                      type=pa.string()))
+        else:
+            converted.append(chunk.cast(target))
+    return pa.chunked_array(converted, type=target)
+
+
+def _finish(column):
+    # Text columns holding ISO dates become timestamps, parsed once here;
+    # text with many repeats (Type, Role, crop names) is dictionary-encoded
+    if not pa.types.is_string(column.type) or len(column) == 0:
+        return column
+    values = column.drop_null()
+    if len(values) and pc.all(pc.match_substring_regex(values, _ISO_DATE)).as_py():
+        # A value shaped like a date that is not one stays text for the whole
+        # column, so nothing else is shown than what is stored: 2024-13-05
+        # fails to parse and 2024-02-30 would become 2024-03-01
+        parsed = pc.strptime(column, format="%Y-%m-%d", unit="s", error_is_null=True)
+        if parsed.null_count == column.null_count and pc.all(
+                pc.equal(pc.day(parsed), pc.cast(pc.utf8_slice_codeunits(column, 8, 10), pa.int64()))).as_py():
+            return parsed
+    if pc.count_distinct(values).as_py() <= len(column) * DICTIONARY_RATIO:
+        return pc.dictionary_encode(column)
+    return column
+
+
+# Read a query into an Arrow table batch by batch, with the column names from
+# the cursor
+def read_table(conn, query, params=(), batch_size=BATCH_SIZE):
+    cursor = conn.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    chunks = [[] for _ in names]
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for column_chunks, values in zip(chunks, zip(*rows)):
+            column_chunks.append(_to_array(values))
+    return pa.table([_finish(_combine(column_chunks)) for column_chunks in chunks], names=names)
+
+
+# read_table on the current database, with results cached like fetch_data's
+def fetch_table(query, params=(), batch_size=BATCH_SIZE):
+    started = time.perf_counter() if diagnostics.enabled else None
+    db_path = db.current_path()
+    db.check_external_writes(db_path)
+    key, table = query_cache.get(db_path, query, params, kind="arrow")
+    if table is not None:
+        if started is not None:
+            diagnostics.record("read", query, started, table.num_rows, cached=True)
+        return table
+    tables = query_cache.tables_in(query)
+    versions = query_cache.table_versions(db_path, tables)
+    with db.get_connection(db_path) as conn:
+        table = read_table(conn, query, params, batch_size)
+        if started is not None:
+            diagnostics.record("read", query, started, table.num_rows, conn=conn, params=params)
+    query_cache.put(key, tables, versions, table)
+    return table
+
+
+def fetch_frame(query, params=(), batch_size=BATCH_SIZE):
+    # Dictionary columns arrive in pandas as categoricals, timestamps as datetime64
+    return fetch_table(query, params, batch_size).to_pandas()
@@ -1,10 +1,7 @@
+import re
 import sqlite3
 
-def create_database():
-    conn = sqlite3.connect('farm_management.db')
-    cursor = conn.cursor()
-
-    # Create tables
+def create_tables(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS Crop (
         CropID INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -130,11 +127,795 @@ def create_database():
     )
     ''')
 
-    # Insert initial data
+
+def create_indexes(cursor):
+    # Secondary indexes for the foreign keys and date columns the pages filter on
+    cursor.executescript('''
+    CREATE INDEX IF NOT EXISTS idx_crop_name ON Crop (Name COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_harvest_crop_date ON Harvest (CropID, HarvestDate);
+    CREATE INDEX IF NOT EXISTS idx_harvest_plot_date ON Harvest (PlotID, HarvestDate);
+    CREATE INDEX IF NOT EXISTS idx_harvest_date ON Harvest (HarvestDate);
+    CREATE INDEX IF NOT EXISTS idx_marketinfo_crop_date ON MarketInfo (CropID, MarketDate);
+    CREATE INDEX IF NOT EXISTS idx_marketinfo_date ON MarketInfo (MarketDate);
+    CREATE INDEX IF NOT EXISTS idx_financialrecord_date ON FinancialRecord (RecordDate);
+    CREATE INDEX IF NOT EXISTS idx_planting_crop_date ON Planting (CropID, PlantingDate);
+    CREATE INDEX IF NOT EXISTS idx_planting_plot_date ON Planting (PlotID, PlantingDate);
+    CREATE INDEX IF NOT EXISTS idx_task_employee_date ON Task (EmployeeID, TaskDate);
+    CREATE INDEX IF NOT EXISTS idx_task_plot_date ON Task (PlotID, TaskDate);
+    CREATE INDEX IF NOT EXISTS idx_inventoryusage_item_date ON InventoryUsage (InventoryID, UsageDate);
+    CREATE INDEX IF NOT EXISTS idx_pestcontrol_plot_date ON PestControl (PlotID, ControlDate);
+    CREATE INDEX IF NOT EXISTS idx_monthlycropproduction_crop_month ON MonthlyCropProduction (CropID, ProductionMonth);
+    ''')
+
+
+# Summary and search tables derived from a source table by triggers; cached
+# reads of them must be invalidated together with the source table
+DERIVED_TABLES = {
+    'FinancialRecord': ['MonthlyFinancialSummary', 'DailyFinancialSummary'],
+    'Harvest': ['MonthlyHarvestSummary', 'HarvestValuation', 'MonthlyRevenueSummary'],
+    'MarketInfo': ['HarvestValuation', 'MonthlyRevenueSummary'],
+    'Crop': ['CropSearch'],
+    'Inventory': ['InventorySearch', 'InventoryBalance', 'InventoryStock'],
+    'InventoryUsage': ['InventoryBalance', 'InventoryStock'],
+    'Employee': ['EmployeeSearch'],
+}
+
+# FTS5 indexes over the searchable text columns: table -> (search table, key, columns)
+SEARCH_TABLES = {
+    'Crop': ('CropSearch', 'CropID', ['Name', 'Type']),
+    'Inventory': ('InventorySearch', 'InventoryID', ['ItemName', 'Type']),
+    'Employee': ('EmployeeSearch', 'EmployeeID', ['FirstName', 'LastName', 'Role']),
+}
+
+
+# Delete triggers skip rows removed while rollups are deferred, which is how
+# archiving moves rows out without taking them out of the summaries. Older
+# databases have versions of them without that check, so those are replaced.
+DEFERRABLE_DELETE_TRIGGERS = [
+    'trg_financialrecord_summary_delete', 'trg_financialrecord_daily_delete', 'trg_harvest_summary_delete',
+    'trg_harvestvaluation_summary_delete', 'trg_harvest_valuation_delete', 'trg_marketinfo_valuation_delete',
+]
+
+
+def drop_outdated_triggers(cursor):
+    placeholders = ', '.join('?' * len(DEFERRABLE_DELETE_TRIGGERS))
+    for name, sql in cursor.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+                                    f"AND name IN ({placeholders})", DEFERRABLE_DELETE_TRIGGERS).fetchall():
+        if 'Deferred' not in sql:
+            cursor.execute(f'DROP TRIGGER {name}')
+
+
+def create_rollups(cursor):
+    # Monthly totals kept up to date by triggers, so reports never re-aggregate history
+    drop_outdated_triggers(cursor)
+    new_tables = cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+        "AND name IN ('MonthlyFinancialSummary', 'MonthlyHarvestSummary', 'DailyFinancialSummary')").fetchone()[0] < 3
+
+    cursor.executescript('''
+    CREATE TABLE IF NOT EXISTS RollupControl (
+        Deferred INTEGER NOT NULL
+    );
+    INSERT INTO RollupControl (Deferred) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM RollupControl);
+
+    CREATE TABLE IF NOT EXISTS MonthlyFinancialSummary (
+        Month TEXT PRIMARY KEY NOT NULL,
+        TotalIncome REAL NOT NULL,
+        TotalExpenses REAL NOT NULL,
+        RecordCount INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS DailyFinancialSummary (
+        Day TEXT PRIMARY KEY NOT NULL,
+        TotalIncome REAL NOT NULL,
+        TotalExpenses REAL NOT NULL,
+        RecordCount INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS MonthlyHarvestSummary (
+        CropID INTEGER NOT NULL,
+        Month TEXT NOT NULL,
+        TotalQuantity INTEGER NOT NULL,
+        HarvestCount INTEGER NOT NULL,
+        PRIMARY KEY (CropID, Month)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_summary_insert AFTER INSERT ON FinancialRecord
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        INSERT INTO MonthlyFinancialSummary (Month, TotalIncome, TotalExpenses, RecordCount)
+        VALUES (COALESCE(strftime('%Y-%m', NEW.RecordDate), 'Unknown'), NEW.Income, NEW.Expenses, 1)
+        ON CONFLICT (Month) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                          TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                          RecordCount = RecordCount + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_summary_delete AFTER DELETE ON FinancialRecord
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        UPDATE MonthlyFinancialSummary
+        SET TotalIncome = TotalIncome - OLD.Income, TotalExpenses = TotalExpenses - OLD.Expenses,
+            RecordCount = RecordCount - 1
+        WHERE Month = COALESCE(strftime('%Y-%m', OLD.RecordDate), 'Unknown');
+        DELETE FROM MonthlyFinancialSummary WHERE RecordCount <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_summary_update
+    AFTER UPDATE OF RecordDate, Income, Expenses ON FinancialRecord
+    BEGIN
+        UPDATE MonthlyFinancialSummary
+        SET TotalIncome = TotalIncome - OLD.Income, TotalExpenses = TotalExpenses - OLD.Expenses,
+            RecordCount = RecordCount - 1
+        WHERE Month = COALESCE(strftime('%Y-%m', OLD.RecordDate), 'Unknown');
+        DELETE FROM MonthlyFinancialSummary WHERE RecordCount <= 0;
+        INSERT INTO MonthlyFinancialSummary (Month, TotalIncome, TotalExpenses, RecordCount)
+        VALUES (COALESCE(strftime('%Y-%m', NEW.RecordDate), 'Unknown'), NEW.Income, NEW.Expenses, 1)
+        ON CONFLICT (Month) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                          TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                          RecordCount = RecordCount + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_daily_insert AFTER INSERT ON FinancialRecord
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        INSERT INTO DailyFinancialSummary (Day, TotalIncome, TotalExpenses, RecordCount)
+        VALUES (COALESCE(date(NEW.RecordDate), 'Unknown'), NEW.Income, NEW.Expenses, 1)
+        ON CONFLICT (Day) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                        TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                        RecordCount = RecordCount + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_daily_delete AFTER DELETE ON FinancialRecord
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        UPDATE DailyFinancialSummary
+        SET TotalIncome = TotalIncome - OLD.Income, TotalExpenses = TotalExpenses - OLD.Expenses,
+            RecordCount = RecordCount - 1
+        WHERE Day = COALESCE(date(OLD.RecordDate), 'Unknown');
+        DELETE FROM DailyFinancialSummary WHERE RecordCount <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_financialrecord_daily_update
+    AFTER UPDATE OF RecordDate, Income, Expenses ON FinancialRecord
+    BEGIN
+        UPDATE DailyFinancialSummary
+        SET TotalIncome = TotalIncome - OLD.Income, TotalExpenses = TotalExpenses - OLD.Expenses,
+            RecordCount = RecordCount - 1
+        WHERE Day = COALESCE(date(OLD.RecordDate), 'Unknown');
+        DELETE FROM DailyFinancialSummary WHERE RecordCount <= 0;
+        INSERT INTO DailyFinancialSummary (Day, TotalIncome, TotalExpenses, RecordCount)
+        VALUES (COALESCE(date(NEW.RecordDate), 'Unknown'), NEW.Income, NEW.Expenses, 1)
+        ON CONFLICT (Day) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                        TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                        RecordCount = RecordCount + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_summary_insert AFTER INSERT ON Harvest
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        INSERT INTO MonthlyHarvestSummary (CropID, Month, TotalQuantity, HarvestCount)
+        VALUES (NEW.CropID, COALESCE(strftime('%Y-%m', NEW.HarvestDate), 'Unknown'), NEW.Quantity, 1)
+        ON CONFLICT (CropID, Month) DO UPDATE SET TotalQuantity = TotalQuantity + excluded.TotalQuantity,
+                                                  HarvestCount = HarvestCount + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_summary_delete AFTER DELETE ON Harvest
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        UPDATE MonthlyHarvestSummary
+        SET TotalQuantity = TotalQuantity - OLD.Quantity, HarvestCount = HarvestCount - 1
+        WHERE CropID = OLD.CropID AND Month = COALESCE(strftime('%Y-%m', OLD.HarvestDate), 'Unknown');
+        DELETE FROM MonthlyHarvestSummary WHERE HarvestCount <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_summary_update
+    AFTER UPDATE OF CropID, HarvestDate, Quantity ON Harvest
+    BEGIN
+        UPDATE MonthlyHarvestSummary
+        SET TotalQuantity = TotalQuantity - OLD.Quantity, HarvestCount = HarvestCount - 1
+        WHERE CropID = OLD.CropID AND Month = COALESCE(strftime('%Y-%m', OLD.HarvestDate), 'Unknown');
+        DELETE FROM MonthlyHarvestSummary WHERE HarvestCount <= 0;
+        INSERT INTO MonthlyHarvestSummary (CropID, Month, TotalQuantity, HarvestCount)
+        VALUES (NEW.CropID, COALESCE(strftime('%Y-%m', NEW.HarvestDate), 'Unknown'), NEW.Quantity, 1)
+        ON CONFLICT (CropID, Month) DO UPDATE SET TotalQuantity = TotalQuantity + excluded.TotalQuantity,
+                                                  HarvestCount = HarvestCount + 1;
+    END;
+    ''')
+
+    if new_tables:
+        rebuild_rollups(cursor)
+
+
+# Every harvest valued at the latest market price for its crop on or before
+# the harvest date, and monthly revenue per crop and plot built on top of it
+VALUATION_COLUMNS = 'HarvestID, CropID, PlotID, HarvestDate, Quantity, PriceID, PriceDate, Price, Revenue'
+
+PRICE_LOOKUP = '''
+    SELECT MarketInfoID FROM MarketInfo
+    WHERE CropID = {harvest}.CropID AND MarketDate <= {harvest}.HarvestDate
+    ORDER BY MarketDate DESC, MarketInfoID DESC LIMIT 1'''
+
+PRICE_REVALUE = '''
+    SELECT m.MarketInfoID, m.MarketDate, m.PricePerUnit, HarvestValuation.Quantity * m.PricePerUnit
+    FROM MarketInfo m
+    WHERE m.CropID = HarvestValuation.CropID AND m.MarketDate <= HarvestValuation.HarvestDate
+    ORDER BY m.MarketDate DESC, m.MarketInfoID DESC LIMIT 1'''
+
+REVENUE_SUMMARY_INSERT = '''
+    INSERT INTO MonthlyRevenueSummary (CropID, PlotID, Month, Revenue, ValuedQuantity, HarvestCount)
+    SELECT CropID, PlotID, COALESCE(strftime('%Y-%m', HarvestDate), 'Unknown') AS Month, SUM(COALESCE(Revenue, 0)),
+           SUM(CASE WHEN Price IS NULL THEN 0 ELSE Quantity END), COUNT(*)
+    FROM HarvestValuation'''
+
+REVENUE_SUMMARY_UPSERT = '''
+    ON CONFLICT (CropID, PlotID, Month) DO UPDATE SET Revenue = Revenue + excluded.Revenue,
+                                                      ValuedQuantity = ValuedQuantity + excluded.ValuedQuantity,
+                                                      HarvestCount = HarvestCount + excluded.HarvestCount'''
+
+# The crops of the prices inserted after rowid ?1, with their earliest new
+# price date, and the live revenue of the harvests those prices re-value
+REPRICED_CROPS = '''
+    SELECT CropID, MIN(MarketDate) AS Since FROM MarketInfo NOT INDEXED WHERE MarketInfoID > ?1 GROUP BY CropID'''
+
+REPRICED_REVENUE = f'''
+    WITH Changed AS ({REPRICED_CROPS})
+    SELECT v.CropID, v.PlotID, COALESCE(strftime('%Y-%m', v.HarvestDate), 'Unknown') AS Month,
+           SUM(COALESCE(v.Revenue, 0)) AS Revenue, SUM(CASE WHEN v.Price IS NULL THEN 0 ELSE v.Quantity END)
+           AS ValuedQuantity, COUNT(*) AS HarvestCount
+    FROM Changed c JOIN HarvestValuation v ON v.CropID = c.CropID AND v.HarvestDate >= c.Since
+    GROUP BY v.CropID, v.PlotID, Month'''
+
+
+def create_valuations(cursor):
+    new_tables = not cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'HarvestValuation'").fetchone()
+
+    harvest_price = PRICE_LOOKUP.format(harvest='NEW')
+    summary_add = '''
+        INSERT INTO MonthlyRevenueSummary (CropID, PlotID, Month, Revenue, ValuedQuantity, HarvestCount)
+        VALUES (NEW.CropID, NEW.PlotID, COALESCE(strftime('%Y-%m', NEW.HarvestDate), 'Unknown'),
+                COALESCE(NEW.Revenue, 0), CASE WHEN NEW.Price IS NULL THEN 0 ELSE NEW.Quantity END, 1)
+    ''' + REVENUE_SUMMARY_UPSERT + ';'
+    summary_remove = '''
+        UPDATE MonthlyRevenueSummary
+        SET Revenue = Revenue - COALESCE(OLD.Revenue, 0),
+            ValuedQuantity = ValuedQuantity - CASE WHEN OLD.Price IS NULL THEN 0 ELSE OLD.Quantity END,
+            HarvestCount = HarvestCount - 1
+        WHERE CropID = OLD.CropID AND PlotID = OLD.PlotID
+          AND Month = COALESCE(strftime('%Y-%m', OLD.HarvestDate), 'Unknown');
+        DELETE FROM MonthlyRevenueSummary WHERE HarvestCount <= 0;
+    '''
+    harvest_add = f'''
+        INSERT INTO HarvestValuation ({VALUATION_COLUMNS})
+        SELECT NEW.HarvestID, NEW.CropID, NEW.PlotID, NEW.HarvestDate, NEW.Quantity,
+               m.MarketInfoID, m.MarketDate, m.PricePerUnit, NEW.Quantity * m.PricePerUnit
+        FROM (SELECT 1) LEFT JOIN MarketInfo m ON m.MarketInfoID = ({harvest_price});
+    '''
+    # A price takes over the harvests on or after its date that were valued
+    # at an older price (later rows win ties on the same date)
+    price_add = '''
+        UPDATE HarvestValuation
+        SET PriceID = NEW.MarketInfoID, PriceDate = NEW.MarketDate, Price = NEW.PricePerUnit,
+            Revenue = Quantity * NEW.PricePerUnit
+        WHERE CropID = NEW.CropID AND HarvestDate >= NEW.MarketDate
+          AND (PriceID IS NULL OR PriceDate < NEW.MarketDate
+               OR (PriceDate = NEW.MarketDate AND PriceID < NEW.MarketInfoID));
+    '''
+    price_remove = f'''
+        UPDATE HarvestValuation SET (PriceID, PriceDate, Price, Revenue) = ({PRICE_REVALUE})
+        WHERE PriceID = OLD.MarketInfoID;
+    '''
+
+    cursor.executescript(f'''
+    CREATE TABLE IF NOT EXISTS HarvestValuation (
+        HarvestID INTEGER PRIMARY KEY,
+        CropID INTEGER NOT NULL,
+        PlotID INTEGER NOT NULL,
+        HarvestDate DATE,
+        Quantity INTEGER NOT NULL,
+        PriceID INTEGER,
+        PriceDate DATE,
+        Price REAL,
+        Revenue REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_harvestvaluation_crop_date ON HarvestValuation (CropID, HarvestDate);
+    CREATE INDEX IF NOT EXISTS idx_harvestvaluation_price ON HarvestValuation (PriceID);
+
+    CREATE TABLE IF NOT EXISTS MonthlyRevenueSummary (
+        CropID INTEGER NOT NULL,
+        PlotID INTEGER NOT NULL,
+        Month TEXT NOT NULL,
+        Revenue REAL NOT NULL,
+        ValuedQuantity INTEGER NOT NULL,
+        HarvestCount INTEGER NOT NULL,
+        PRIMARY KEY (CropID, PlotID, Month)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvestvaluation_summary_insert AFTER INSERT ON HarvestValuation
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {summary_add}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvestvaluation_summary_delete AFTER DELETE ON HarvestValuation
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {summary_remove}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvestvaluation_summary_update AFTER UPDATE ON HarvestValuation
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {summary_remove}
+        {summary_add}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_valuation_insert AFTER INSERT ON Harvest
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {harvest_add}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_valuation_delete AFTER DELETE ON Harvest
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        DELETE FROM HarvestValuation WHERE HarvestID = OLD.HarvestID;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_harvest_valuation_update
+    AFTER UPDATE OF HarvestID, CropID, PlotID, HarvestDate, Quantity ON Harvest
+    BEGIN
+        DELETE FROM HarvestValuation WHERE HarvestID = OLD.HarvestID;
+        {harvest_add}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_marketinfo_valuation_insert AFTER INSERT ON MarketInfo
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {price_add}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_marketinfo_valuation_delete AFTER DELETE ON MarketInfo
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        {price_remove}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_marketinfo_valuation_update
+    AFTER UPDATE OF MarketInfoID, CropID, MarketDate, PricePerUnit ON MarketInfo
+    BEGIN
+        {price_remove}
+        {price_add}
+    END;
+    ''')
+
+    if new_tables:
+        rebuild_valuations(cursor)
+
+
+def rebuild_valuations(cursor):
+    # Deferred keeps the per-row summary triggers out of the bulk insert; the
+    # savepoint keeps that flag from being committed on its own
+    cursor.executescript(f'''
+    SAVEPOINT rebuild_valuations;
+    UPDATE RollupControl SET Deferred = 1;
+    DELETE FROM HarvestValuation;
+    INSERT INTO HarvestValuation ({VALUATION_COLUMNS})
+    SELECT h.HarvestID, h.CropID, h.PlotID, h.HarvestDate, h.Quantity,
+           m.MarketInfoID, m.MarketDate, m.PricePerUnit, h.Quantity * m.PricePerUnit
+    FROM Harvest h
+    LEFT JOIN MarketInfo m ON m.MarketInfoID = ({PRICE_LOOKUP.format(harvest='h')});
+    DELETE FROM MonthlyRevenueSummary;
+    {REVENUE_SUMMARY_INSERT}
+    GROUP BY CropID, PlotID, Month;
+    UPDATE RollupControl SET Deferred = 0;
+    RELEASE rebuild_valuations;
+    ''')
+
+
+# Bulk loaders switch the insert triggers off inside their own transaction and
+# fold each batch into the summaries with a few grouped statements instead.
+# Other connections never see the triggers missing or Deferred = 1, because
+# neither is ever committed.
+ROLLUP_BATCH_REFRESH = {
+    'FinancialRecord': ['''
+        INSERT INTO MonthlyFinancialSummary (Month, TotalIncome, TotalExpenses, RecordCount)
+        SELECT COALESCE(strftime('%Y-%m', RecordDate), 'Unknown') AS Month, SUM(Income), SUM(Expenses), COUNT(*)
+        FROM FinancialRecord
+        WHERE RecordID > ?
+        GROUP BY Month
+        ON CONFLICT (Month) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                          TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                          RecordCount = RecordCount + excluded.RecordCount
+    ''', '''
+        INSERT INTO DailyFinancialSummary (Day, TotalIncome, TotalExpenses, RecordCount)
+        SELECT COALESCE(date(RecordDate), 'Unknown') AS Day, SUM(Income), SUM(Expenses), COUNT(*)
+        FROM FinancialRecord
+        WHERE RecordID > ?
+        GROUP BY Day
+        ON CONFLICT (Day) DO UPDATE SET TotalIncome = TotalIncome + excluded.TotalIncome,
+                                        TotalExpenses = TotalExpenses + excluded.TotalExpenses,
+                                        RecordCount = RecordCount + excluded.RecordCount
+    '''],
+    'Harvest': ['''
+        INSERT INTO MonthlyHarvestSummary (CropID, Month, TotalQuantity, HarvestCount)
+        SELECT CropID, COALESCE(strftime('%Y-%m', HarvestDate), 'Unknown') AS Month, SUM(Quantity), COUNT(*)
+        FROM Harvest NOT INDEXED
+        WHERE HarvestID > ?
+        GROUP BY CropID, Month
+        ON CONFLICT (CropID, Month) DO UPDATE SET TotalQuantity = TotalQuantity + excluded.TotalQuantity,
+                                                  HarvestCount = HarvestCount + excluded.HarvestCount
+    ''', f'''
+        INSERT INTO HarvestValuation ({VALUATION_COLUMNS})
+        SELECT h.HarvestID, h.CropID, h.PlotID, h.HarvestDate, h.Quantity,
+               m.MarketInfoID, m.MarketDate, m.PricePerUnit, h.Quantity * m.PricePerUnit
+        FROM Harvest h
+        LEFT JOIN MarketInfo m ON m.MarketInfoID = ({PRICE_LOOKUP.format(harvest='h')})
+        WHERE h.HarvestID > ?
+    ''', f'''
+        {REVENUE_SUMMARY_INSERT} NOT INDEXED
+        WHERE HarvestID > ?
+        GROUP BY CropID, PlotID, Month
+        {REVENUE_SUMMARY_UPSERT}
+    '''],
+    # New prices re-value the harvests of their crops from their earliest date
+    # on. Their old revenue is taken out of the summary and the new added, so
+    # months whose harvests have been archived keep their totals.
+    'MarketInfo': [f'''
+        WITH Old AS ({REPRICED_REVENUE})
+        UPDATE MonthlyRevenueSummary
+        SET Revenue = MonthlyRevenueSummary.Revenue - Old.Revenue,
+            ValuedQuantity = MonthlyRevenueSummary.ValuedQuantity - Old.ValuedQuantity
+        FROM Old
+        WHERE MonthlyRevenueSummary.CropID = Old.CropID AND MonthlyRevenueSummary.PlotID = Old.PlotID
+          AND MonthlyRevenueSummary.Month = Old.Month
+    ''', f'''
+        WITH Changed AS ({REPRICED_CROPS})
+        UPDATE HarvestValuation
+        SET (PriceID, PriceDate, Price, Revenue) = ({PRICE_REVALUE})
+        WHERE HarvestID IN (SELECT v.HarvestID FROM Changed c
+                            JOIN HarvestValuation v ON v.CropID = c.CropID AND v.HarvestDate >= c.Since)
+    ''', f'''
+        INSERT INTO MonthlyRevenueSummary (CropID, PlotID, Month, Revenue, ValuedQuantity, HarvestCount)
+        SELECT * FROM ({REPRICED_REVENUE}) WHERE true
+        ON CONFLICT (CropID, PlotID, Month) DO UPDATE SET Revenue = Revenue + excluded.Revenue,
+                                                          ValuedQuantity = ValuedQuantity + excluded.ValuedQuantity
+    '''],
+    'InventoryUsage': ['''
+        INSERT INTO InventoryBalance (InventoryID, Received, Used, Balance, UsageCount, FirstUsage, LastUsage)
+        SELECT InventoryID, 0, SUM(QuantityUsed), -SUM(QuantityUsed), COUNT(*), MIN(UsageDate), MAX(UsageDate)
+        FROM InventoryUsage NOT INDEXED
+        WHERE UsageID > ?
+        GROUP BY InventoryID
+        ON CONFLICT (InventoryID) DO UPDATE SET Used = Used + excluded.Used, Balance = Balance + excluded.Balance,
+            UsageCount = UsageCount + excluded.UsageCount,
+            FirstUsage = MIN(COALESCE(FirstUsage, excluded.FirstUsage), excluded.FirstUsage),
+            LastUsage = MAX(COALESCE(LastUsage, excluded.LastUsage), excluded.LastUsage)
+    '''],
+}
+
+
+# The insert triggers on table and the tables derived from it are dropped
+# for the load rather than skipped by their Deferred check, which would still
+# cost a RollupControl lookup per row, and recreated before the commit.
+# Deferred stays set for the update triggers the batch refresh sets off.
+def defer_rollups(cursor, table):
+    # Call at the start of a write transaction; returns what refresh_deferred_rollups needs
+    cursor.execute('UPDATE RollupControl SET Deferred = 1')
+    names = [table] + DERIVED_TABLES.get(table, [])
+    triggers = [(name, sql) for name, target, sql in cursor.execute(
+                    "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+                if target in names and re.search(r'\bAFTER\s+INSERT\s+ON\b', sql, re.IGNORECASE)]
+    for name, sql in triggers:
+        cursor.execute(f'DROP TRIGGER {name}')
+    after_rowid = cursor.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+    return after_rowid, triggers
+
+
+def refresh_deferred_rollups(cursor, table, deferred):
+    # Call before committing: adds every row inserted since defer_rollups
+    after_rowid, triggers = deferred
+    for statement in ROLLUP_BATCH_REFRESH[table]:
+        cursor.execute(statement, (after_rowid,))
+    if table in CHANGE_TABLES:
+        key = CHANGE_TABLES[table]
+        cursor.execute(f"INSERT INTO ChangeLog (TableName, RowID, Operation) SELECT '{table}', {key}, 'I' "
+                       f"FROM {table} WHERE {key} > ? ORDER BY {key}", (after_rowid,))
+    for name, sql in triggers:
+        cursor.execute(sql)
+    cursor.execute('UPDATE RollupControl SET Deferred = 0')
+
+
+def rebuild_rollups(cursor):
+    # Recompute the summaries from scratch, e.g. for a database that predates them
+    cursor.executescript('''
+    DELETE FROM MonthlyFinancialSummary;
+    INSERT INTO MonthlyFinancialSummary (Month, TotalIncome, TotalExpenses, RecordCount)
+    SELECT COALESCE(strftime('%Y-%m', RecordDate), 'Unknown') AS Month, SUM(Income), SUM(Expenses), COUNT(*)
+    FROM FinancialRecord
+    GROUP BY Month;
+
+    DELETE FROM DailyFinancialSummary;
+    INSERT INTO DailyFinancialSummary (Day, TotalIncome, TotalExpenses, RecordCount)
+    SELECT COALESCE(date(RecordDate), 'Unknown') AS Day, SUM(Income), SUM(Expenses), COUNT(*)
+    FROM FinancialRecord
+    GROUP BY Day;
+
+    DELETE FROM MonthlyHarvestSummary;
+    INSERT INTO MonthlyHarvestSummary (CropID, Month, TotalQuantity, HarvestCount)
+    SELECT CropID, COALESCE(strftime('%Y-%m', HarvestDate), 'Unknown') AS Month, SUM(Quantity), COUNT(*)
+    FROM Harvest
+    GROUP BY CropID, Month;
+    ''')
+
+
+def create_ledger(cursor):
+    # Running stock per inventory item: Inventory.Quantity is what was received
+    # and every InventoryUsage row is drawn from it. Triggers keep one balance
+    # row per item, so stock, burn rate and depletion are single-row lookups.
+    new_table = not cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'InventoryBalance'").fetchone()
+
+    cursor.executescript('''
+    CREATE TABLE IF NOT EXISTS InventoryBalance (
+        InventoryID INTEGER PRIMARY KEY,
+        Received INTEGER NOT NULL,
+        Used INTEGER NOT NULL,
+        Balance INTEGER NOT NULL,
+        UsageCount INTEGER NOT NULL,
+        FirstUsage DATE,
+        LastUsage DATE
+    );
+
+    -- Burn rate is the average daily usage between the first and last usage
+    CREATE VIEW IF NOT EXISTS InventoryStock AS
+    SELECT i.InventoryID, i.ItemName, i.Type, COALESCE(b.Received, i.Quantity) AS Received,
+           COALESCE(b.Used, 0) AS Used, COALESCE(b.Balance, i.Quantity) AS Stock, b.LastUsage,
+           ROUND(b.Used * 1.0 / (julianday(b.LastUsage) - julianday(b.FirstUsage) + 1), 2) AS BurnRate,
+           CASE WHEN b.Used > 0 THEN CAST(MAX(b.Balance, 0) * (julianday(b.LastUsage) - julianday(b.FirstUsage) + 1)
+                                          / b.Used AS INTEGER) END AS DaysLeft
+    FROM Inventory i
+    LEFT JOIN InventoryBalance b ON b.InventoryID = i.InventoryID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_balance_insert AFTER INSERT ON Inventory
+    BEGIN
+        INSERT INTO InventoryBalance (InventoryID, Received, Used, Balance, UsageCount)
+        VALUES (NEW.InventoryID, NEW.Quantity, 0, NEW.Quantity, 0)
+        ON CONFLICT (InventoryID) DO UPDATE SET Received = excluded.Received,
+                                                Balance = Balance + excluded.Received;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_balance_update AFTER UPDATE OF Quantity ON Inventory
+    BEGIN
+        UPDATE InventoryBalance
+        SET Received = NEW.Quantity, Balance = Balance + NEW.Quantity - OLD.Quantity
+        WHERE InventoryID = NEW.InventoryID;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_balance_delete AFTER DELETE ON Inventory
+    BEGIN
+        DELETE FROM InventoryBalance WHERE InventoryID = OLD.InventoryID;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_inventoryusage_balance_insert AFTER INSERT ON InventoryUsage
+    WHEN (SELECT Deferred FROM RollupControl) = 0
+    BEGIN
+        INSERT INTO InventoryBalance (InventoryID, Received, Used, Balance, UsageCount, FirstUsage, LastUsage)
+        VALUES (NEW.InventoryID, 0, NEW.QuantityUsed, -NEW.QuantityUsed, 1, NEW.UsageDate, NEW.UsageDate)
+        ON CONFLICT (InventoryID) DO UPDATE SET Used = Used + excluded.Used, Balance = Balance + excluded.Balance,
+            UsageCount = UsageCount + 1,
+            FirstUsage = MIN(COALESCE(FirstUsage, excluded.FirstUsage), excluded.FirstUsage),
+            LastUsage = MAX(COALESCE(LastUsage, excluded.LastUsage), excluded.LastUsage);
+    END;
+
+    -- Removing a usage looks the first and last dates up again through
+    -- idx_inventoryusage_item_date, which is a seek rather than a scan
+    CREATE TRIGGER IF NOT EXISTS trg_inventoryusage_balance_delete AFTER DELETE ON InventoryUsage
+    BEGIN
+        UPDATE InventoryBalance
+        SET Used = Used - OLD.QuantityUsed, Balance = Balance + OLD.QuantityUsed, UsageCount = UsageCount - 1,
+            FirstUsage = (SELECT MIN(UsageDate) FROM InventoryUsage WHERE InventoryID = OLD.InventoryID),
+            LastUsage = (SELECT MAX(UsageDate) FROM InventoryUsage WHERE InventoryID = OLD.InventoryID)
+        WHERE InventoryID = OLD.InventoryID;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_inventoryusage_balance_update
+    AFTER UPDATE OF InventoryID, UsageDate, QuantityUsed ON InventoryUsage
+    BEGIN
+        UPDATE InventoryBalance
+        SET Used = Used - OLD.QuantityUsed, Balance = Balance + OLD.QuantityUsed, UsageCount = UsageCount - 1,
+            FirstUsage = (SELECT MIN(UsageDate) FROM InventoryUsage WHERE InventoryID = OLD.InventoryID),
+            LastUsage = (SELECT MAX(UsageDate) FROM InventoryUsage WHERE InventoryID = OLD.InventoryID)
+        WHERE InventoryID = OLD.InventoryID;
+        INSERT INTO InventoryBalance (InventoryID, Received, Used, Balance, UsageCount, FirstUsage, LastUsage)
+        VALUES (NEW.InventoryID, 0, NEW.QuantityUsed, -NEW.QuantityUsed, 1, NEW.UsageDate, NEW.UsageDate)
+        ON CONFLICT (InventoryID) DO UPDATE SET Used = Used + excluded.Used, Balance = Balance + excluded.Balance,
+            UsageCount = UsageCount + 1,
+            FirstUsage = (SELECT MIN(UsageDate) FROM InventoryUsage WHERE InventoryID = NEW.InventoryID),
+            LastUsage = (SELECT MAX(UsageDate) FROM InventoryUsage WHERE InventoryID = NEW.InventoryID);
+    END;
+    ''')
+
+    if new_table:
+        rebuild_ledger(cursor)
+
+
+def rebuild_ledger(cursor):
+    cursor.executescript('''
+    DELETE FROM InventoryBalance;
+    INSERT INTO InventoryBalance (InventoryID, Received, Used, Balance, UsageCount, FirstUsage, LastUsage)
+    SELECT i.InventoryID, i.Quantity, COALESCE(u.Used, 0), i.Quantity - COALESCE(u.Used, 0),
+           COALESCE(u.UsageCount, 0), u.FirstUsage, u.LastUsage
+    FROM Inventory i
+    LEFT JOIN (SELECT InventoryID, SUM(QuantityUsed) AS Used, COUNT(*) AS UsageCount,
+                      MIN(UsageDate) AS FirstUsage, MAX(UsageDate) AS LastUsage
+               FROM InventoryUsage
+               GROUP BY InventoryID) u ON u.InventoryID = i.InventoryID;
+    ''')
+
+
+def create_search_indexes(cursor):
+    # External-content FTS5 tables: the text lives in the base table and
+    # triggers keep the full-text index in step with every write
+    for table, (search_table, key, columns) in SEARCH_TABLES.items():
+        new_table = not cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (search_table,)).fetchone()
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'NEW.{col}' for col in columns)
+        old_values = ', '.join(f'OLD.{col}' for col in columns)
+        cursor.executescript(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {search_table} USING fts5(
+            {column_list}, content='{table}', content_rowid='{key}', prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_search_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {search_table} (rowid, {column_list}) VALUES (NEW.{key}, {new_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_search_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {search_table} ({search_table}, rowid, {column_list})
+            VALUES ('delete', OLD.{key}, {old_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_search_update
+        AFTER UPDATE OF {key}, {column_list} ON {table}
+        BEGIN
+            INSERT INTO {search_table} ({search_table}, rowid, {column_list})
+            VALUES ('delete', OLD.{key}, {old_values});
+            INSERT INTO {search_table} (rowid, {column_list}) VALUES (NEW.{key}, {new_values});
+        END;
+        ''')
+        if new_table:
+            cursor.execute(f"INSERT INTO {search_table} ({search_table}) VALUES ('rebuild')")
+
+
+# Tables edited from the pages. Every update bumps RowVersion, and the edit
+# grid only updates or deletes a row whose version it last read.
+VERSIONED_TABLES = ["Crop", "Inventory", "InventoryUsage", "FinancialRecord", "Harvest", "MarketInfo", "Employee"]
+
+
+def create_row_versions(cursor):
+    for table in VERSIONED_TABLES:
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if "RowVersion" not in columns:
+            # A constant default is stored in the schema, so old rows are not rewritten
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN RowVersion INTEGER NOT NULL DEFAULT 1")
+
+
+# Every insert, update and delete on the tables below is logged with an
+# increasing sequence number, so field clients can fetch only what changed
+# since their last sync: table -> key column
+CHANGE_TABLES = {
+    'Crop': 'CropID', 'Plot': 'PlotID', 'Employee': 'EmployeeID', 'Inventory': 'InventoryID',
+    'FinancialRecord': 'RecordID', 'Planting': 'PlantingID', 'Harvest': 'HarvestID', 'Task': 'TaskID',
+    'InventoryUsage': 'UsageID', 'PestControl': 'ControlID', 'MonthlyCropProduction': 'ProductionID',
+    'MarketInfo': 'MarketInfoID',
+}
+
+
+def create_change_log(cursor):
+    # AUTOINCREMENT never hands out a sequence number twice, whatever entries
+    # compaction deletes
+    cursor.executescript('''
+    CREATE TABLE IF NOT EXISTS ChangeLog (
+        Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        TableName TEXT NOT NULL,
+        RowID INTEGER NOT NULL,
+        Operation TEXT NOT NULL CHECK (Operation IN ('I', 'U', 'D'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_changelog_row ON ChangeLog (TableName, RowID, Seq);
+    ''')
+    for table, key in CHANGE_TABLES.items():
+        cursor.executescript(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_changelog_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (TableName, RowID, Operation) VALUES ('{table}', NEW.{key}, 'I');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_changelog_update AFTER UPDATE ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (TableName, RowID, Operation) VALUES ('{table}', NEW.{key}, 'U');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_changelog_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO ChangeLog (TableName, RowID, Operation) VALUES ('{table}', OLD.{key}, 'D');
+        END;
+        ''')
+    # Rows from before the log existed count as inserted, so a client syncing
+    # from sequence 0 receives every row
+    for table, key in CHANGE_TABLES.items():
+        cursor.execute(f"INSERT INTO ChangeLog (TableName, RowID, Operation) SELECT '{table}', {key}, 'I' "
+                       f"FROM {table} WHERE NOT EXISTS (SELECT 1 FROM ChangeLog WHERE TableName = '{table}') "
+                       f"ORDER BY {key}")
+
+
+# Keep only the newest entry for each row: a client behind it needs the row's
+# current state (or that it was deleted), not every step in between
+def compact_change_log(cursor):
+    return cursor.execute('DELETE FROM ChangeLog WHERE Seq NOT IN '
+                          '(SELECT MAX(Seq) FROM ChangeLog GROUP BY TableName, RowID)').rowcount
+
+
+# Schema migrations in order; a database's PRAGMA user_version is the number
+# of them it has applied. executescript commits as it goes, so every
+# migration must be safe to run again after an interruption. The first seven
+# also bring databases from before user_version was kept up to date.
+# Append new migrations at the end; never reorder or remove one.
+MIGRATIONS = [
+    create_tables,
+    create_indexes,
+    create_rollups,
+    create_search_indexes,
+    create_ledger,
+    create_valuations,
+    create_row_versions,
+    create_change_log,
+]
+
+
+# Apply the migrations db_path has not had yet; returns the version it had.
+# A database that is up to date costs one PRAGMA read.
+def migrate(db_path='farm_management.db'):
+    conn = sqlite3.connect(db_path)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= len(MIGRATIONS):
+            return version
+        cursor = conn.cursor()
+        if not cursor.execute('SELECT 1 FROM sqlite_master').fetchone():
+            # Lets maintenance hand free pages back with PRAGMA incremental_vacuum;
+            # it only takes effect when set before the first table is created
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        cursor.execute('PRAGMA optimize')
+        conn.commit()
+        return version
+    finally:
+        conn.close()
+
+
+# The sample farm from the original app, only added to a database without crops
+def seed_demo_data(cursor):
+    if cursor.execute('SELECT 1 FROM Crop LIMIT 1').fetchone():
+        return False
     insert_data(cursor)
+    return True
+
+
+def create_database(db_path='farm_management.db', demo_data=False):
+    migrate(db_path)
+    if demo_data:
+        conn = sqlite3.connect(db_path)
+        seed_demo_data(conn.cursor())
+        conn.commit()
+        conn.close()
 
-    conn.commit()
-    conn.close()
 
 def insert_data(cursor):
     # Insert data into Crop table
@@ -0,0 +1,208 @@
+import argparse
+import os
+import sqlite3
+import time
+import numpy as np
+from database_setup import create_database, defer_rollups, refresh_deferred_rollups
+
+# Share of the requested row count that goes into each table. The lookup
+# tables (Crop, Plot, Employee, Inventory) grow much more slowly.
+TABLE_SHARES = {
+    "Harvest": 0.30,
+    "Planting": 0.15,
+    "MarketInfo": 0.15,
+    "FinancialRecord": 0.10,
+    "Task": 0.12,
+    "InventoryUsage": 0.10,
+    "PestControl": 0.06,
+    "MonthlyCropProduction": 0.02,
+}
+START_DATE = np.datetime64("2015-01-01")
+DAYS = 365 * 10
+
+CROPS = [("Maize", "Cereal", 120), ("Sorghum", "Cereal", 110), ("Millet", "Cereal", 95), ("Rice", "Cereal", 130),
+         ("Cassava", "Root", 365), ("Yam", "Root", 180), ("Cocoyam", "Root", 270), ("Sweet Potato", "Root", 120),
+         ("Beans", "Legume", 90), ("Groundnut", "Legume", 100), ("Cowpea", "Legume", 75),
+         ("Soybean", "Legume", 110), ("Tomato", "Vegetable", 80), ("Pepper", "Vegetable", 90),
+         ("Okra", "Vegetable", 60), ("Onion", "Vegetable", 120), ("Plantain", "Fruit", 300),
+         ("Pineapple", "Fruit", 540), ("Cocoa", "Tree Crop", 1095), ("Oil Palm", "Tree Crop", 1460)]
+LOCATIONS = ["Accra", "Kumasi", "Tamale", "Takoradi", "Cape Coast", "Savannah", "Aburi", "Ho", "Bolgatanga", "Wa",
+             "Sunyani", "Koforidua", "Techiman", "Nkawkaw", "Obuasi", "Yendi", "Tema", "Winneba", "Keta", "Damongo"]
+FIRST_NAMES = ["Kofi", "Ama", "Yaw", "Afia", "Kwame", "Akosua", "Kwabena", "Abena", "Kojo", "Adwoa", "Kwaku",
+               "Yaa", "Kwesi", "Efua", "Fiifi", "Esi", "Nana", "Adjoa", "Selorm", "Mawuli"]
+LAST_NAMES = ["Mensah", "Asante", "Boateng", "Opoku", "Owusu", "Agyeman", "Osei", "Addo", "Appiah", "Darko",
+              "Acheampong", "Amoah", "Ofori", "Quaye", "Tetteh", "Annan", "Adjei", "Frimpong", "Sarpong", "Nkrumah"]
+ROLES = ["Farmer", "Field Worker", "Supervisor", "Technician", "Manager", "Driver", "Storekeeper", "Agronomist"]
+ITEMS = [("Fertilizer", "Agricultural Input"), ("Seeds", "Agricultural Input"), ("Pesticide", "Chemical"),
+         ("Herbicide", "Chemical"), ("Fungicide", "Chemical"), ("Tools", "Equipment"),
+         ("Irrigation Pipes", "Equipment"), ("Sprayer", "Equipment"), ("Sacks", "Packaging"), ("Crates", "Packaging"),
+         ("Diesel", "Fuel"), ("Tarpaulin", "Equipment")]
+TASKS = ["Planting", "Watering", "Fertilizing", "Weeding", "Harvesting", "Plowing", "Applying Pesticides",
+         "Preparing Soil", "Monitoring Crops", "Pruning", "Mulching", "Repairing Irrigation"]
+CONTROL_METHODS = ["Spraying", "Trapping", "Natural Predators", "Chemical", "Organic", "Crop Rotation"]
+
+
+def _dates(offsets):
+    return np.datetime_as_string(START_DATE + offsets.astype("timedelta64[D]"))
+
+
+def _insert(conn, table, columns, arrays):
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                     zip(*(array.tolist() for array in arrays)))
+
+
+def _max_id(conn, table):
+    return conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+
+
+# Fill every table with referentially consistent data: plantings are harvested
+# after roughly the crop's growth duration, prices follow a random walk per
+# crop, tasks and pest control refer to existing employees and plots.
+def generate(conn, total_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    counts = {table: max(int(total_rows * share), 1) for table, share in TABLE_SHARES.items()}
+    counts["Crop"] = len(CROPS)
+    counts["Plot"] = max(int(np.sqrt(total_rows) / 2), 5)
+    counts["Employee"] = max(int(np.sqrt(total_rows) / 3), 5)
+    counts["Inventory"] = max(int(np.sqrt(total_rows) / 4), len(ITEMS))
+
+    crop_start = _max_id(conn, "Crop")
+    _insert(conn, "Crop", ["Name", "Type", "GrowthDuration"],
+            [np.array([name for name, _, _ in CROPS]), np.array([kind for _, kind, _ in CROPS]),
+             np.array([days for _, _, days in CROPS])])
+    crop_ids = np.arange(crop_start + 1, crop_start + len(CROPS) + 1)
+    growth = np.array([days for _, _, days in CROPS])
+
+    n = counts["Plot"]
+    plot_start = _max_id(conn, "Plot")
+    plot_sizes = np.round(rng.lognormal(0.7, 0.6, n), 2)
+    _insert(conn, "Plot", ["Location", "Size"],
+            [np.char.add(np.array(LOCATIONS)[rng.integers(0, len(LOCATIONS), n)],
+                         np.char.add(" ", (np.arange(n) + 1).astype(str))),
+             plot_sizes])
+    plot_ids = np.arange(plot_start + 1, plot_start + n + 1)
+
+    n = counts["Employee"]
+    employee_start = _max_id(conn, "Employee")
+    _insert(conn, "Employee", ["FirstName", "LastName", "Role", "HireDate"],
+            [np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), n)],
+             np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), n)],
+             np.array(ROLES)[rng.choice(len(ROLES), n, p=[0.3, 0.3, 0.1, 0.08, 0.04, 0.06, 0.06, 0.06])],
+             _dates(rng.integers(-3650, DAYS, n))])
+    employee_ids = np.arange(employee_start + 1, employee_start + n + 1)
+
+    n = counts["Inventory"]
+    inventory_start = _max_id(conn, "Inventory")
+    item = rng.integers(0, len(ITEMS), n)
+    _insert(conn, "Inventory", ["ItemName", "Quantity", "Type", "PurchaseDate"],
+            [np.array([name for name, _ in ITEMS])[item], rng.integers(10, 5000, n),
+             np.array([kind for _, kind in ITEMS])[item], _dates(rng.integers(0, DAYS, n))])
+    inventory_ids = np.arange(inventory_start + 1, inventory_start + n + 1)
+
+    # Harvests are drawn from the plantings and dated about one growth duration later
+    n = counts["Planting"]
+    crop = rng.integers(0, len(CROPS), n)
+    plot = rng.integers(0, len(plot_ids), n)
+    planted = rng.integers(0, DAYS, n)
+    quantity = rng.integers(50, 1000, n)
+    _insert(conn, "Planting", ["CropID", "PlotID", "PlantingDate", "Quantity"],
+            [crop_ids[crop], plot_ids[plot], _dates(planted), quantity])
+
+    n = counts["Harvest"]
+    source = rng.integers(0, len(crop), n)
+    harvested = planted[source] + (growth[crop[source]] * rng.normal(1.0, 0.08, n)).astype(np.int64)
+    harvested = np.minimum(harvested, DAYS + 365)
+    yield_factor = rng.lognormal(0.0, 0.25, n) * plot_sizes[plot[source]]
+    harvest_load = defer_rollups(conn, "Harvest")
+    _insert(conn, "Harvest", ["CropID", "PlotID", "HarvestDate", "Quantity"],
+            [crop_ids[crop[source]], plot_ids[plot[source]], _dates(harvested),
+             np.maximum((quantity[source] * 0.8 * yield_factor).astype(np.int64), 1)])
+    refresh_deferred_rollups(conn, "Harvest", harvest_load)
+
+    # Weekly-ish market prices: a multiplicative random walk per crop
+    n = counts["MarketInfo"]
+    crop = rng.integers(0, len(CROPS), n)
+    day = np.sort(rng.integers(0, DAYS, n))
+    steps = rng.normal(0.0, 0.02, n)
+    walk = np.zeros(n)
+    for index in range(len(CROPS)):
+        mask = crop == index
+        walk[mask] = np.cumsum(steps[mask])
+    base_price = rng.uniform(3.0, 30.0, len(CROPS))
+    price_load = defer_rollups(conn, "MarketInfo")
+    _insert(conn, "MarketInfo", ["CropID", "MarketDate", "PricePerUnit"],
+            [crop_ids[crop], _dates(day), np.round(base_price[crop] * np.exp(walk), 2)])
+    refresh_deferred_rollups(conn, "MarketInfo", price_load)
+
+    n = counts["FinancialRecord"]
+    record_load = defer_rollups(conn, "FinancialRecord")
+    _insert(conn, "FinancialRecord", ["RecordDate", "Income", "Expenses"],
+            [_dates(rng.integers(0, DAYS, n)), np.round(rng.gamma(2.0, 800.0, n), 2),
+             np.round(rng.gamma(2.0, 450.0, n), 2)])
+    refresh_deferred_rollups(conn, "FinancialRecord", record_load)
+
+    n = counts["Task"]
+    _insert(conn, "Task", ["EmployeeID", "PlotID", "TaskDescription", "TaskDate"],
+            [employee_ids[rng.integers(0, len(employee_ids), n)], plot_ids[rng.integers(0, len(plot_ids), n)],
+             np.array(TASKS)[rng.integers(0, len(TASKS), n)], _dates(rng.integers(0, DAYS, n))])
+
+    n = counts["InventoryUsage"]
+    usage_load = defer_rollups(conn, "InventoryUsage")
+    _insert(conn, "InventoryUsage", ["InventoryID", "UsageDate", "QuantityUsed"],
+            [inventory_ids[rng.integers(0, len(inventory_ids), n)], _dates(rng.integers(0, DAYS, n)),
+             rng.integers(1, 50, n)])
+    refresh_deferred_rollups(conn, "InventoryUsage", usage_load)
+
+    n = counts["PestControl"]
+    _insert(conn, "PestControl", ["PlotID", "ControlMethod", "ControlDate", "Quantity"],
+            [plot_ids[rng.integers(0, len(plot_ids), n)],
+             np.array(CONTROL_METHODS)[rng.integers(0, len(CONTROL_METHODS), n)],
+             _dates(rng.integers(0, DAYS, n)), np.round(rng.uniform(0.5, 10.0, n), 1)])
+
+    n = counts["MonthlyCropProduction"]
+    record_start = record_load[0]
+    record_ids = np.arange(record_start + 1, record_start + counts["FinancialRecord"] + 1)
+    month = rng.integers(0, 120, n)
+    _insert(conn, "MonthlyCropProduction", ["CropID", "FinancialRecordID", "ProductionMonth", "QuantityProduced"],
+            [crop_ids[rng.integers(0, len(CROPS), n)], record_ids[rng.integers(0, len(record_ids), n)],
+             np.datetime_as_string(np.datetime64("2015-01") + month.astype("timedelta64[M]")),
+             rng.integers(10, 5000, n)])
+
+    conn.commit()
+    return counts
+
+
+# Create a new database at db_path holding roughly total_rows generated rows
+def create_synthetic_database(db_path, total_rows, seed=0):
+    if os.path.exists(db_path):
+        raise FileExistsError(db_path)
+    create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        counts = generate(conn, total_rows, seed)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a FarmFlow database filled with synthetic data")
+    parser.add_argument("rows", type=int, help="approximate total number of rows, e.g. 10000 to 10000000")
+    parser.add_argument("-o", "--output", default="farm_synthetic.db")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = create_synthetic_database(args.output, args.rows, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Generated {sum(counts.values()):,} rows in {elapsed:.1f}s into {args.output}")
+    for table, count in counts.items():
+        print(f"  {table}: {count:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+import sqlite3
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+import query_cache
+import diagnostics
+from database_setup import VERSIONED_TABLES, migrate, seed_demo_data
+
+DB_PATH = 'farm_management.db'
+
+# New, empty databases get the sample farm only when this is set
+DEMO_DATA = os.environ.get("FARMFLOW_DEMO_DATA", "0") == "1"
+
+# Connection settings, applied once when a connection is opened
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KIB = 65536          # 64 MiB page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024   # 256 MiB of memory-mapped reads
+STATEMENT_CACHE_SIZE = 256      # prepared statements kept per connection
+POOL_SIZE = 8                   # idle connections kept per database file
+
+# Writes from every session go through one writer thread per database file,
+# which commits whatever arrived within the window as a single transaction
+WRITE_WINDOW = float(os.environ.get("FARMFLOW_WRITE_WINDOW_MS", "0.5")) / 1000
+WRITE_BATCH_SIZE = 256          # most writes committed in one transaction
+
+_pools = {}
+_local = threading.local()
+_writers = {}                   # db_path -> (request queue, writer thread, connection, connection lock)
+_data_versions = {}             # db_path -> PRAGMA data_version last seen on the writer's connection
+_pools_lock = threading.Lock()
+
+
+def use_database(db_path):
+    # Called at the start of every rerun with the session's farm, so each
+    # session reads and writes its own database file
+    _local.db_path = db_path
+
+
+def current_path():
+    return getattr(_local, "db_path", None) or DB_PATH
+
+
+def _open_connection(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def _get_pool(db_path):
+    # Migrations run once per database file and process, under the pool lock;
+    # after that a connection is a dictionary lookup away
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = queue.LifoQueue(maxsize=POOL_SIZE)
+                if migrate(db_path) == 0 and DEMO_DATA:
+                    conn = _open_connection(db_path)
+                    load_demo_data(db_path, conn)
+                    pool.put_nowait(conn)
+                _pools[db_path] = pool
+    return pool
+
+
+# Borrow a pooled connection; it goes back to the pool instead of being closed.
+# Streamlit runs every rerun on a fresh thread, so connections are shared across
+# threads but only ever used by one borrower at a time.
+@contextmanager
+def get_connection(db_path=None):
+    db_path = db_path or current_path()
+    pool = _get_pool(db_path)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(db_path)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+# Add the sample farm to a database without crops; returns whether it did
+def load_demo_data(db_path=None, conn=None):
+    db_path = db_path or current_path()
+    if conn is None:
+        return run_exclusive(lambda conn: load_demo_data(db_path, conn), db_path)
+    conn.execute("BEGIN IMMEDIATE")
+    seeded = seed_demo_data(conn.cursor())
+    conn.commit()
+    if seeded:
+        for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            query_cache.invalidate_table(db_path, table)
+    return seeded
+
+
+def close_connections():
+    # Writers finish the requests already queued before they stop
+    with _pools_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for requests, thread, conn, conn_lock in writers:
+        requests.put(None)
+        thread.join()
+    with _pools_lock:
+        for pool in _pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+        _pools.clear()
+
+
+class WriteConflict(Exception):
+    # Raised when rows in a change set were changed or deleted by someone else
+    # since they were read; the whole change set is rolled back
+    def __init__(self, table, keys):
+        super().__init__(f"{table} rows changed by someone else since they were loaded: "
+                         f"{', '.join(map(str, keys))}")
+        self.table = table
+        self.keys = keys
+
+
+def _run(conn, table, statement, values):
+    if isinstance(statement, str):
+        return conn.execute(statement, values).rowcount
+    if callable(statement):
+        # Runs inside the batch's transaction, under the request's savepoint
+        return statement(conn)
+    # A change set: (statement, rows, version query) steps, each run with
+    # executemany. Steps with a version query must touch every one of their
+    # rows, whose last two values are the key and the version read.
+    count = 0
+    for step, rows, version_query in statement:
+        changed = conn.executemany(step, rows).rowcount
+        if version_query is not None and changed != len(rows):
+            stale = [row[-2] for row in rows if conn.execute(version_query, (row[-2],)).fetchone() != (row[-1],)]
+            raise WriteConflict(table, stale)
+        count += changed
+    return count
+
+
+def _statement_text(statement):
+    if callable(statement):
+        return getattr(statement, "__qualname__", repr(statement))
+    return statement if isinstance(statement, str) else "; ".join(step[0] for step in statement)
+
+
+# PRAGMA data_version changes on a connection when any other connection has
+# committed to the file since it was last asked, never for the connection's own
+# commits. Asked on the writer's connection, it tells whether someone other
+# than this process's writer (another process, or a tool writing directly) has
+# written; the database's cached results are dropped then.
+def _check_data_version(db_path, conn):
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if _data_versions.get(db_path) != version:
+        query_cache.invalidate_database(db_path)
+        _data_versions[db_path] = version
+
+
+# Called before serving cached results. While the writer is busy the check is
+# left to it: it checks again as soon as it holds the write lock.
+def check_external_writes(db_path=None):
+    db_path = db_path or current_path()
+    requests, thread, conn, conn_lock = _get_writer(db_path)
+    if conn_lock.acquire(blocking=False):
+        try:
+            _check_data_version(db_path, conn)
+        except sqlite3.ProgrammingError:
+            pass  # the writer has just stopped and closed its connection
+        finally:
+            conn_lock.release()
+
+
+def _commit_batch(db_path, conn, batch):
+    # Each request runs under its own savepoint, so a failing statement is
+    # reported to its caller without rolling back the rest of the batch. Any
+    # error counts, not only SQLite's: values the driver cannot bind (an
+    # integer beyond 64 bits) raise OverflowError or TypeError.
+    results = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Nobody else can commit until this transaction ends, so every write
+        # from elsewhere is seen here and not mistaken for this batch's
+        _check_data_version(db_path, conn)
+        for table, statement, values, future, started, page in batch:
+            conn.execute("SAVEPOINT request")
+            try:
+                results.append(_run(conn, table, statement, values))
+            except Exception as error:
+                conn.execute("ROLLBACK TO request")
+                results.append(error)
+            conn.execute("RELEASE request")
+        conn.commit()
+    except Exception as error:
+        if conn.in_transaction:
+            conn.rollback()
+        for request in batch:
+            request[3].set_exception(error)
+        return
+
+    for table in {request[0] for request in batch}:
+        query_cache.invalidate_table(db_path, table)
+    for (table, statement, values, future, started, page), result in zip(batch, results):
+        if isinstance(result, Exception):
+            future.set_exception(result)
+            continue
+        if diagnostics.enabled:
+            if isinstance(statement, str):
+                diagnostics.record("write", statement, started, result, conn=conn, params=values, page=page)
+            else:
+                diagnostics.record("write", _statement_text(statement), started, result, page=page)
+        future.set_result(result)
+
+
+def _run_job(conn, request):
+    future = request[3]
+    try:
+        result = request[1](conn)
+    except Exception as error:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+
+def _writer_loop(db_path, requests, conn, conn_lock):
+    try:
+        stopping = False
+        busy = False
+        held = None
+        while not stopping:
+            request = held or requests.get()
+            held = None
+            if request is None:
+                break
+            if request[0] is None:
+                with conn_lock:
+                    _run_job(conn, request)
+                continue
+            # Only wait for more writes while other sessions are writing too;
+            # a lone form submit commits straight away. Jobs and callable
+            # writes (bulk import chunks) are not batched with anything, so
+            # the form writes queued behind one do not wait for the next too.
+            batch = [request]
+            deadline = time.monotonic() + (WRITE_WINDOW if busy else 0)
+            while len(batch) < WRITE_BATCH_SIZE and not callable(batch[0][1]):
+                try:
+                    request = requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if request[0] is None or callable(request[1]):
+                    held = request
+                    break
+                batch.append(request)
+            busy = len(batch) > 1
+            try:
+                with conn_lock:
+                    _commit_batch(db_path, conn, batch)
+            except Exception as error:
+                # The batch failed after its commit, e.g. in diagnostics; the
+                # thread keeps serving and no caller is left waiting
+                for request in batch:
+                    if not request[3].done():
+                        request[3].set_exception(error)
+    finally:
+        # If the thread stops unexpectedly the next write starts a new one;
+        # requests still queued fail instead of hanging
+        with _pools_lock:
+            if _writers.get(db_path, (None,))[0] is requests:
+                del _writers[db_path]
+        with conn_lock:
+            conn.close()
+            # A new writer's connection counts data versions from its own start
+            _data_versions.pop(db_path, None)
+        while True:
+            try:
+                request = requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and not request[3].done():
+                request[3].set_exception(sqlite3.OperationalError("The database writer has stopped"))
+
+
+def _get_writer(db_path):
+    writer = _writers.get(db_path)
+    if writer is None:
+        _get_pool(db_path)
+        with _pools_lock:
+            writer = _writers.get(db_path)
+            if writer is None:
+                requests = queue.Queue()
+                conn = _open_connection(db_path)
+                conn_lock = threading.Lock()
+                thread = threading.Thread(target=_writer_loop, args=(db_path, requests, conn, conn_lock),
+                                          name=f"farmflow-writer-{os.path.basename(db_path)}", daemon=True)
+                thread.start()
+                writer = _writers[db_path] = (requests, thread, conn, conn_lock)
+    return writer
+
+
+# Queue a write for the writer thread. The future resolves to the statement's
+# row count once its transaction has committed, or to the statement's error.
+def submit_write(table, statement, values, db_path=None):
+    db_path = db_path or current_path()
+    future = Future()
+    _get_writer(db_path)[0].put((table, statement, values, future, time.perf_counter(), diagnostics.current_page()))
+    return future
+
+
+# Run function(conn) on the writer thread between batches, with the writer's
+# connection outside any transaction, and return its result. For writes that
+# manage their own transactions (archiving, maintenance, demo data): they
+# take their turn with the form writes instead of competing with them for the
+# database lock. function must not wait for other writes itself.
+def run_exclusive(function, db_path=None):
+    db_path = db_path or current_path()
+    future = Future()
+    _get_writer(db_path)[0].put((None, function, (), future, time.perf_counter(), diagnostics.current_page()))
+    return future.result()
+
+
+def _execute_write(table, statement, values):
+    return submit_write(table, statement, values).result()
+
+
+# Define CRUD functions for each table
+def add_record(table, values):
+    columns = ', '.join(values.keys())
+    placeholders = ', '.join('?' * len(values))
+    _execute_write(table, f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", list(values.values()))
+
+
+def update_record(table, set_values, condition):
+    set_clause = ', '.join([f"{col} = ?" for col in set_values.keys()])
+    if table in VERSIONED_TABLES:
+        set_clause += ", RowVersion = RowVersion + 1"
+    condition_clause = ' AND '.join([f"{col} = ?" for col in condition.keys()])
+    values = list(set_values.values()) + list(condition.values())
+    _execute_write(table, f"UPDATE {table} SET {set_clause} WHERE {condition_clause}", values)
+
+
+def delete_record(table, condition):
+    condition_clause = ' AND '.join([f"{col} = ?" for col in condition.keys()])
+    values = list(condition.values())
+    _execute_write(table, f"DELETE FROM {table} WHERE {condition_clause}", values)
+
+
+# Insert many rows at once, e.g. a bulk entry form, as one writer request:
+# either every row is recorded or, if any is rejected, none is and the error
+# is raised. Returns the number of rows inserted.
+def add_records(table, columns, rows):
+    placeholders = ', '.join('?' * len(columns))
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    return _execute_write(table, [(statement, [tuple(row) for row in rows], None)], ())
+
+
+# Apply the edits made in a grid as one transaction. inserts are dicts of
+# column values; updates are (key, version, changed columns) and deletes
+# (key, version), where version is the RowVersion the grid read. Rows with the
+# same set of changed columns share one executemany. Raises WriteConflict,
+# with nothing applied, if any updated or deleted row has changed since.
+def apply_changes(table, key_column, inserts=(), updates=(), deletes=()):
+    version_query = f"SELECT RowVersion FROM {table} WHERE {key_column} = ?"
+    steps = []
+    by_columns = {}
+    for values in inserts:
+        by_columns.setdefault(tuple(values), []).append(tuple(values.values()))
+    for columns, rows in by_columns.items():
+        steps.append((f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                      rows, None))
+    by_columns = {}
+    for key, version, changes in updates:
+        by_columns.setdefault(tuple(changes), []).append((*changes.values(), key, version))
+    for columns, rows in by_columns.items():
+        set_clause = ', '.join(f"{column} = ?" for column in columns)
+        steps.append((f"UPDATE {table} SET {set_clause}, RowVersion = RowVersion + 1 "
+                      f"WHERE {key_column} = ? AND RowVersion = ?", rows, version_query))
+    if deletes:
+        steps.append((f"DELETE FROM {table} WHERE {key_column} = ? AND RowVersion = ?",
+                      [(key, version) for key, version in deletes], version_query))
+    if not steps:
+        return 0
+    return submit_write(table, steps, ()).result()
+
+
+# Reads are served from query_cache until a write touches one of their tables
+def fetch_data(query, params=()):
+    started = time.perf_counter() if diagnostics.enabled else None
+    db_path = current_path()
+    check_external_writes(db_path)
+    key, rows = query_cache.get(db_path, query, params)
+    if rows is not None:
+        if started is not None:
+            diagnostics.record("read", query, started, len(rows), cached=True)
+        return rows
+    tables = query_cache.tables_in(query)
+    versions = query_cache.table_versions(db_path, tables)
+    with get_connection(db_path) as conn:
+        rows = conn.execute(query, params).fetchall()
+        if started is not None:
+            diagnostics.record("read", query, started, len(rows), conn=conn, params=params)
+    query_cache.put(key, tables, versions, rows)
+    return rows
+
+
+# Row estimates from sqlite_stat1 (kept by ANALYZE / PRAGMA optimize) and,
+# when asked, on-disk sizes from the dbstat table, which reads every page
+def table_statistics(measure_sizes=False):
+    with get_connection() as conn:
+        has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        rows = {}
+        if has_stats:
+            for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                estimate = int(stat.split()[0]) if stat else 0
+                rows[table] = max(rows.get(table, 0), estimate)
+        sizes = {}
+        if measure_sizes:
+            for name, table, size in conn.execute(
+                    "SELECT d.name, COALESCE(m.tbl_name, d.name), SUM(d.pgsize) FROM dbstat d "
+                    "LEFT JOIN sqlite_master m ON m.name = d.name GROUP BY d.name"):
+                sizes[table] = sizes.get(table, 0) + size
+    tables = sorted(set(rows) | set(sizes), key=lambda name: (sizes.get(name, 0), rows.get(name, 0)), reverse=True)
+    return [{"Table": table, "Estimated Rows": rows.get(table), "Size (MB)": sizes[table] / 2 ** 20
+             if table in sizes else None} for table in tables]
@@ -0,0 +1,92 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# Query tracing for fetch_data and the write helpers. Off unless switched on
+# with FARMFLOW_TRACING=1 or from the Diagnostics page: traced queries pay for
+# the latency bookkeeping, and slow ones for an EXPLAIN and a log write. When
+# disabled the only cost on the query path is one module attribute check.
+enabled = os.environ.get("FARMFLOW_TRACING", "0") == "1"
+slow_query_ms = float(os.environ.get("FARMFLOW_SLOW_QUERY_MS", "100"))
+
+SAMPLES_PER_QUERY = 1000  # latencies kept per query for the percentiles
+RECENT_SLOW_QUERIES = 50
+
+slow_query_logger = logging.getLogger("farmflow.slow_queries")
+if not slow_query_logger.handlers:
+    slow_query_logger.addHandler(logging.FileHandler(os.environ.get("FARMFLOW_SLOW_QUERY_LOG", "slow_queries.log"),
+                                                     delay=True))
+    slow_query_logger.setLevel(logging.INFO)
+    slow_query_logger.propagate = False
+
+_stats = {}  # (page, kind, sql) -> {"count", "rows", "cached", "samples"}
+_slow = deque(maxlen=RECENT_SLOW_QUERIES)
+_lock = threading.Lock()
+_local = threading.local()
+_WHITESPACE = re.compile(r"\s+")
+
+
+def set_page(page):
+    # Called at the start of every rerun so queries are attributed to the page
+    _local.page = page
+
+
+def current_page():
+    return getattr(_local, "page", None) or "(none)"
+
+
+# Record one traced statement. started is a time.perf_counter() value taken
+# before the statement ran; conn and params are only used to explain it when
+# it turns out to be slow. page is given when recording on another thread.
+def record(kind, sql, started, rows, cached=False, conn=None, params=(), page=None):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    page = page or current_page()
+    key = (page, kind, sql)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {"count": 0, "rows": 0, "cached": 0, "samples": deque(maxlen=SAMPLES_PER_QUERY)}
+        entry["count"] += 1
+        entry["rows"] += rows
+        entry["cached"] += cached
+        entry["samples"].append(elapsed_ms)
+
+    if elapsed_ms >= slow_query_ms and conn is not None:
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        except Exception as error:
+            plan = [f"(no plan: {error})"]
+        slow = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "page": page, "kind": kind, "ms": round(elapsed_ms, 2),
+                "rows": rows, "sql": _WHITESPACE.sub(" ", sql).strip(), "plan": plan}
+        _slow.append(slow)
+        slow_query_logger.info("%(time)s %(ms).1fms page=%(page)s kind=%(kind)s rows=%(rows)s sql=%(sql)s", slow)
+        for step in plan:
+            slow_query_logger.info("    %s", step)
+
+
+def query_stats():
+    with _lock:
+        items = [(key, dict(entry, samples=list(entry["samples"]))) for key, entry in _stats.items()]
+    results = []
+    for (page, kind, sql), entry in items:
+        p50, p95, p99 = np.percentile(entry["samples"], [50, 95, 99])
+        results.append({"Page": page, "Kind": kind, "Query": _WHITESPACE.sub(" ", sql).strip(),
+                        "Calls": entry["count"], "Cache Hits": entry["cached"],
+                        "Avg Rows": entry["rows"] / entry["count"],
+                        "p50 ms": p50, "p95 ms": p95, "p99 ms": p99})
+    return sorted(results, key=lambda row: row["p95 ms"], reverse=True)
+
+
+def slow_queries():
+    with _lock:
+        return list(_slow)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _slow.clear()
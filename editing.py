@@ -0,0 +1,103 @@
+import datetime
+import sqlite3
+import numpy as np
+import pandas as pd
+import streamlit as st
+from db import WriteConflict, apply_changes
+from columnar import fetch_frame
+
+EDIT_ROWS = 500  # rows loaded into the edit grid at a time
+
+
+def _cell(value):
+    # Grid values back to what SQLite stores: ISO dates, plain numbers, NULL
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _load(table, key_column, start):
+    df = fetch_frame(f"SELECT * FROM {table} WHERE {key_column} >= ? ORDER BY {key_column} LIMIT ?",
+                     (start, EDIT_ROWS))
+    # Categorical text would only offer the values already present
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].astype(object)
+    return df
+
+
+def _discard(editor_key, rows_key):
+    st.session_state.pop(editor_key, None)
+    st.session_state.pop(rows_key, None)
+
+
+# The changes made in the grid, read from the editor's state: only the cells
+# that were edited, the rows added and the rows deleted
+def grid_changes(rows, edited, state, key_column):
+    columns = [name for name in rows.columns if name not in (key_column, "RowVersion")]
+    updates = []
+    for position, cells in state["edited_rows"].items():
+        label = rows.index[int(position)]
+        if label not in edited.index:
+            continue
+        changes = {name: _cell(edited.at[label, name]) for name in cells if name in columns}
+        if changes:
+            updates.append((int(rows.at[label, key_column]), int(rows.at[label, "RowVersion"]), changes))
+    added = edited.loc[~edited.index.isin(rows.index)]
+    inserts = [{name: value for name in columns if (value := _cell(row[name])) is not None}
+               for _, row in added.iterrows()]
+    deletes = [(int(rows[key_column].iloc[position]), int(rows["RowVersion"].iloc[position]))
+               for position in state["deleted_rows"]]
+    return inserts, updates, deletes
+
+
+# An editable grid over up to EDIT_ROWS rows of a table, starting at a key.
+# Saving applies every insert, update and delete in one transaction, and only
+# if none of the edited rows changed since the grid loaded them.
+def show_edit_grid(key, table, key_column):
+    editor_key = f"{key}_grid_editor"
+    rows_key = f"{key}_grid_rows"
+    start = st.number_input(f"Start at {key_column}", min_value=1, value=1, key=f"{key}_grid_start")
+
+    # While there are unsaved edits the grid keeps the rows they were made on,
+    # so the editor's row positions and the versions read stay valid
+    state = st.session_state.get(editor_key)
+    pending = state is not None and any(state[part] for part in ("edited_rows", "added_rows", "deleted_rows"))
+    loaded = st.session_state.get(rows_key)
+    if pending and loaded is not None and loaded[0] == start:
+        rows = loaded[1]
+    else:
+        rows = _load(table, key_column, start)
+        st.session_state[rows_key] = (start, rows)
+
+    dates = {name: st.column_config.DateColumn() for name in rows.columns
+             if str(rows[name].dtype).startswith("datetime")}
+    column_config = {key_column: st.column_config.NumberColumn(disabled=True), **dates}
+    st.caption(f"Showing up to {EDIT_ROWS} rows. Edit cells, add rows at the bottom or select rows to delete.")
+    edited = st.data_editor(rows, num_rows="dynamic", hide_index=True, key=editor_key, column_config=column_config,
+                            column_order=[name for name in rows.columns if name != "RowVersion"])
+
+    state = st.session_state[editor_key]
+    inserts, updates, deletes = grid_changes(rows, edited, state, key_column)
+    changed = len(inserts) + len(updates) + len(deletes)
+    save_col, discard_col, info_col = st.columns([1, 1, 3])
+    info_col.caption(f"{len(updates)} updated · {len(inserts)} added · {len(deletes)} deleted")
+    discard_col.button("Discard Edits", key=f"{key}_grid_discard", disabled=not changed,
+                       on_click=_discard, args=(editor_key, rows_key))
+    if save_col.button("Save Changes", key=f"{key}_grid_save", type="primary", disabled=not changed):
+        try:
+            apply_changes(table, key_column, inserts, updates, deletes)
+        except WriteConflict as error:
+            st.error(f"Nothing was saved. {error}. Discard your edits to reload the latest rows.")
+        except sqlite3.Error as error:
+            st.error(f"Nothing was saved: {error}")
+        else:
+            _discard(editor_key, rows_key)
+            return changed
+    return None
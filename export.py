@@ -0,0 +1,163 @@
+import argparse
+import os
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import db
+
+BATCH_SIZE = 50000  # rows held in memory at a time
+EXPORT_DIR = os.environ.get("FARMFLOW_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "farmflow_exports"))
+EXPORT_MAX_AGE = int(os.environ.get("FARMFLOW_EXPORT_MAX_AGE", "3600"))  # seconds a prepared export is kept
+
+# Named report queries offered next to the raw tables
+REPORT_QUERIES = {
+    "Monthly Income vs Expenses": """
+        SELECT Month, TotalIncome, TotalExpenses
+        FROM MonthlyFinancialSummary
+        ORDER BY Month
+    """,
+    "Monthly Harvest by Crop": """
+        SELECT s.Month, c.Name as Crop, s.TotalQuantity, s.HarvestCount
+        FROM MonthlyHarvestSummary s
+        JOIN Crop c ON c.CropID = s.CropID
+        ORDER BY s.Month, c.Name
+    """,
+}
+
+
+def list_tables():
+    # Ordinary tables only: FTS5 search tables and their shadow tables are left out
+    rows = db.fetch_data("SELECT name FROM pragma_table_list WHERE schema = 'main' AND type = 'table' "
+                         "AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    return [row[0] for row in rows]
+
+
+def _declared_schema(table):
+    # Arrow types from the declared column types, so every batch shares one schema
+    fields = []
+    for _, name, declared, *_ in db.fetch_data(f"PRAGMA table_info({table})"):
+        declared = (declared or "").upper()
+        if "INT" in declared:
+            fields.append(pa.field(name, pa.int64()))
+        elif any(kind in declared for kind in ("REAL", "FLOA", "DOUB")):
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+# Iterate a query as Arrow record batches of at most batch_size rows. Without
+# a schema the types are inferred from the first batch.
+def iter_record_batches(query, params=(), schema=None, batch_size=BATCH_SIZE):
+    with db.get_connection() as conn:
+        cursor = conn.execute(query, params)
+        names = [column[0] for column in cursor.description]
+        empty = True
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            empty = False
+            columns = list(zip(*rows))
+            if schema is None:
+                arrays = [pa.array(column) for column in columns]
+                schema = pa.schema([pa.field(name, pa.string() if pa.types.is_null(array.type) else array.type)
+                                    for name, array in zip(names, arrays)])
+            yield pa.RecordBatch.from_arrays([pa.array(column, type=field.type)
+                                              for column, field in zip(columns, schema)], schema=schema)
+        if empty:
+            # Still produce a file with the right header
+            schema = schema or pa.schema([pa.field(name, pa.string()) for name in names])
+            yield pa.RecordBatch.from_pylist([], schema=schema)
+
+
+# Write a query to a Parquet or CSV sink batch by batch. Returns the row count.
+def export_query(query, sink, file_format="parquet", params=(), schema=None, batch_size=BATCH_SIZE):
+    writer = None
+    rows = 0
+    try:
+        for batch in iter_record_batches(query, params, schema, batch_size):
+            if writer is None:
+                if file_format == "parquet":
+                    writer = pq.ParquetWriter(sink, batch.schema, compression="zstd")
+                else:
+                    writer = pa_csv.CSVWriter(sink, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_table(table, sink, file_format="parquet", batch_size=BATCH_SIZE):
+    if table not in list_tables():
+        raise ValueError(f"Unknown table {table}")
+    return export_query(f"SELECT * FROM {table}", sink, file_format, schema=_declared_schema(table),
+                        batch_size=batch_size)
+
+
+# Export a table or one of REPORT_QUERIES by name
+def export(name, sink, file_format="parquet", batch_size=BATCH_SIZE):
+    if name in REPORT_QUERIES:
+        return export_query(REPORT_QUERIES[name], sink, file_format, batch_size=batch_size)
+    return export_table(name, sink, file_format, batch_size)
+
+
+# Streamlit can only offer a finished file for download, so the export is
+# streamed to a file in EXPORT_DIR first and the page hands out that file.
+# Sessions that are closed never remove theirs, so files older than
+# EXPORT_MAX_AGE are swept away whenever another export is prepared.
+def export_to_tempfile(name, file_format="parquet"):
+    remove_stale_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix=f".{file_format}", prefix="farmflow_", dir=EXPORT_DIR)
+    os.close(handle)
+    try:
+        export(name, path, file_format)
+    except Exception:
+        remove_tempfile(path)
+        raise
+    return path
+
+
+def remove_tempfile(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Remove prepared exports not modified for max_age seconds. Returns their paths.
+def remove_stale_exports(max_age=None):
+    if not os.path.isdir(EXPORT_DIR):
+        return []
+    cutoff = time.time() - (EXPORT_MAX_AGE if max_age is None else max_age)
+    removed = []
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed.append(entry.path)
+        except FileNotFoundError:
+            pass  # removed by another session meanwhile
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a FarmFlow table or report to Parquet or CSV")
+    parser.add_argument("name", help="table name or one of: " + ", ".join(REPORT_QUERIES))
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--format", choices=["parquet", "csv"])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    file_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "parquet")
+    rows = export(args.name, args.output, file_format, args.batch_size)
+    print(f"Exported {rows:,} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import re
+from database_setup import SEARCH_TABLES
+
+# Typed search filters. Each helper returns a (clause, params) pair, or None when
+# the filter is empty, so the pages can combine them into a WHERE clause that the
+# indexes in database_setup.create_indexes can serve.
+
+
+def crop_filter(term, column="CropID"):
+    # An exact crop ID, or a crop name resolved through the Crop table
+    term = term.strip()
+    if not term:
+        return None
+    if term.isdigit():
+        return f"{column} = ?", [int(term)]
+    return f"{column} IN (SELECT CropID FROM Crop WHERE Name = ? COLLATE NOCASE)", [term]
+
+
+def id_filter(column, value):
+    # Number inputs use 0 for "any"
+    if not value:
+        return None
+    return f"{column} = ?", [int(value)]
+
+
+def date_range_filter(column, date_range):
+    # st.date_input returns (), (start,) or (start, end) for a range selection
+    if not date_range:
+        return None
+    start = date_range[0]
+    end = date_range[1] if len(date_range) > 1 else start
+    return f"{column} BETWEEN ? AND ?", [start.isoformat(), end.isoformat()]
+
+
+def text_search(table, term):
+    # Full-text search over the table's FTS5 index. Every word is matched as a
+    # prefix, so "ma ce" finds Maize of type Cereal. Returns (search table, match
+    # expression) for show_paginated_table, or None for an empty search.
+    words = re.findall(r"\w+", term)
+    if not words:
+        return None
+    return SEARCH_TABLES[table][0], ' '.join(f'"{word}"*' for word in words)
+
+
+def combine_filters(*filters):
+    clauses = []
+    params = []
+    for item in filters:
+        if item is not None:
+            clauses.append(item[0])
+            params.extend(item[1])
+    where = ' AND '.join(clauses) if clauses else '1 = 1'
+    return where, params
@@ -0,0 +1,261 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from streamlit.testing.v1 import AppTest
+import db
+from datagen import create_synthetic_database
+
+# Simulated users: each session is its own AppTest driving main.py the way a
+# person would, in its own process, against a synthetic database of the chosen
+# size. Every rerun is timed; the report gives latency percentiles per kind
+# of action, overall throughput, database lock errors and memory per session.
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+DEFAULT_SESSIONS = 8
+DEFAULT_ROWS = 100000
+ITERATIONS = 5                  # passes through the scenario per session
+THINK_TIME = 0.5                # seconds a user waits between actions, on average
+RERUN_TIMEOUT = 120
+SESSION_TIMEOUT = 3600          # seconds to wait for a session to finish
+SEARCH_TERMS = ["ma", "be", "fert", "to", "so"]
+
+
+def _rss_bytes():
+    # Resident memory now (Linux), or the peak where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _by_label(widgets, label):
+    return next(widget for widget in widgets if widget.label == label)
+
+
+def _navigate(page):
+    def step(at):
+        at.radio(key="page").set_value(page).run(timeout=RERUN_TIMEOUT)
+    return "navigate", step
+
+
+def _open(section):
+    def step(at):
+        at.toggle(key=section).set_value(True).run(timeout=RERUN_TIMEOUT)
+    return "open_section", step
+
+
+def _search(label, terms):
+    def step(at):
+        _by_label(at.text_input, label).input(random.choice(terms)).run(timeout=RERUN_TIMEOUT)
+    return "search", step
+
+
+def _add_harvest(crop_ids, plot_ids):
+    def step(at):
+        _by_label(at.number_input, "Crop ID").set_value(random.choice(crop_ids))
+        _by_label(at.number_input, "Plot ID").set_value(random.choice(plot_ids))
+        _by_label(at.number_input, "Quantity").set_value(random.randint(1, 500))
+        _by_label(at.button, "Add Harvest Record").click().run(timeout=RERUN_TIMEOUT)
+    return "submit", step
+
+
+# One pass of what a user does: browse and search the pages, record a harvest
+# and open the reports
+def scenario(crop_ids, plot_ids):
+    crop_names = [row[0] for row in db.fetch_data("SELECT Name FROM Crop LIMIT 20")] or SEARCH_TERMS
+    return [
+        _navigate("Crop Planning"),
+        _open("view_crops"),
+        _search("Search Crops", SEARCH_TERMS),
+        _navigate("Inventory Management"),
+        _open("view_inventory"),
+        _search("Search Inventory", SEARCH_TERMS),
+        _navigate("Harvest Tracking"),
+        _open("view_harvest_records"),
+        _search("Crop ID or Name", crop_names),
+        _open("add_harvest_record"),
+        _add_harvest(crop_ids, plot_ids),
+        _navigate("Market Information"),
+        _open("view_market_information"),
+        _navigate("Report"),
+        _navigate("Home"),
+    ]
+
+
+def _is_lock_error(message):
+    return "database is locked" in message or "database table is locked" in message
+
+
+# One simulated user in its own process: AppTest swaps process-wide Streamlit
+# state (the runtime, config options) on every run, so sessions cannot share a
+# process. They share the database file, so SQLite contention between writers
+# is real; the query cache and writer batching are per session, which makes
+# the numbers a conservative bound for one server process.
+def run_session(index, db_path, iterations, think_time, results, start_barrier):
+    random.seed(index)
+    memory_before = _rss_bytes()
+    if db_path:
+        db.DB_PATH = db_path
+    crop_ids = [row[0] for row in db.fetch_data("SELECT CropID FROM Crop LIMIT 100")]
+    plot_ids = [row[0] for row in db.fetch_data("SELECT PlotID FROM Plot LIMIT 100")]
+    steps = scenario(crop_ids, plot_ids)
+    at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT)
+    session = {"latencies": {}, "errors": [], "lock_errors": 0, "reruns": 0}
+    start_barrier.wait()
+    started = time.perf_counter()
+    at.run()
+    session["latencies"]["start"] = [(time.perf_counter() - started) * 1000]
+    # The first run loads the app's modules, which a server process does once;
+    # what the session adds after that is what each extra user costs
+    memory_started = _rss_bytes()
+    session["app_memory_mb"] = (memory_started - memory_before) / 2 ** 20
+    for _ in range(iterations):
+        for kind, step in steps:
+            time.sleep(random.expovariate(1 / think_time) if think_time else 0)
+            started = time.perf_counter()
+            try:
+                step(at)
+            except Exception as error:
+                # The widget to drive was missing, usually because the rerun before failed
+                session["errors"].append(f"{kind}: {error!r}")
+                continue
+            session["latencies"].setdefault(kind, []).append((time.perf_counter() - started) * 1000)
+            session["reruns"] += 1
+            for exception in at.exception:
+                message = str(exception.message)
+                if _is_lock_error(message):
+                    session["lock_errors"] += 1
+                else:
+                    session["errors"].append(f"{kind}: {message}")
+    session["memory_mb"] = (_rss_bytes() - memory_started) / 2 ** 20
+    db.close_connections()
+    results.put(session)
+
+
+def _percentiles(values):
+    values = sorted(values)
+
+    def percentile(fraction):
+        return values[min(int(len(values) * fraction), len(values) - 1)]
+
+    return {"count": len(values), "p50_ms": statistics.median(values), "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99), "max_ms": values[-1]}
+
+
+# Run sessions concurrent users through the scenario on the database at
+# db_path (the app's database by default)
+def run_load_test(sessions=DEFAULT_SESSIONS, iterations=ITERATIONS, think_time=THINK_TIME, db_path=None):
+    with db.get_connection(db_path or db.DB_PATH) as conn:
+        if not conn.execute("SELECT 1 FROM Crop").fetchone() or not conn.execute("SELECT 1 FROM Plot").fetchone():
+            raise ValueError("The database has no crops or plots; load demo data or use --rows")
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    start_barrier = context.Barrier(sessions + 1)
+    processes = [context.Process(target=run_session, name=f"loadtest-session-{index}",
+                                 args=(index, db_path, iterations, think_time, results, start_barrier))
+                 for index in range(sessions)]
+    for process in processes:
+        process.start()
+    try:
+        start_barrier.wait(timeout=RERUN_TIMEOUT)
+    except threading.BrokenBarrierError:
+        for process in processes:
+            process.terminate()
+        raise RuntimeError("The sessions did not start; run one session to see why")
+    started = time.perf_counter()
+    finished = []
+    for _ in processes:
+        try:
+            finished.append(results.get(timeout=SESSION_TIMEOUT))
+        except queue.Empty:
+            break
+    seconds = time.perf_counter() - started
+    for process in processes:
+        process.join(timeout=RERUN_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+
+    by_kind = {}
+    for session in finished:
+        for kind, latencies in session["latencies"].items():
+            by_kind.setdefault(kind, []).extend(latencies)
+    every_rerun = [latency for latencies in by_kind.values() for latency in latencies]
+    reruns = sum(session["reruns"] for session in finished)
+    errors = [error for session in finished for error in session["errors"]]
+    return {
+        "sessions": sessions,
+        "sessions_failed": sessions - len(finished),
+        "iterations": iterations,
+        "think_time": think_time,
+        "seconds": seconds,
+        "reruns": reruns,
+        "reruns_per_second": reruns / seconds,
+        "latency": _percentiles(every_rerun) if every_rerun else None,
+        "latency_by_action": {kind: _percentiles(latencies) for kind, latencies in sorted(by_kind.items())},
+        "lock_errors": sum(session["lock_errors"] for session in finished),
+        "errors": len(errors),
+        "first_errors": errors[:10],
+        "app_memory_mb": statistics.median(session["app_memory_mb"] for session in finished) if finished else None,
+        "memory_per_session_mb": statistics.median(session["memory_mb"] for session in finished) if finished else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the FarmFlow pages with concurrent simulated sessions")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[DEFAULT_SESSIONS],
+                        help="concurrent sessions; several values run one test each")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--think-time", type=float, default=THINK_TIME)
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS,
+                        help="rows in the generated database (0 to use --database as it is)")
+    parser.add_argument("--database", help="database to test against when --rows is 0")
+    parser.add_argument("--workdir", default=tempfile.gettempdir())
+    parser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    db_path = args.database
+    generated = None
+    if args.rows:
+        generated = db_path = os.path.join(args.workdir, f"farm_loadtest_{args.rows}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        create_synthetic_database(db_path, args.rows)
+    try:
+        report = {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "rows": args.rows,
+            "results": [run_load_test(sessions, args.iterations, args.think_time, db_path)
+                        for sessions in args.sessions],
+        }
+    finally:
+        if generated:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(generated + suffix):
+                    os.remove(generated + suffix)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,69 @@
-import streamlit as st
-import sqlite3
 import os
+import sqlite3
+import streamlit as st
 import pandas as pd
-from database_setup import create_database
-import matplotlib.pyplot as plt
-
-
-# Define connection function
-def get_connection():
-    db_path = 'farm_management.db'
-    if not os.path.exists(db_path):
-        create_database()
-    return sqlite3.connect(db_path)
-
-
-# Define CRUD functions for each table
-def add_record(table, data):
-    conn = get_connection()
-    cursor = conn.cursor()
-    placeholders = ', '.join('?' * len(data))
-    cursor.execute(f"INSERT INTO {table} VALUES (NULL, {placeholders})", data)
-    conn.commit()
-    conn.close()
-
-
-def update_record(table, set_values, condition):
-    conn = get_connection()
-    cursor = conn.cursor()
-    set_clause = ', '.join([f"{col} = ?" for col in set_values.keys()])
-    condition_clause = ' AND '.join([f"{col} = ?" for col in condition.keys()])
-    values = list(set_values.values()) + list(condition.values())
-    cursor.execute(f"UPDATE {table} SET {set_clause} WHERE {condition_clause}", values)
-    conn.commit()
-    conn.close()
-
-
-def delete_record(table, condition):
-    conn = get_connection()
-    cursor = conn.cursor()
-    condition_clause = ' AND '.join([f"{col} = ?" for col in condition.keys()])
-    values = list(condition.values())
-    cursor.execute(f"DELETE FROM {table} WHERE {condition_clause}", values)
-    conn.commit()
-    conn.close()
-
-
-def fetch_data(query, params=()):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    data = cursor.fetchall()
-    conn.close()
-    return data
+import archive
+import backup
+import diagnostics
+import maintenance
+import shards
+from db import (use_database, load_demo_data, add_record, add_records, update_record, delete_record, fetch_data,
+                table_statistics)
+from columnar import fetch_frame
+from analytics import yield_analytics
+from charts import (GRANULARITIES, HARVEST_QUERIES, MAX_POINTS, downsample, finance_series, harvest_series,
+                    report_date_bounds)
+from market import FREQUENCIES, REVENUE_GROUPS, price_series, estimated_revenue
+from query_cache import cache_stats
+from pagination import show_paginated_table
+from editing import show_edit_grid
+from bulk_import import IMPORT_TABLES, import_file
+from export import REPORT_QUERIES, list_tables, export_to_tempfile, remove_tempfile
+from filters import crop_filter, id_filter, date_range_filter, text_search, combine_filters
+
+
+# Each section of a page is its own fragment, so widgets inside it rerun only
+# that section. A section's queries run only while its toggle is switched on.
+def lazy_section(label, key, visible=False):
+    # Fragment reruns skip main(), so select the farm and attribute queries to the page again
+    use_database(shards.farm_path(st.session_state.get("farm")))
+    diagnostics.set_page(st.session_state.get("page"))
+    return st.toggle(label, value=visible, key=key)
+
+
+def saved(message):
+    # A write changes what the other sections show, so rerun the whole page
+    st.session_state["flash"] = message
+    st.rerun()
+
+
+def archived_records(table, key_column, where, params, date_range):
+    # Rows of archived years are no longer in the live table; list those in range
+    if not date_range:
+        return
+    start, end = date_range[0], date_range[-1]
+    years = archive.archived_years(start, end)
+    if not years:
+        return
+    with st.expander(f"Archived records from {', '.join(map(str, years))}"):
+        df = archive.fetch_frame(f"SELECT * FROM {table} WHERE ({where}) ORDER BY {key_column} LIMIT ?",
+                                 [*params, archive.PREVIEW_ROWS], start, end, include_live=False)
+        if len(df) > archive.PREVIEW_ROWS:
+            st.caption(f"Showing the first {archive.PREVIEW_ROWS:,} archived records.")
+        dates = {name: st.column_config.DateColumn() for name in df.columns
+                 if str(df[name].dtype).startswith("datetime")}
+        st.dataframe(df.drop(columns="RowVersion", errors="ignore").head(archive.PREVIEW_ROWS), hide_index=True,
+                     column_config=dates)
+
+
+@st.fragment
+def edit_grid_section(table, key_column, label="Edit in Grid"):
+    if not lazy_section(label, f"{table.lower()}_edit_grid"):
+        return
+    with st.container(border=True):
+        changed = show_edit_grid(table.lower(), table, key_column)
+        if changed:
+            saved(f"{changed} changes saved successfully!")
 
 
 # Define pages
@@ -59,29 +71,42 @@ def show_home():
     st.title("Welcome to FarmFlow Ghana")
     st.markdown("### Our Motto")
     st.markdown("**Empowering Farmers, Enhancing Yields, Ensuring Prosperity**")
-
-
-def show_crop_planning():
-    st.title("Crop Planning")
-    st.write("Manage crop planning here.")
-    search_query = st.text_input("Search Crops")
-
-    with st.expander("View Crops"):
-        query = "SELECT * FROM Crop WHERE Name LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%',))
-        df = pd.DataFrame(data, columns=["CropID", "Name", "Type", "GrowthDuration"])
-        st.write(df)
-
-    with st.expander("Add Crop"):
+    if not fetch_data("SELECT 1 FROM Crop LIMIT 1"):
+        st.info("This farm has no records yet. Add them from the pages in the sidebar, import a file, "
+                "or start from the sample farm.")
+        if st.button("Load Demo Data"):
+            load_demo_data()
+            saved("Demo data loaded.")
+
+
+@st.fragment
+def view_crops_section():
+    if not lazy_section("View Crops", "view_crops"):
+        return
+    with st.container(border=True):
+        search_query = st.text_input("Search Crops")
+        show_paginated_table("crops", "Crop", "CropID", search=text_search("Crop", search_query))
+
+
+@st.fragment
+def add_crop_section():
+    if not lazy_section("Add Crop", "add_crop"):
+        return
+    with st.container(border=True):
         with st.form("add_crop_form"):
             name = st.text_input("Crop Name")
             type_ = st.text_input("Type")
             growth_duration = st.number_input("Growth Duration", min_value=1)
             if st.form_submit_button("Add Crop"):
-                add_record("Crop", (name, type_, growth_duration))
-                st.success("Crop added successfully!")
+                add_record("Crop", {"Name": name, "Type": type_, "GrowthDuration": growth_duration})
+                saved("Crop added successfully!")
 
-    with st.expander("Update Crop"):
+
+@st.fragment
+def update_crop_section():
+    if not lazy_section("Update Crop", "update_crop"):
+        return
+    with st.container(border=True):
         with st.form("update_crop_form"):
             crop_id = st.number_input("Crop ID to update", min_value=1)
             name = st.text_input("New Crop Name")
@@ -90,38 +115,61 @@ def show_crop_planning():
             if st.form_submit_button("Update Crop"):
                 update_record("Crop", {"Name": name, "Type": type_, "GrowthDuration": growth_duration},
                               {"CropID": crop_id})
-                st.success("Crop updated successfully!")
+                saved("Crop updated successfully!")
+
 
-    with st.expander("Delete Crop"):
+@st.fragment
+def delete_crop_section():
+    if not lazy_section("Delete Crop", "delete_crop"):
+        return
+    with st.container(border=True):
         with st.form("delete_crop_form"):
             crop_id = st.number_input("Crop ID to delete", min_value=1)
             if st.form_submit_button("Delete Crop"):
                 delete_record("Crop", {"CropID": crop_id})
-                st.success("Crop deleted successfully!")
-
+                saved("Crop deleted successfully!")
 
-def show_inventory_management():
-    st.title("Inventory Management")
-    st.write("Track and manage inventory here.")
-    search_query = st.text_input("Search Inventory")
 
-    with st.expander("View Inventory"):
-        query = "SELECT * FROM Inventory WHERE ItemName LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%',))
-        df = pd.DataFrame(data, columns=["InventoryID", "ItemName", "Quantity", "Type", "PurchaseDate"])
-        st.write(df)
-
-    with st.expander("Add Inventory Item"):
+def show_crop_planning():
+    st.title("Crop Planning")
+    st.write("Manage crop planning here.")
+    view_crops_section()
+    add_crop_section()
+    update_crop_section()
+    delete_crop_section()
+    edit_grid_section("Crop", "CropID")
+
+
+@st.fragment
+def view_inventory_section():
+    if not lazy_section("View Inventory", "view_inventory"):
+        return
+    with st.container(border=True):
+        search_query = st.text_input("Search Inventory")
+        show_paginated_table("inventory", "Inventory", "InventoryID", search=text_search("Inventory", search_query))
+
+
+@st.fragment
+def add_inventory_item_section():
+    if not lazy_section("Add Inventory Item", "add_inventory_item"):
+        return
+    with st.container(border=True):
         with st.form("add_inventory_form"):
             item_name = st.text_input("Item Name")
             quantity = st.number_input("Quantity", min_value=1)
             type_ = st.text_input("Type")
             purchase_date = st.date_input("Purchase Date")
             if st.form_submit_button("Add Inventory Item"):
-                add_record("Inventory", (item_name, quantity, type_, purchase_date.isoformat()))
-                st.success("Inventory item added successfully!")
+                add_record("Inventory", {"ItemName": item_name, "Quantity": quantity, "Type": type_,
+                                         "PurchaseDate": purchase_date.isoformat()})
+                saved("Inventory item added successfully!")
+
 
-    with st.expander("Update Inventory Item"):
+@st.fragment
+def update_inventory_item_section():
+    if not lazy_section("Update Inventory Item", "update_inventory_item"):
+        return
+    with st.container(border=True):
         with st.form("update_inventory_form"):
             inventory_id = st.number_input("Inventory ID to update", min_value=1)
             item_name = st.text_input("New Item Name")
@@ -131,37 +179,128 @@ def show_inventory_management():
             if st.form_submit_button("Update Inventory Item"):
                 update_record("Inventory", {"ItemName": item_name, "Quantity": quantity, "Type": type_,
                                             "PurchaseDate": purchase_date.isoformat()}, {"InventoryID": inventory_id})
-                st.success("Inventory item updated successfully!")
+                saved("Inventory item updated successfully!")
 
-    with st.expander("Delete Inventory Item"):
+
+@st.fragment
+def delete_inventory_item_section():
+    if not lazy_section("Delete Inventory Item", "delete_inventory_item"):
+        return
+    with st.container(border=True):
         with st.form("delete_inventory_form"):
             inventory_id = st.number_input("Inventory ID to delete", min_value=1)
             if st.form_submit_button("Delete Inventory Item"):
                 delete_record("Inventory", {"InventoryID": inventory_id})
-                st.success("Inventory item deleted successfully!")
-
-
-def show_financial_records():
-    st.title("Financial Records")
-    st.write("Manage financial records here.")
-    search_query = st.text_input("Search Financial Records")
+                saved("Inventory item deleted successfully!")
+
+
+@st.fragment
+def stock_levels_section():
+    if not lazy_section("View Stock Levels", "view_stock_levels"):
+        return
+    with st.container(border=True):
+        # Stock, burn rate and days left come from the ledger kept by triggers
+        # on InventoryUsage, one row per item
+        days = st.number_input("Running out within (days, 0 for all)", min_value=0)
+        where, params = combine_filters(("DaysLeft <= ?", [days]) if days else None)
+        show_paginated_table("stock", "InventoryStock", "InventoryID", where, params)
+
+
+@st.fragment
+def record_usage_section():
+    if not lazy_section("Record Usage", "record_usage"):
+        return
+    with st.container(border=True):
+        with st.form("record_usage_form"):
+            inventory_id = st.number_input("Inventory ID", min_value=1)
+            usage_date = st.date_input("Usage Date")
+            quantity_used = st.number_input("Quantity Used", min_value=1)
+            if st.form_submit_button("Record Usage"):
+                add_record("InventoryUsage", {"InventoryID": inventory_id, "UsageDate": usage_date.isoformat(),
+                                              "QuantityUsed": quantity_used})
+                saved("Usage recorded successfully!")
+
+
+@st.fragment
+def bulk_usage_entry_section():
+    if not lazy_section("Bulk Usage Entry", "bulk_usage_entry"):
+        return
+    with st.container(border=True):
+        st.caption("One row per usage; the rows are recorded together, or none of them if any is rejected.")
+        empty = pd.DataFrame({"InventoryID": pd.Series(dtype="Int64"), "UsageDate": pd.Series(dtype="object"),
+                              "QuantityUsed": pd.Series(dtype="Int64")})
+        entries = st.data_editor(empty, num_rows="dynamic", hide_index=True, key="bulk_usage_editor",
+                                 column_config={"InventoryID": st.column_config.NumberColumn(min_value=1, step=1),
+                                                "UsageDate": st.column_config.DateColumn(),
+                                                "QuantityUsed": st.column_config.NumberColumn(min_value=1, step=1)})
+        if st.button("Record Usages", disabled=entries.empty):
+            entries = entries.dropna(how="all")
+            if entries.isna().any(axis=None):
+                st.error("Every row needs an inventory ID, a date and a quantity.")
+                return
+            ids = sorted({int(value) for value in entries["InventoryID"]})
+            known = {row[0] for row in fetch_data(
+                f"SELECT InventoryID FROM Inventory WHERE InventoryID IN ({', '.join('?' * len(ids))})", ids)}
+            unknown = [value for value in ids if value not in known]
+            if unknown:
+                st.error(f"Unknown inventory IDs: {', '.join(map(str, unknown))}")
+                return
+            rows = [(int(item), date.isoformat(), int(quantity)) for item, date, quantity
+                    in entries[["InventoryID", "UsageDate", "QuantityUsed"]].itertuples(index=False)]
+            try:
+                add_records("InventoryUsage", ["InventoryID", "UsageDate", "QuantityUsed"], rows)
+            except sqlite3.Error as error:
+                st.error(f"Nothing was recorded: {error}")
+            else:
+                del st.session_state["bulk_usage_editor"]
+                saved(f"{len(rows)} usages recorded successfully!")
 
-    with st.expander("View Financial Records"):
-        query = "SELECT * FROM FinancialRecord WHERE RecordDate LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%',))
-        df = pd.DataFrame(data, columns=["RecordID", "RecordDate", "Income", "Expenses"])
-        st.write(df)
 
-    with st.expander("Add Financial Record"):
+def show_inventory_management():
+    st.title("Inventory Management")
+    st.write("Track and manage inventory here.")
+    view_inventory_section()
+    add_inventory_item_section()
+    update_inventory_item_section()
+    delete_inventory_item_section()
+    edit_grid_section("Inventory", "InventoryID")
+    stock_levels_section()
+    record_usage_section()
+    bulk_usage_entry_section()
+    edit_grid_section("InventoryUsage", "UsageID", "Edit Usages in Grid")
+
+
+@st.fragment
+def view_financial_records_section():
+    if not lazy_section("View Financial Records", "view_financial_records"):
+        return
+    with st.container(border=True):
+        date_range = st.date_input("Record Date Range", value=[])
+        where, params = combine_filters(date_range_filter("RecordDate", date_range))
+        show_paginated_table("financial_records", "FinancialRecord", "RecordID", where, params)
+        archived_records("FinancialRecord", "RecordID", where, params, date_range)
+
+
+@st.fragment
+def add_financial_record_section():
+    if not lazy_section("Add Financial Record", "add_financial_record"):
+        return
+    with st.container(border=True):
         with st.form("add_financial_record_form"):
             record_date = st.date_input("Record Date")
             income = st.number_input("Income", min_value=0.0)
             expenses = st.number_input("Expenses", min_value=0.0)
             if st.form_submit_button("Add Financial Record"):
-                add_record("FinancialRecord", (record_date.isoformat(), income, expenses))
-                st.success("Financial record added successfully!")
+                add_record("FinancialRecord", {"RecordDate": record_date.isoformat(), "Income": income,
+                                               "Expenses": expenses})
+                saved("Financial record added successfully!")
 
-    with st.expander("Update Financial Record"):
+
+@st.fragment
+def update_financial_record_section():
+    if not lazy_section("Update Financial Record", "update_financial_record"):
+        return
+    with st.container(border=True):
         with st.form("update_financial_record_form"):
             record_id = st.number_input("Record ID to update", min_value=1)
             record_date = st.date_input("New Record Date")
@@ -171,38 +310,67 @@ def show_financial_records():
                 update_record("FinancialRecord",
                               {"RecordDate": record_date.isoformat(), "Income": income, "Expenses": expenses},
                               {"RecordID": record_id})
-                st.success("Financial record updated successfully!")
+                saved("Financial record updated successfully!")
+
 
-    with st.expander("Delete Financial Record"):
+@st.fragment
+def delete_financial_record_section():
+    if not lazy_section("Delete Financial Record", "delete_financial_record"):
+        return
+    with st.container(border=True):
         with st.form("delete_financial_record_form"):
             record_id = st.number_input("Record ID to delete", min_value=1)
             if st.form_submit_button("Delete Financial Record"):
                 delete_record("FinancialRecord", {"RecordID": record_id})
-                st.success("Financial record deleted successfully!")
+                saved("Financial record deleted successfully!")
 
 
-def show_harvest_tracking():
-    st.title("Harvest Tracking")
-    st.write("Track and compare harvest yields here.")
-    search_query = st.text_input("Search Harvest Records")
-
-    with st.expander("View Harvest Records"):
-        query = "SELECT * FROM Harvest WHERE CropID LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%',))
-        df = pd.DataFrame(data, columns=["HarvestID", "CropID", "PlotID", "HarvestDate", "Quantity"])
-        st.write(df)
-
-    with st.expander("Add Harvest Record"):
+def show_financial_records():
+    st.title("Financial Records")
+    st.write("Manage financial records here.")
+    view_financial_records_section()
+    add_financial_record_section()
+    update_financial_record_section()
+    delete_financial_record_section()
+    edit_grid_section("FinancialRecord", "RecordID")
+
+
+@st.fragment
+def view_harvest_records_section():
+    if not lazy_section("View Harvest Records", "view_harvest_records"):
+        return
+    with st.container(border=True):
+        col1, col2, col3 = st.columns(3)
+        crop_term = col1.text_input("Crop ID or Name")
+        plot_id = col2.number_input("Plot ID (0 for all)", min_value=0)
+        date_range = col3.date_input("Harvest Date Range", value=[])
+        where, params = combine_filters(crop_filter(crop_term), id_filter("PlotID", plot_id),
+                                        date_range_filter("HarvestDate", date_range))
+        show_paginated_table("harvests", "Harvest", "HarvestID", where, params)
+        archived_records("Harvest", "HarvestID", where, params, date_range)
+
+
+@st.fragment
+def add_harvest_record_section():
+    if not lazy_section("Add Harvest Record", "add_harvest_record"):
+        return
+    with st.container(border=True):
         with st.form("add_harvest_form"):
             crop_id = st.number_input("Crop ID", min_value=1)
             plot_id = st.number_input("Plot ID", min_value=1)
             harvest_date = st.date_input("Harvest Date")
             quantity = st.number_input("Quantity", min_value=1)
             if st.form_submit_button("Add Harvest Record"):
-                add_record("Harvest", (crop_id, plot_id, harvest_date.isoformat(), quantity))
-                st.success("Harvest record added successfully!")
+                add_record("Harvest", {"CropID": crop_id, "PlotID": plot_id, "HarvestDate": harvest_date.isoformat(),
+                                       "Quantity": quantity})
+                saved("Harvest record added successfully!")
 
-    with st.expander("Update Harvest Record"):
+
+@st.fragment
+def update_harvest_record_section():
+    if not lazy_section("Update Harvest Record", "update_harvest_record"):
+        return
+    with st.container(border=True):
         with st.form("update_harvest_form"):
             harvest_id = st.number_input("Harvest ID to update", min_value=1)
             crop_id = st.number_input("New Crop ID", min_value=1)
@@ -213,37 +381,64 @@ def show_harvest_tracking():
                 update_record("Harvest", {"CropID": crop_id, "PlotID": plot_id, "HarvestDate": harvest_date.isoformat(),
                                           "Quantity": quantity},
                               {"HarvestID": harvest_id})
-                st.success("Harvest record updated successfully!")
+                saved("Harvest record updated successfully!")
+
 
-    with st.expander("Delete Harvest Record"):
+@st.fragment
+def delete_harvest_record_section():
+    if not lazy_section("Delete Harvest Record", "delete_harvest_record"):
+        return
+    with st.container(border=True):
         with st.form("delete_harvest_form"):
             harvest_id = st.number_input("Harvest ID to delete", min_value=1)
             if st.form_submit_button("Delete Harvest Record"):
                 delete_record("Harvest", {"HarvestID": harvest_id})
-                st.success("Harvest record deleted successfully!")
+                saved("Harvest record deleted successfully!")
 
 
-def show_market_info():
-    st.title("Market Information")
-    st.write("Manage market data and pricing here.")
-    search_query = st.text_input("Search Market Information")
-
-    with st.expander("View Market Information"):
-        query = "SELECT * FROM MarketInfo WHERE CropID LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%',))
-        df = pd.DataFrame(data, columns=["MarketInfoID", "CropID", "MarketDate", "PricePerUnit"])
-        st.write(df)
-
-    with st.expander("Add Market Information"):
+def show_harvest_tracking():
+    st.title("Harvest Tracking")
+    st.write("Track and compare harvest yields here.")
+    view_harvest_records_section()
+    add_harvest_record_section()
+    update_harvest_record_section()
+    delete_harvest_record_section()
+    edit_grid_section("Harvest", "HarvestID")
+
+
+@st.fragment
+def view_market_information_section():
+    if not lazy_section("View Market Information", "view_market_information"):
+        return
+    with st.container(border=True):
+        col1, col2 = st.columns(2)
+        crop_term = col1.text_input("Crop ID or Name")
+        date_range = col2.date_input("Market Date Range", value=[])
+        where, params = combine_filters(crop_filter(crop_term), date_range_filter("MarketDate", date_range))
+        show_paginated_table("market_info", "MarketInfo", "MarketInfoID", where, params)
+        archived_records("MarketInfo", "MarketInfoID", where, params, date_range)
+
+
+@st.fragment
+def add_market_information_section():
+    if not lazy_section("Add Market Information", "add_market_information"):
+        return
+    with st.container(border=True):
         with st.form("add_market_info_form"):
             crop_id = st.number_input("Crop ID", min_value=1)
             market_date = st.date_input("Market Date")
             price_per_unit = st.number_input("Price Per Unit", min_value=0.0)
             if st.form_submit_button("Add Market Information"):
-                add_record("MarketInfo", (crop_id, market_date.isoformat(), price_per_unit))
-                st.success("Market information added successfully!")
+                add_record("MarketInfo", {"CropID": crop_id, "MarketDate": market_date.isoformat(),
+                                          "PricePerUnit": price_per_unit})
+                saved("Market information added successfully!")
+
 
-    with st.expander("Update Market Information"):
+@st.fragment
+def update_market_information_section():
+    if not lazy_section("Update Market Information", "update_market_information"):
+        return
+    with st.container(border=True):
         with st.form("update_market_info_form"):
             market_info_id = st.number_input("MarketInfo ID to update", min_value=1)
             crop_id = st.number_input("New Crop ID", min_value=1)
@@ -253,38 +448,98 @@ def show_market_info():
                 update_record("MarketInfo", {"CropID": crop_id, "MarketDate": market_date.isoformat(),
                                              "PricePerUnit": price_per_unit},
                               {"MarketInfoID": market_info_id})
-                st.success("Market information updated successfully!")
+                saved("Market information updated successfully!")
 
-    with st.expander("Delete Market Information"):
+
+@st.fragment
+def delete_market_information_section():
+    if not lazy_section("Delete Market Information", "delete_market_information"):
+        return
+    with st.container(border=True):
         with st.form("delete_market_info_form"):
             market_info_id = st.number_input("MarketInfo ID to delete", min_value=1)
             if st.form_submit_button("Delete Market Information"):
                 delete_record("MarketInfo", {"MarketInfoID": market_info_id})
-                st.success("Market information deleted successfully!")
+                saved("Market information deleted successfully!")
+
+
+@st.fragment
+def price_trends_section():
+    if not lazy_section("Price Trends", "price_trends"):
+        return
+    with st.container(border=True):
+        crops = fetch_data("SELECT CropID, Name FROM Crop ORDER BY Name")
+        if not crops:
+            st.info("Add crops to see their prices.")
+            return
+        col1, col2, col3 = st.columns(3)
+        crop = col1.selectbox("Crop", crops, format_func=lambda crop: f"{crop[1]} (ID {crop[0]})")
+        frequency = col2.selectbox("Resample", list(FREQUENCIES), index=1)
+        window = col3.number_input("Rolling window (periods)", min_value=2, value=4)
+        series = price_series(crop[0], FREQUENCIES[frequency], window)
+        if series.empty:
+            st.info("No prices recorded for this crop.")
+            return
+        st.line_chart(series[["Price", "RollingMean"]])
+        st.caption("Volatility: rolling standard deviation of log price changes")
+        st.line_chart(series["Volatility"])
+
+
+@st.fragment
+def estimated_revenue_section():
+    if not lazy_section("Estimated Harvest Revenue", "estimated_revenue"):
+        return
+    with st.container(border=True):
+        st.caption("Each harvest valued at its crop's most recent market price on the harvest date.")
+        group_by = st.radio("Group by", list(REVENUE_GROUPS), horizontal=True)
+        df = estimated_revenue(group_by)
+        st.dataframe(df, hide_index=True)
+        if group_by == "Month":
+            st.bar_chart(df, x="Month", y="Revenue")
 
 
-def show_employee_management():
-    st.title("Employee Management")
-    st.write("Manage employees and their details here.")
-    search_query = st.text_input("Search Employees")
-
-    with st.expander("View Employees"):
-        query = "SELECT * FROM Employee WHERE FirstName LIKE ? OR LastName LIKE ?"
-        data = fetch_data(query, ('%' + search_query + '%', '%' + search_query + '%'))
-        df = pd.DataFrame(data, columns=["EmployeeID", "FirstName", "LastName", "Role", "HireDate"])
-        st.write(df)
-
-    with st.expander("Add Employee"):
+def show_market_info():
+    st.title("Market Information")
+    st.write("Manage market data and pricing here.")
+    view_market_information_section()
+    add_market_information_section()
+    update_market_information_section()
+    delete_market_information_section()
+    edit_grid_section("MarketInfo", "MarketInfoID")
+    price_trends_section()
+    estimated_revenue_section()
+
+
+@st.fragment
+def view_employees_section():
+    if not lazy_section("View Employees", "view_employees"):
+        return
+    with st.container(border=True):
+        search_query = st.text_input("Search Employees")
+        show_paginated_table("employees", "Employee", "EmployeeID", search=text_search("Employee", search_query))
+
+
+@st.fragment
+def add_employee_section():
+    if not lazy_section("Add Employee", "add_employee"):
+        return
+    with st.container(border=True):
         with st.form("add_employee_form"):
             first_name = st.text_input("First Name")
             last_name = st.text_input("Last Name")
             role = st.text_input("Role")
             hire_date = st.date_input("Hire Date")
             if st.form_submit_button("Add Employee"):
-                add_record("Employee", (first_name, last_name, role, hire_date.isoformat()))
-                st.success("Employee added successfully!")
+                add_record("Employee", {"FirstName": first_name, "LastName": last_name, "Role": role,
+                                        "HireDate": hire_date.isoformat()})
+                saved("Employee added successfully!")
+
 
-    with st.expander("Update Employee"):
+@st.fragment
+def update_employee_section():
+    if not lazy_section("Update Employee", "update_employee"):
+        return
+    with st.container(border=True):
         with st.form("update_employee_form"):
             employee_id = st.number_input("Employee ID to update", min_value=1)
             first_name = st.text_input("New First Name")
@@ -295,58 +550,390 @@ def show_employee_management():
                 update_record("Employee", {"FirstName": first_name, "LastName": last_name, "Role": role,
                                            "HireDate": hire_date.isoformat()},
                               {"EmployeeID": employee_id})
-                st.success("Employee updated successfully!")
+                saved("Employee updated successfully!")
 
-    with st.expander("Delete Employee"):
+
+@st.fragment
+def delete_employee_section():
+    if not lazy_section("Delete Employee", "delete_employee"):
+        return
+    with st.container(border=True):
         with st.form("delete_employee_form"):
             employee_id = st.number_input("Employee ID to delete", min_value=1)
             if st.form_submit_button("Delete Employee"):
                 delete_record("Employee", {"EmployeeID": employee_id})
-                st.success("Employee deleted successfully!")
+                saved("Employee deleted successfully!")
+
+
+def show_employee_management():
+    st.title("Employee Management")
+    st.write("Manage employees and their details here.")
+    view_employees_section()
+    add_employee_section()
+    update_employee_section()
+    delete_employee_section()
+    edit_grid_section("Employee", "EmployeeID")
+
+
+def report_period(key, granularities):
+    # Date range and granularity controls shared by the report sections
+    bounds = report_date_bounds()
+    if bounds is None:
+        return None
+    col1, col2 = st.columns([2, 1])
+    date_range = col1.date_input("Date Range", value=bounds, min_value=bounds[0], max_value=bounds[1],
+                                 key=f"{key}_range")
+    granularity = col2.selectbox("Granularity", granularities, index=granularities.index("Monthly"),
+                                 key=f"{key}_granularity")
+    start = date_range[0] if date_range else bounds[0]
+    end = date_range[1] if len(date_range) > 1 else bounds[1]
+    return granularity, start, end
+
+
+@st.fragment
+def income_expenses_section():
+    if not lazy_section("Income vs Expenses", "report_income_expenses", visible=True):
+        return
+
+    # Totals per period come from the trigger-maintained daily and monthly summaries
+    period = report_period("finance", GRANULARITIES)
+    if period is None:
+        st.info("No financial records yet.")
+        return
+    df = finance_series(*period)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.dataframe(df, hide_index=True, column_config={"Period": st.column_config.DateColumn()})
+    with col2:
+        # Long series are reduced to MAX_POINTS per line with LTTB before they
+        # are sent to the browser
+        points = downsample(df, "Period", ["TotalIncome", "TotalExpenses"])
+        st.line_chart(points, x="Period", y="Value", color="Series")
+        if len(df) > MAX_POINTS:
+            st.caption(f"{len(df):,} periods shown as {MAX_POINTS:,} points per line")
+
+
+@st.fragment
+def harvest_by_crop_section():
+    if not lazy_section("Harvest by Crop", "report_harvest_by_crop", visible=True):
+        return
+
+    period = report_period("harvest", list(HARVEST_QUERIES))
+    if period is None:
+        st.info("No harvests yet.")
+        return
+    df = harvest_series(*period)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.dataframe(df, hide_index=True, column_config={"Period": st.column_config.DateColumn()})
+    with col2:
+        st.bar_chart(df, x="Period", y="TotalQuantity", color="Crop")
 
 
 def show_report():
     st.title("Reports")
     st.write("Generate and view reports here.")
+    income_expenses_section()
+    harvest_by_crop_section()
+
 
-    # Example report: Total income vs. total expenses
-    st.subheader("Income vs Expenses")
-
-    # Query to fetch data
-    query = """
-        SELECT strftime('%Y-%m', RecordDate) as Month, 
-               SUM(Income) as TotalIncome, 
-               SUM(Expenses) as TotalExpenses
-        FROM FinancialRecord
-        GROUP BY Month
-        ORDER BY Month
-    """
-    data = fetch_data(query)
-    df = pd.DataFrame(data, columns=["Month", "TotalIncome", "TotalExpenses"])
-
-    # Create columns for layout
+@st.fragment
+def yield_by_crop_section():
+    if not lazy_section("Yield by Crop", "yield_by_crop", visible=True):
+        return
+    df = yield_analytics()["by_crop"]
     col1, col2 = st.columns(2)
+    col1.dataframe(df, hide_index=True)
+    col2.bar_chart(df, x="Crop", y="YieldPerHectare")
 
-    # Table in the first column
-    with col1:
-        st.write(df)
 
-    # Line chart in the second column
-    with col2:
-        fig, ax = plt.subplots()
-        df.plot(x="Month", y=["TotalIncome", "TotalExpenses"], kind="line", ax=ax, marker='o')
-        plt.title("Monthly Income vs Expenses")
-        plt.xlabel("Month")
-        plt.ylabel("Amount")
-        st.pyplot(fig)
+@st.fragment
+def yield_by_plot_section():
+    if not lazy_section("Yield by Plot", "yield_by_plot"):
+        return
+    st.dataframe(yield_analytics()["by_plot"], hide_index=True)
 
 
+@st.fragment
+def yield_by_season_section():
+    if not lazy_section("Yield by Season", "yield_by_season"):
+        return
+    df = yield_analytics()["by_season"]
+    season = df["Year"].astype(str) + " " + df["Season"].astype(str)
+    col1, col2 = st.columns(2)
+    col1.dataframe(df, hide_index=True)
+    col2.line_chart(df.assign(Season=season), x="Season", y="YieldPerHectare", color="Crop")
+
+
+@st.fragment
+def cycle_length_section():
+    if not lazy_section("Cycle Length vs Growth Duration", "cycle_length"):
+        return
+    st.caption("Days from planting to harvest against each crop's expected growth duration. "
+               "LateShare is the share of harvests more than 20% later than expected.")
+    st.dataframe(yield_analytics()["cycles"], hide_index=True)
+
+
+@st.fragment
+def yield_outliers_section():
+    if not lazy_section("Yield Outliers", "yield_outliers"):
+        return
+    st.caption("Harvests whose yield per hectare is far from the median for their crop.")
+    st.dataframe(yield_analytics()["outliers"], hide_index=True,
+                 column_config={"HarvestDate": st.column_config.DateColumn()})
+
+
+def show_yield_analytics():
+    st.title("Yield Analytics")
+    st.write("Yield per hectare, planting-to-harvest conversion and crop cycle lengths.")
+
+    results = yield_analytics()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Harvests", f"{results['harvests']:,}")
+    col2.metric("Matched to a Planting", f"{results['matched']:,}")
+    col3.metric("Median Yield per Hectare", f"{results['median_yield']:,.1f}")
+    col4.metric("Outliers", f"{len(results['outliers']):,}")
+
+    yield_by_crop_section()
+    yield_by_plot_section()
+    yield_by_season_section()
+    cycle_length_section()
+    yield_outliers_section()
+
+
+def show_data_import():
+    st.title("Data Import")
+    st.write("Load harvest sheets, market prices and other records from CSV or Parquet files.")
+
+    table = st.selectbox("Table", list(IMPORT_TABLES))
+    st.caption("Expected columns: " + ", ".join(IMPORT_TABLES[table]["columns"]))
+    uploaded_file = st.file_uploader("File", type=["csv", "parquet"])
+    stop_on_error = st.checkbox("Import nothing if any row is invalid")
+
+    if uploaded_file is not None and st.button("Import"):
+        progress_bar = st.progress(0.0)
+        status = st.empty()
+
+        def show_progress(report, fraction):
+            if fraction is not None:
+                progress_bar.progress(fraction)
+            status.write(f"{report['rows_read']:,} rows read, {report['rows_rejected']:,} rejected")
+
+        try:
+            report = import_file(uploaded_file, table, progress=show_progress,
+                                 on_error="abort" if stop_on_error else "skip")
+        except ValueError as error:
+            st.error(f"Import failed: {error}")
+        else:
+            progress_bar.progress(1.0)
+            st.success(f"Imported {report['rows_inserted']:,} rows into {table} in {report['seconds']:.1f}s "
+                       f"({report['rows_per_second']:,.0f} rows/s)")
+            if report["errors"]:
+                st.warning(f"{report['rows_rejected']:,} rows were skipped")
+                st.dataframe(pd.DataFrame(report["errors"]), hide_index=True)
+
+
+def show_data_export():
+    st.title("Data Export")
+    st.write("Download any table or report as Parquet or CSV.")
+
+    name = st.selectbox("Table or report", list_tables() + list(REPORT_QUERIES))
+    file_format = st.radio("Format", ["parquet", "csv"], horizontal=True)
+
+    prepared = st.session_state.get("export_file")
+    if st.button("Prepare Export"):
+        if prepared is not None:
+            remove_tempfile(prepared[2])
+        with st.spinner("Exporting..."):
+            prepared = (name, file_format, export_to_tempfile(name, file_format))
+            st.session_state["export_file"] = prepared
+
+    if prepared is not None and not os.path.exists(prepared[2]):
+        # Swept away after EXPORT_MAX_AGE; it has to be prepared again
+        prepared = st.session_state["export_file"] = None
+    if prepared is not None and prepared[:2] == (name, file_format):
+        with open(prepared[2], "rb") as export_file:
+            st.download_button("Download", export_file, file_name=f"{name.replace(' ', '_')}.{file_format}",
+                               mime="application/octet-stream")
+
+
+def show_diagnostics():
+    st.title("Diagnostics")
+    st.write("Query latency, cache efficiency and table sizes for this server process.")
+
+    col1, col2, col3 = st.columns(3)
+    diagnostics.enabled = col1.toggle("Trace queries", value=diagnostics.enabled)
+    diagnostics.slow_query_ms = col2.number_input("Slow query threshold (ms)", min_value=0.0,
+                                                  value=float(diagnostics.slow_query_ms))
+    if col3.button("Reset statistics"):
+        diagnostics.reset()
+
+    st.subheader("Query Latency")
+    stats = diagnostics.query_stats()
+    if stats:
+        st.dataframe(pd.DataFrame(stats), hide_index=True)
+    else:
+        st.info("No queries recorded yet." if diagnostics.enabled else "Switch on Trace queries to record them.")
+
+    st.subheader("Result Cache")
+    cache = cache_stats()
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Hit Rate", f"{cache['hit_rate']:.0%}")
+    col2.metric("Entries", cache["entries"])
+    col3.metric("Size", f"{cache['bytes'] / 2 ** 20:,.1f} MB")
+    col4.metric("Invalidations", cache["invalidations"])
+    col5.metric("Evictions", cache["evictions"])
+
+    st.subheader("Slow Queries")
+    slow = diagnostics.slow_queries()
+    if not slow:
+        st.info(f"No queries slower than {diagnostics.slow_query_ms:g} ms.")
+    for entry in reversed(slow):
+        with st.expander(f"{entry['ms']:.1f} ms · {entry['page']} · {entry['time']}"):
+            st.code(entry["sql"], language="sql")
+            st.code("\n".join(entry["plan"]))
+
+    st.subheader("Largest Tables")
+    measure_sizes = st.checkbox("Measure on-disk sizes (reads the whole database)")
+    st.dataframe(pd.DataFrame(table_statistics(measure_sizes)), hide_index=True)
+
+
+@st.fragment
+def archive_section():
+    if not lazy_section("Archive Closed Years", "archive_years", visible=True):
+        return
+    with st.container(border=True):
+        st.caption(f"Rows dated in a closed year move to that year's archive file. The last {archive.HOT_YEARS} "
+                   "years stay live; reports and filtered views still include archived years.")
+        years = archive.closed_years()
+        if years:
+            col1, col2 = st.columns([2, 1])
+            year = col1.selectbox("Closed year", years, key="archive_year")
+            if col2.button("Archive Year"):
+                moved = archive.archive_year(year)
+                saved(f"Archived {sum(moved.values()):,} rows from {year}.")
+        else:
+            st.info("No closed years left to archive.")
+        summary = archive.archive_summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary), hide_index=True)
+
+
+@st.fragment
+def database_maintenance_section():
+    if not lazy_section("Database Maintenance", "database_maintenance", visible=True):
+        return
+    with st.container(border=True):
+        st.caption(f"A snapshot, change log compaction, ANALYZE, incremental vacuum and a WAL checkpoint run for "
+                   f"every farm each day at {maintenance.MAINTENANCE_HOUR:02d}:00.")
+        if st.button("Run Now"):
+            maintenance.run_maintenance()
+        runs = maintenance.last_runs()
+        if runs:
+            st.dataframe(pd.DataFrame(runs), hide_index=True)
+        else:
+            st.info("Maintenance has not run in this server process yet.")
+
+
+@st.fragment
+def backups_section():
+    if not lazy_section("Backups", "backups"):
+        return
+    with st.container(border=True):
+        st.caption(f"Snapshots are copied while the farm stays in use and kept for {backup.KEEP_DAILY} days, "
+                   f"{backup.KEEP_WEEKLY} weeks and {backup.KEEP_MONTHLY} months. Restore one with "
+                   "`python backup.py restore <file>`; the running app shows the restored data without a restart.")
+        if st.button("Back Up Now"):
+            manifest = backup.snapshot()
+            backup.prune()
+            saved(f"Saved {manifest['file']}.")
+        snapshots = backup.list_snapshots()
+        if not snapshots:
+            st.info("No snapshots of this farm yet.")
+            return
+        st.dataframe(pd.DataFrame([{"Snapshot": manifest["file"], "Created": manifest["created"],
+                                    "Size (MB)": manifest["bytes"] / 2 ** 20,
+                                    "Compressed (MB)": manifest["compressed_bytes"] / 2 ** 20}
+                                   for manifest in snapshots]), hide_index=True)
+        col1, col2 = st.columns([2, 1])
+        name = col1.selectbox("Snapshot", [manifest["file"] for manifest in snapshots], key="verify_snapshot")
+        if col2.button("Verify"):
+            try:
+                backup.verify(name)
+            except ValueError as error:
+                st.error(str(error))
+            else:
+                st.success(f"{name} matches its checksum and passes the integrity check.")
+
+
+def show_maintenance():
+    st.title("Maintenance")
+    st.write("Archive closed years, back up and keep the database files small.")
+    archive_section()
+    database_maintenance_section()
+    backups_section()
+
+
+def select_farm():
+    farms = shards.farm_names()
+    if "created_farm" in st.session_state:
+        st.session_state["farm"] = st.session_state.pop("created_farm")
+    if st.session_state.get("farm") not in farms:
+        st.session_state["farm"] = shards.MAIN_FARM
+    farm = st.sidebar.selectbox("Farm", farms, key="farm")
+    with st.sidebar.popover("Add a farm"):
+        with st.form("add_farm", clear_on_submit=True):
+            name = st.text_input("Farm name")
+            if st.form_submit_button("Create"):
+                try:
+                    st.session_state["created_farm"] = shards.create_farm(name)
+                except ValueError as error:
+                    st.error(str(error))
+                else:
+                    saved(f"Farm {name.strip()} created.")
+    use_database(shards.farm_path(farm))
+    return farm
+
+
+@st.fragment
+def consolidated_reports_section():
+    if not lazy_section("Consolidated Reports", "consolidated_reports", visible=True):
+        return
+    with st.container(border=True):
+        farms = shards.farm_names()
+        selected = st.multiselect("Farms", farms, default=farms, key="consolidated_farms")
+        report = st.selectbox("Report", list(shards.REPORTS), key="consolidated_report")
+        if not selected:
+            st.info("Select at least one farm.")
+            return
+        df = shards.consolidated(report, selected)
+        if df.empty:
+            st.info("No records yet on the selected farms.")
+        else:
+            st.dataframe(df, hide_index=True)
+
+
+def show_all_farms():
+    st.title("All Farms")
+    st.write("Figures from every farm's database, read in parallel and merged.")
+    consolidated_reports_section()
+
 
 def main():
+    maintenance.start_scheduler()
+    farm = select_farm()
     st.sidebar.title("Navigation")
     pages = ["Home", "Crop Planning", "Inventory Management", "Financial Records", "Harvest Tracking",
-             "Market Information", "Employee Management", "Report"]
-    selection = st.sidebar.radio("Go to", pages)
+             "Market Information", "Employee Management", "Report", "Yield Analytics", "All Farms",
+             "Data Import", "Data Export", "Diagnostics", "Maintenance"]
+    selection = st.sidebar.radio("Go to", pages, key="page")
+    diagnostics.set_page(selection)
+    st.sidebar.caption(f"Working on {farm}")
+
+    if "flash" in st.session_state:
+        st.toast(st.session_state.pop("flash"))
 
     if selection == "Home":
         show_home()
@@ -364,6 +951,18 @@ def main():
         show_employee_management()
     elif selection == "Report":
         show_report()
+    elif selection == "Yield Analytics":
+        show_yield_analytics()
+    elif selection == "All Farms":
+        show_all_farms()
+    elif selection == "Data Import":
+        show_data_import()
+    elif selection == "Data Export":
+        show_data_export()
+    elif selection == "Diagnostics":
+        show_diagnostics()
+    elif selection == "Maintenance":
+        show_maintenance()
 
 
 if __name__ == "__main__":
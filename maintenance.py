@@ -0,0 +1,116 @@
+import datetime
+import os
+import threading
+import time
+import archive
+import backup
+import db
+import export
+import query_cache
+import shards
+from database_setup import compact_change_log
+
+# Housekeeping for every farm's database, run once a day by a background
+# thread during the off-peak hour, or on demand from the Maintenance page
+MAINTENANCE_HOUR = int(os.environ.get("FARMFLOW_MAINTENANCE_HOUR", "2"))   # local time
+AUTO_ARCHIVE = os.environ.get("FARMFLOW_AUTO_ARCHIVE", "0") == "1"         # also archive closed years
+NIGHTLY_BACKUP = os.environ.get("FARMFLOW_NIGHTLY_BACKUP", "1") == "1"     # snapshot every farm first
+CHECK_INTERVAL = 300            # seconds between checks of the clock
+ANALYSIS_LIMIT = 1000           # rows sampled per index by ANALYZE
+VACUUM_PAGES = 10000            # free pages returned to the file system per run
+
+_history = {}                   # db_path -> results of the last run
+_lock = threading.Lock()
+_scheduler = None
+
+
+# Superseded change log entries dropped, statistics for the query planner,
+# free pages handed back and the WAL folded into the database. Returns what was done, with timings in milliseconds.
+def run_maintenance(db_path=None):
+    db_path = db_path or db.current_path()
+    result = {"Database": db_path, "Started": time.strftime("%Y-%m-%d %H:%M:%S")}
+    if NIGHTLY_BACKUP:
+        result["Snapshot"] = backup.snapshot(db_path)["file"]
+        result["Snapshots Pruned"] = len(backup.prune(db_path))
+    # Exports prepared by sessions that were closed before downloading them
+    result["Exports Removed"] = len(export.remove_stale_exports())
+    if AUTO_ARCHIVE:
+        result["Archived Years"] = [year for year in archive.closed_years(db_path)
+                                    if archive.archive_year(year, db_path)]
+    # On the writer thread, so form writes queue behind it rather than failing
+    # on the lock
+    db.run_exclusive(lambda conn: _housekeeping(conn, result), db_path)
+    query_cache.invalidate_table(db_path, "ChangeLog")
+    result["Size (MB)"] = os.path.getsize(db_path) / 2 ** 20
+    with _lock:
+        _history[db_path] = result
+    return result
+
+
+def _housekeeping(conn, result):
+    started = time.perf_counter()
+    result["Changes Compacted"] = compact_change_log(conn)
+    conn.commit()
+    result["Compact ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+    result["Analyze ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Incremental vacuum needs auto_vacuum set before the file is
+        # rebuilt, so older databases get one full VACUUM first
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+    result["Pages Freed"] = free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    result["Vacuum ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    result["WAL Pages"] = wal_pages
+    result["Checkpoint Complete"] = not busy
+    result["Checkpoint ms"] = (time.perf_counter() - started) * 1000
+
+
+def last_runs():
+    with _lock:
+        return list(_history.values())
+
+
+def run_nightly(now):
+    for farm in shards.farm_names():
+        try:
+            run_maintenance(shards.farm_path(farm))
+        except Exception as error:
+            # A busy database, a full disk or a failed snapshot is shown on the
+            # Maintenance page; the other farms go ahead and this one is tried
+            # again tomorrow
+            with _lock:
+                _history[shards.farm_path(farm)] = {"Database": shards.farm_path(farm),
+                                                    "Started": now.strftime("%Y-%m-%d %H:%M:%S"),
+                                                    "Error": f"{type(error).__name__}: {error}"}
+
+
+def _scheduler_loop():
+    last_day = None
+    while True:
+        now = datetime.datetime.now()
+        if now.hour == MAINTENANCE_HOUR and now.date() != last_day:
+            last_day = now.date()
+            run_nightly(now)
+        time.sleep(CHECK_INTERVAL)
+
+
+def start_scheduler():
+    # One scheduler thread per process, started by the first session
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = threading.Thread(target=_scheduler_loop, name="farmflow-maintenance", daemon=True)
+                _scheduler.start()
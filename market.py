@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import archive
+from columnar import fetch_frame
+
+# Resampling frequencies offered on the Market Information page
+FREQUENCIES = {"Daily": "D", "Weekly": "W", "Monthly": "MS", "Quarterly": "QS"}
+
+REVENUE_GROUPS = {"Crop": ["CropID"], "Plot": ["PlotID"], "Month": ["Month"], "Crop and Month": ["CropID", "Month"]}
+
+
+def price_history(crop_id):
+    # Read through idx_marketinfo_crop_date, archived years included; cached
+    # until MarketInfo changes
+    return archive.fetch_frame("SELECT MarketInfoID, MarketDate, PricePerUnit FROM MarketInfo WHERE CropID = ? "
+                               "ORDER BY MarketDate, MarketInfoID", (crop_id,),
+                               sort_by=[("MarketDate", "ascending"), ("MarketInfoID", "ascending")])
+
+
+# Prices for one crop resampled to a regular calendar: the last price seen in
+# each period (carried forward through periods without a quote), its rolling
+# mean over window periods and the rolling volatility of log returns
+def price_series(crop_id, frequency="W", window=4):
+    history = price_history(crop_id)
+    if history.empty:
+        return pd.DataFrame(columns=["Price", "RollingMean", "Volatility"])
+    prices = history.set_index(pd.to_datetime(history["MarketDate"]))["PricePerUnit"].astype(float)
+    price = prices.resample(frequency).last().ffill()
+    returns = np.log(price).diff()
+    return pd.DataFrame({
+        "Price": price,
+        "RollingMean": price.rolling(window, min_periods=1).mean(),
+        "Volatility": returns.rolling(window, min_periods=2).std(),
+    })
+
+
+# Estimated harvest revenue from the trigger-maintained MonthlyRevenueSummary,
+# where every harvest is valued at its crop's latest price on the harvest date
+def estimated_revenue(group_by="Crop"):
+    keys = REVENUE_GROUPS[group_by]
+    columns = ', '.join(f"s.{key}" for key in keys)
+    names = ", c.Name AS Crop" if "CropID" in keys else ""
+    names += ", p.Location" if "PlotID" in keys else ""
+    return fetch_frame(f"""
+        SELECT {columns}{names}, SUM(s.Revenue) AS Revenue, SUM(s.ValuedQuantity) AS ValuedQuantity,
+               SUM(s.HarvestCount) AS Harvests
+        FROM MonthlyRevenueSummary s
+        LEFT JOIN Crop c ON c.CropID = s.CropID
+        LEFT JOIN Plot p ON p.PlotID = s.PlotID
+        GROUP BY {columns}
+        ORDER BY {columns}
+    """)
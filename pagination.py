@@ -0,0 +1,95 @@
+import streamlit as st
+from db import current_path, fetch_data
+from columnar import fetch_frame
+
+PAGE_SIZES = [25, 50, 100, 250]
+COUNT_CAP = 10000  # stop counting matches after this many
+
+
+def fetch_page(table, key_column, where, params, after, limit):
+    # Keyset pagination: seek past the last key seen instead of using OFFSET
+    if after is None:
+        query = f"SELECT * FROM {table} WHERE ({where}) ORDER BY {key_column} LIMIT ?"
+        return fetch_frame(query, [*params, limit])
+    query = f"SELECT * FROM {table} WHERE {key_column} > ? AND ({where}) ORDER BY {key_column} LIMIT ?"
+    return fetch_frame(query, [after, *params, limit])
+
+
+def fetch_ranked_page(table, key_column, search, after, limit):
+    # Full-text matches ordered best first; the keyset is (rank, key), so the
+    # FTS5 rank comes back as an extra "rank" column
+    search_table, match = search
+    query = (f"SELECT t.*, s.rank FROM {search_table} s JOIN {table} t ON t.{key_column} = s.rowid "
+             f"WHERE s.{search_table} MATCH ?")
+    params = [match]
+    if after is not None:
+        query += " AND (s.rank > ? OR (s.rank = ? AND s.rowid > ?))"
+        params += [after[0], after[0], after[1]]
+    query += " ORDER BY s.rank, s.rowid LIMIT ?"
+    return fetch_frame(query, [*params, limit])
+
+
+def estimate_count(table, where, params):
+    query = f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE ({where}) LIMIT ?)"
+    return fetch_data(query, [*params, COUNT_CAP + 1])[0][0]
+
+
+def estimate_match_count(search):
+    search_table, match = search
+    query = f"SELECT COUNT(*) FROM (SELECT 1 FROM {search_table} WHERE {search_table} MATCH ? LIMIT ?)"
+    return fetch_data(query, [match, COUNT_CAP + 1])[0][0]
+
+
+def _next_page(state_key, last_key):
+    st.session_state[state_key]["starts"].append(last_key)
+
+
+def _previous_page(state_key):
+    st.session_state[state_key]["starts"].pop()
+
+
+# Render one page of a table with next/previous controls. Only the rows of the
+# current page are read from SQLite and sent to the browser. A search from
+# filters.text_search replaces the where clause and orders rows by relevance.
+def show_paginated_table(key, table, key_column, where='1 = 1', params=(), search=None):
+    state_key = f"{key}_pagination"
+    size_col, prev_col, next_col, info_col = st.columns([2, 1, 1, 3])
+    page_size = size_col.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size",
+                                   label_visibility="collapsed")
+
+    # Start again from the first page whenever the farm, filter or page size changes
+    signature = (current_path(), where, tuple(params), search, page_size)
+    state = st.session_state.get(state_key)
+    if state is None or state["signature"] != signature:
+        state = {"signature": signature, "starts": [None]}
+        st.session_state[state_key] = state
+
+    if search is None:
+        df = fetch_page(table, key_column, where, params, state["starts"][-1], page_size + 1)
+    else:
+        df = fetch_ranked_page(table, key_column, search, state["starts"][-1], page_size + 1)
+    has_more = len(df) > page_size
+    df = df.iloc[:page_size]
+    if df.empty:
+        last_key = None
+    elif search is None:
+        last_key = int(df[key_column].iloc[-1])
+    else:
+        last_key = (float(df["rank"].iloc[-1]), int(df[key_column].iloc[-1]))
+        df = df.drop(columns="rank")
+
+    prev_col.button("Previous", key=f"{key}_previous", disabled=len(state["starts"]) == 1,
+                    on_click=_previous_page, args=(state_key,))
+    next_col.button("Next", key=f"{key}_next", disabled=not has_more,
+                    on_click=_next_page, args=(state_key, last_key))
+
+    total = estimate_count(table, where, params) if search is None else estimate_match_count(search)
+    total_label = f"{COUNT_CAP:,}+" if total > COUNT_CAP else f"{total:,}"
+    first = (len(state["starts"]) - 1) * page_size
+    info_col.caption(f"Page {len(state['starts'])} · rows {first + 1 if len(df) else 0}–{first + len(df)} "
+                     f"of {total_label}")
+
+    df = df.drop(columns="RowVersion", errors="ignore")
+    # Dates arrive as timestamps; show them without a time of day
+    dates = {name: st.column_config.DateColumn() for name in df.columns if str(df[name].dtype).startswith("datetime")}
+    st.dataframe(df, hide_index=True, column_config=dates)
@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from database_setup import CHANGE_TABLES, DERIVED_TABLES
+
+MAX_ENTRIES = 512
+MAX_BYTES = int(os.environ.get("FARMFLOW_CACHE_MB", "256")) * 2 ** 20   # results held per process, in total
+MAX_ENTRY_BYTES = MAX_BYTES // 8    # larger results, such as whole-table loads, are not cached
+
+# Writes to a table also change the tables its triggers maintain, the change log included
+_DERIVED = {source.lower(): [table.lower() for table in DERIVED_TABLES.get(source, [])] +
+            (['changelog'] if source in CHANGE_TABLES else []) for source in {*DERIVED_TABLES, *CHANGE_TABLES}}
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+# Result cache for fetch_data, keyed by database, SQL text and parameters.
+# Every table has a version counter; a write bumps it and evicts only the
+# entries that read from that table. Writes made by other processes (the API,
+# the backup tool) are noticed by db.check_external_writes, which drops the
+# whole database's entries through invalidate_database.
+_entries = OrderedDict()  # key -> (tables, result, size in bytes)
+_keys_by_table = {}       # (db_path, table) -> set of keys
+_versions = {}            # (db_path, table) -> int
+_epochs = {}              # db_path -> int, bumped by invalidate_database
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "bytes": 0}
+
+
+def tables_in(query):
+    return frozenset(name.lower() for name in _TABLE_PATTERN.findall(query))
+
+
+def result_size(result):
+    # Arrow tables know their buffer sizes; row lists are estimated from their
+    # first row, which is close enough for rows of one query
+    if hasattr(result, "nbytes"):
+        return result.nbytes
+    if not result:
+        return sys.getsizeof(result)
+    first = result[0]
+    return sys.getsizeof(result) + len(result) * (sys.getsizeof(first) + sum(map(sys.getsizeof, first)))
+
+
+def _current_versions(db_path, tables):
+    return (_epochs.get(db_path, 0),) + tuple(_versions.get((db_path, table), 0) for table in sorted(tables))
+
+
+def table_versions(db_path, tables):
+    with _lock:
+        return _current_versions(db_path, tables)
+
+
+# kind separates results of the same query held in different forms, such as
+# fetch_data's rows and columnar.fetch_table's Arrow tables
+def get(db_path, query, params, kind="rows"):
+    key = (db_path, query, tuple(params), kind)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return key, None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return key, entry[1]
+
+
+# Least recently used results are evicted past MAX_ENTRIES or MAX_BYTES
+def put(key, tables, versions, result):
+    db_path = key[0]
+    size = result_size(result)
+    if size > MAX_ENTRY_BYTES:
+        return
+    with _lock:
+        # Drop results read while one of their tables was being written
+        if _current_versions(db_path, tables) != versions:
+            return
+        if key in _entries:
+            _forget(key, _entries.pop(key))
+        _entries[key] = (tables, result, size)
+        _stats["bytes"] += size
+        for table in tables:
+            _keys_by_table.setdefault((db_path, table), set()).add(key)
+        while len(_entries) > MAX_ENTRIES or _stats["bytes"] > MAX_BYTES:
+            old_key, old_entry = _entries.popitem(last=False)
+            _forget(old_key, old_entry)
+            _stats["evictions"] += 1
+
+
+def _forget(key, entry):
+    _stats["bytes"] -= entry[2]
+    for table in entry[0]:
+        keys = _keys_by_table.get((key[0], table))
+        if keys is not None:
+            keys.discard(key)
+
+
+# Bump a table's version (and that of the summaries derived from it) and drop
+# the cached results that read from it
+def invalidate_table(db_path, table):
+    table = table.lower()
+    with _lock:
+        for name in [table] + _DERIVED.get(table, []):
+            _versions[(db_path, name)] = _versions.get((db_path, name), 0) + 1
+            for key in _keys_by_table.pop((db_path, name), ()):
+                entry = _entries.pop(key, None)
+                if entry is not None:
+                    _forget(key, entry)
+                    _stats["invalidations"] += 1
+
+
+# Drop every cached result of a database, after it was written to by another
+# process
+def invalidate_database(db_path):
+    with _lock:
+        _epochs[db_path] = _epochs.get(db_path, 0) + 1
+        for key in [key for key in _entries if key[0] == db_path]:
+            _forget(key, _entries.pop(key))
+            _stats["invalidations"] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _keys_by_table.clear()
+        _stats["bytes"] = 0
+        for table_key in _versions:
+            _versions[table_key] += 1
+        for db_path in _epochs:
+            _epochs[db_path] += 1
+
+
+def cache_stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, entries=len(_entries), hit_rate=_stats["hits"] / lookups if lookups else 0.0)
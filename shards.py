@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import db
+import query_cache
+
+# One SQLite file per farm. The main farm keeps db.DB_PATH; every other farm
+# is a file in FARMS_DIR named after it.
+FARMS_DIR = os.environ.get("FARMFLOW_FARMS_DIR", "farms")
+MAIN_FARM = "Main Farm"
+FAN_OUT_WORKERS = int(os.environ.get("FARMFLOW_FAN_OUT_WORKERS", str(os.cpu_count() or 1)))
+
+_FARM_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9 _-]{0,63}$")
+
+# Consolidated reports: each farm runs the query on its own file and returns a
+# partial aggregate, and the partials are summed over the key columns. Only
+# sums and counts are returned, so merging them is exact.
+REPORTS = {
+    "Farm Totals": (["Farm"], """
+        SELECT (SELECT COALESCE(SUM(TotalIncome), 0) FROM MonthlyFinancialSummary) AS TotalIncome,
+               (SELECT COALESCE(SUM(TotalExpenses), 0) FROM MonthlyFinancialSummary) AS TotalExpenses,
+               (SELECT COALESCE(SUM(TotalQuantity), 0) FROM MonthlyHarvestSummary) AS HarvestedQuantity,
+               (SELECT COALESCE(SUM(Revenue), 0) FROM MonthlyRevenueSummary) AS EstimatedRevenue,
+               (SELECT COUNT(*) FROM Employee) AS Employees
+    """),
+    "Monthly Finances": (["Month"], """
+        SELECT Month, TotalIncome, TotalExpenses, RecordCount FROM MonthlyFinancialSummary
+    """),
+    "Harvest by Crop": (["Crop"], """
+        SELECT c.Name AS Crop, SUM(s.TotalQuantity) AS TotalQuantity, SUM(s.HarvestCount) AS Harvests
+        FROM MonthlyHarvestSummary s JOIN Crop c ON c.CropID = s.CropID
+        GROUP BY c.Name
+    """),
+    "Revenue by Crop": (["Crop"], """
+        SELECT c.Name AS Crop, SUM(s.Revenue) AS Revenue, SUM(s.ValuedQuantity) AS ValuedQuantity
+        FROM MonthlyRevenueSummary s JOIN Crop c ON c.CropID = s.CropID
+        GROUP BY c.Name
+    """),
+    "Inventory by Item": (["ItemName", "Type"], """
+        SELECT ItemName, Type, SUM(Received) AS Received, SUM(Used) AS Used, SUM(Stock) AS Stock
+        FROM InventoryStock GROUP BY ItemName, Type
+    """),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_results = {}  # (report, farms) -> (table versions, merged frame)
+_results_lock = threading.Lock()
+
+
+def farm_names():
+    names = []
+    if os.path.isdir(FARMS_DIR):
+        names = sorted(entry[:-3] for entry in os.listdir(FARMS_DIR) if entry.endswith(".db"))
+    return [MAIN_FARM] + names
+
+
+def farm_path(name):
+    if name == MAIN_FARM or name is None:
+        return db.DB_PATH
+    return os.path.join(FARMS_DIR, f"{name}.db")
+
+
+def create_farm(name):
+    name = name.strip()
+    if not _FARM_NAME.match(name) or name == MAIN_FARM:
+        raise ValueError("Farm names use letters, digits, spaces, '-' and '_' (at most 64 characters).")
+    path = farm_path(name)
+    if os.path.exists(path):
+        raise ValueError(f"A farm called {name} already exists.")
+    os.makedirs(FARMS_DIR, exist_ok=True)
+    # Opening the pool creates the file with the full schema
+    with db.get_connection(path):
+        pass
+    return name
+
+
+def _partial(db_path, query):
+    # Runs in a worker process on a read-only connection of its own
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(query)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Streamlit's server is multi-threaded, so workers are spawned, not forked
+            _executor = ProcessPoolExecutor(FAN_OUT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+# Run query on every farm in parallel and return one frame per farm, each
+# with a Farm column. A single farm is read in this process.
+def fan_out(query, farms=None):
+    farms = farms or farm_names()
+    paths = [farm_path(name) for name in farms]
+    for path in paths:
+        # Creates or upgrades each farm's schema once per process
+        with db.get_connection(path):
+            pass
+    if len(paths) == 1:
+        results = [_partial(paths[0], query)]
+    else:
+        results = list(_get_executor().map(_partial, paths, [query] * len(paths)))
+    return [pd.DataFrame.from_records(rows, columns=columns).assign(Farm=name)
+            for name, (columns, rows) in zip(farms, results)]
+
+
+def consolidated(report, farms=None):
+    farms = tuple(farms or farm_names())
+    keys, query = REPORTS[report]
+    tables = query_cache.tables_in(query)
+    # Cached until a write touches a source table on any farm
+    for name in farms:
+        db.check_external_writes(farm_path(name))
+    versions = tuple(query_cache.table_versions(farm_path(name), tables) for name in farms)
+    with _results_lock:
+        cached = _results.get((report, farms))
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+    partials = [frame for frame in fan_out(query, farms) if not frame.empty]
+    if not partials:
+        merged = pd.DataFrame(columns=keys)
+    elif keys == ["Farm"]:
+        merged = pd.concat(partials, ignore_index=True)
+        merged = merged[["Farm"] + [column for column in merged.columns if column != "Farm"]]
+    else:
+        merged = (pd.concat(partials, ignore_index=True).drop(columns="Farm")
+                  .groupby(keys, sort=True, dropna=False).sum(numeric_only=True).reset_index())
+    with _results_lock:
+        _results[(report, farms)] = (versions, merged)
+    return merged
@@ -0,0 +1,191 @@
+import json
+import math
+import sqlite3
+import numpy as np
+import pandas as pd
+import db
+from bulk_import import IMPORT_TABLES, validate_chunk
+from database_setup import CHANGE_TABLES, VERSIONED_TABLES
+
+# Delta sync for offline field clients. A client keeps the sequence number of
+# the last change it has seen and pulls the changes after it; what a pull
+# costs depends on how much changed, not on how big the tables are. Edits made
+# offline come back as a batch, applied only where the rows have not changed
+# on the server since the client read them.
+PULL_LIMIT = 5000               # change log entries covered by one pull
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1   # what SQLite stores as INTEGER
+
+
+# Typed columns of the edited tables, checked like a bulk import's rows: the
+# import's specs, and the same kind of spec for the tables it does not take
+EDIT_COLUMNS = dict(
+    {table: spec for table, spec in IMPORT_TABLES.items()},
+    Crop={"columns": {"GrowthDuration": "int"}, "foreign_keys": {}},
+    Inventory={"columns": {"Quantity": "int", "PurchaseDate": "date"}, "foreign_keys": {}},
+    Employee={"columns": {"HireDate": "date"}, "foreign_keys": {}},
+)
+
+
+class SyncReset(Exception):
+    # The client's sequence number is ahead of the log, e.g. after a restore;
+    # it has to start again from 0
+    pass
+
+
+def last_sequence(db_path=None):
+    with db.get_connection(db_path) as conn:
+        return conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM ChangeLog").fetchone()[0]
+
+
+# The changes after sequence number since, covering at most limit log
+# entries. Each changed row is sent once in its current state, table by
+# table as column names and value lists; deleted rows as their keys. Pull
+# again from "next" while "more" is set.
+def changes_since(since, limit=PULL_LIMIT, db_path=None):
+    with db.get_connection(db_path) as conn:
+        # One read transaction, so the log and the rows are read at one point in time
+        conn.execute("BEGIN")
+        last = conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM ChangeLog").fetchone()[0]
+        if since > last:
+            raise SyncReset(f"Sequence {since} is ahead of the change log ({last})")
+        upto = conn.execute("SELECT Seq FROM ChangeLog WHERE Seq > ? ORDER BY Seq LIMIT 1 OFFSET ?",
+                            (since, limit - 1)).fetchone()
+        upto = upto[0] if upto else last
+        latest = conn.execute("SELECT TableName, RowID, Operation FROM ChangeLog WHERE Seq IN "
+                              "(SELECT MAX(Seq) FROM ChangeLog WHERE Seq > ? AND Seq <= ? "
+                              "GROUP BY TableName, RowID)", (since, upto)).fetchall()
+        changed = {}
+        for table, row_id, operation in latest:
+            deleted, kept = changed.setdefault(table, ([], []))
+            (deleted if operation == "D" else kept).append(row_id)
+        tables = {}
+        for table, (deleted, kept) in changed.items():
+            entry = tables[table] = {"columns": [], "rows": [], "deleted": deleted}
+            if kept:
+                # A row deleted after upto is skipped here; its delete comes with the next pull
+                cursor = conn.execute(f"SELECT * FROM {table} WHERE {CHANGE_TABLES[table]} IN "
+                                      f"(SELECT value FROM json_each(?))", (json.dumps(kept),))
+                entry["columns"] = [column[0] for column in cursor.description]
+                entry["rows"] = [list(row) for row in cursor]
+        conn.rollback()
+    return {"since": since, "next": upto, "more": upto < last, "tables": tables}
+
+
+def _columns(table):
+    return [row[1] for row in db.fetch_data(f"SELECT * FROM pragma_table_info('{table}')")]
+
+
+def _is_integer(value):
+    # JSON true and false arrive as bool, a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool) and MIN_INTEGER <= value <= MAX_INTEGER
+
+
+def _is_value(value):
+    # NaN and Infinity are accepted by json.loads but are not numbers SQLite keeps
+    return (value is None or isinstance(value, str) or _is_integer(value)
+            or (isinstance(value, float) and math.isfinite(value)))
+
+
+# Check the values of a table's edits, given as (number, values), with
+# bulk_import.validate_chunk one column at a time, as edits carry different
+# columns. Returns the reason for each rejected edit by number, and writes the
+# normalized dates back into the values of the others.
+def _check_values(table, edits):
+    spec = EDIT_COLUMNS.get(table, {"columns": {}, "foreign_keys": {}})
+    reasons = {}
+    for column, kind in spec["columns"].items():
+        numbers = [number for number, values in edits if column in values and number not in reasons]
+        if not numbers:
+            continue
+        checked = set(numbers)
+        supplied = [values[column] for number, values in edits if number in checked]
+        if kind == "date":
+            supplied = [value if isinstance(value, str) else None for value in supplied]
+        valid_keys = {}
+        if column in spec["foreign_keys"]:
+            parent, key = spec["foreign_keys"][column]
+            valid_keys[column] = np.array([row[0] for row in db.fetch_data(f"SELECT {key} FROM {parent}")],
+                                          dtype=np.int64)
+        frame = pd.DataFrame({column: pd.Series(supplied, index=numbers, dtype=object)})
+        clean, rejected, why = validate_chunk(frame, {"columns": {column: kind}}, valid_keys)
+        reasons.update(why[rejected].items())
+        if kind == "date":
+            dates = dict(zip(clean.index, clean[column].tolist()))
+            for number, values in edits:
+                if number in dates:
+                    values[column] = dates[number]
+    return reasons
+
+
+def _current_rows(table, keys):
+    key_column = CHANGE_TABLES[table]
+    with db.get_connection() as conn:
+        cursor = conn.execute(f"SELECT * FROM {table} WHERE {key_column} IN (SELECT value FROM json_each(?))",
+                              (json.dumps(keys),))
+        return [column[0] for column in cursor.description], [list(row) for row in cursor]
+
+
+# Apply a batch of offline edits, each {"table", "op": "insert" | "update" |
+# "delete", "key", "version", "values"}, where version is the RowVersion the
+# client last pulled. Each table's edits are one transaction; a table whose
+# edits touch a row changed on the server since is left unchanged and its
+# result lists the conflicting keys with the server's rows, for the client to
+# resolve and send again. Inserted rows come back, with their new keys, on
+# the next pull. Values are checked like a bulk import's (see EDIT_COLUMNS);
+# an edit with an invalid value is left out and listed under "rejected" with
+# the reason. Raises ValueError for a malformed batch, before anything is
+# written.
+def apply_edits(edits, db_path=None):
+    if db_path:
+        db.use_database(db_path)
+    by_table = {}
+    for number, edit in enumerate(edits):
+        if not isinstance(edit, dict):
+            raise ValueError(f"Edit {number}: not an object")
+        table, operation = edit.get("table"), edit.get("op")
+        if table not in VERSIONED_TABLES:
+            raise ValueError(f"Edit {number}: {table} cannot be edited through sync")
+        key_column = CHANGE_TABLES[table]
+        columns = set(_columns(table)) - {key_column, "RowVersion"}
+        values = edit.get("values") or {}
+        if not isinstance(values, dict) or not all(_is_value(value) for value in values.values()):
+            raise ValueError(f"Edit {number}: values must map columns to strings, 64-bit numbers or null")
+        unknown = set(values) - columns
+        if unknown:
+            raise ValueError(f"Edit {number}: unknown columns {', '.join(sorted(map(str, unknown)))}")
+        if operation == "insert":
+            if not values:
+                raise ValueError(f"Edit {number}: insert without values")
+        elif operation in ("update", "delete"):
+            if not _is_integer(edit.get("key")) or not _is_integer(edit.get("version")):
+                raise ValueError(f"Edit {number}: {operation} needs the row's integer key and version")
+        else:
+            raise ValueError(f"Edit {number}: unknown op {operation}")
+        by_table.setdefault(table, []).append((number, operation, edit.get("key"), edit.get("version"), dict(values)))
+
+    results = []
+    rejected = []
+    for table, table_edits in by_table.items():
+        reasons = _check_values(table, [(number, values) for number, _, _, _, values in table_edits])
+        inserts, updates, deletes = [], [], []
+        for number, operation, key, version, values in table_edits:
+            if number in reasons:
+                rejected.append({"edit": number, "error": reasons[number]})
+            elif operation == "insert":
+                inserts.append(values)
+            elif operation == "update":
+                if values:
+                    updates.append((key, version, values))
+            else:
+                deletes.append((key, version))
+        result = {"table": table, "applied": 0}
+        try:
+            result["applied"] = db.apply_changes(table, CHANGE_TABLES[table], inserts, updates, deletes)
+        except db.WriteConflict as conflict:
+            result["conflicts"] = conflict.keys
+            result["columns"], result["rows"] = _current_rows(table, conflict.keys)
+        except sqlite3.IntegrityError as error:
+            result["error"] = str(error)
+        results.append(result)
+    rejected.sort(key=lambda entry: entry["edit"])
+    return {"results": results, "rejected": rejected, "last_sequence": last_sequence()}
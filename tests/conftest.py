@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import query_cache
+
+
+# A fresh, migrated database per test; the writer threads and pooled
+# connections are closed afterwards so the next test starts clean
+@pytest.fixture
+def farm_db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "farm.db")
+    monkeypatch.setattr(db, "DB_PATH", db_path)
+    monkeypatch.setattr(db, "DEMO_DATA", False)
+    db.use_database(db_path)
+    with db.get_connection(db_path):
+        pass
+    yield db_path
+    db.close_connections()
+    db.use_database(None)
+    query_cache.clear()
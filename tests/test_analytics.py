@@ -0,0 +1,70 @@
+import threading
+import pandas as pd
+import analytics
+import archive
+import db
+
+
+def _farm():
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    db.add_record("Plot", {"Location": "North", "Size": 2.0})
+    for month in range(1, 7):
+        db.add_record("Planting", {"CropID": 1, "PlotID": 1, "PlantingDate": f"2024-{month:02d}-01", "Quantity": 10})
+        db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": f"2024-{month + 3:02d}-01",
+                                  "Quantity": 20 + month})
+
+
+def _assert_same(results, expected):
+    assert results["harvests"] == expected["harvests"] and results["matched"] == expected["matched"]
+    for name in ("by_crop", "by_plot", "by_season", "cycles"):
+        pd.testing.assert_frame_equal(results[name], expected[name], check_dtype=False)
+
+
+def test_changes_are_patched_in(farm_db):
+    _farm()
+    analytics.yield_analytics()
+    db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-11-01", "Quantity": 30})
+    db.update_record("Harvest", {"Quantity": 99}, {"HarvestID": 2})
+    db.delete_record("Harvest", {"HarvestID": 3})
+    db.update_record("Planting", {"Quantity": 5}, {"PlantingID": 1})
+    _assert_same(analytics.yield_analytics(), analytics.compute(*analytics.load_sources()))
+
+
+def test_small_writes_do_not_reload_harvests(farm_db, monkeypatch):
+    _farm()
+    analytics.yield_analytics()
+    loads = []
+    fetch_frame = archive.fetch_frame
+    monkeypatch.setattr(archive, "fetch_frame", lambda *args, **kwargs: loads.append(args) or fetch_frame(*args))
+    db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-11-01", "Quantity": 30})
+    db.update_record("Crop", {"GrowthDuration": 100}, {"CropID": 1})
+    assert analytics.yield_analytics()["harvests"] == 7
+    assert loads == []
+
+
+def test_one_farm_does_not_wait_for_another(farm_db, tmp_path, monkeypatch):
+    other = str(tmp_path / "other.db")
+    db.use_database(other)
+    _farm()
+    db.use_database(farm_db)
+    _farm()
+    started, release = threading.Event(), threading.Event()
+    compute = analytics.compute
+
+    def slow_compute(*sources):
+        if db.current_path() == farm_db:
+            started.set()
+            release.wait(10)
+        return compute(*sources)
+
+    monkeypatch.setattr(analytics, "compute", slow_compute)
+    worker = threading.Thread(target=lambda: (db.use_database(farm_db), analytics.yield_analytics()))
+    worker.start()
+    assert started.wait(10)
+    try:
+        db.use_database(other)
+        assert analytics.yield_analytics()["harvests"] == 6
+        assert worker.is_alive()
+    finally:
+        release.set()
+        worker.join()
@@ -0,0 +1,46 @@
+import datetime
+import os
+import subprocess
+import sys
+import backup
+import db
+import maintenance
+import shards
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _crop(name):
+    db.add_record("Crop", {"Name": name, "Type": "Grain", "GrowthDuration": 90})
+
+
+def test_restore_from_the_command_line_reaches_a_running_app(farm_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "BACKUP_DIR", str(tmp_path / "backups"))
+    _crop("Maize")
+    manifest = backup.snapshot(throttle=False)
+    _crop("Rice")
+    assert db.fetch_data("SELECT COUNT(*) FROM Crop") == [(2,)]
+    subprocess.run([sys.executable, "backup.py", "--database", farm_db, "restore", manifest["file"]], cwd=REPO,
+                   env=dict(os.environ, FARMFLOW_BACKUP_DIR=backup.BACKUP_DIR), check=True, capture_output=True)
+    assert db.fetch_data("SELECT Name FROM Crop") == [("Maize",)]
+
+
+def test_nightly_run_survives_a_failed_snapshot(farm_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(shards, "FARMS_DIR", str(tmp_path / "farms"))
+    os.makedirs(shards.FARMS_DIR)
+    other = shards.farm_path("North")
+    with db.get_connection(other):
+        pass
+    snapshot = backup.snapshot
+
+    def disk_full(db_path=None, throttle=None):
+        if db_path == farm_db:
+            raise OSError(28, "No space left on device")
+        return snapshot(db_path, throttle)
+
+    monkeypatch.setattr(backup, "snapshot", disk_full)
+    maintenance.run_nightly(datetime.datetime.now())
+    runs = {run["Database"]: run for run in maintenance.last_runs()}
+    assert "No space left on device" in runs[farm_db]["Error"]
+    assert "Error" not in runs[other] and runs[other]["Snapshot"]
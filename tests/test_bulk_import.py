@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import bulk_import
+import db
+
+
+@pytest.fixture
+def harvest_file(farm_db, tmp_path):
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    db.add_record("Plot", {"Location": "North", "Size": 2.0})
+    lines = [f"1,1,2024-06-{day:02d},{day}" for day in range(1, 6)] + ["1,1,2024-06-30,-4"]
+    path = tmp_path / "harvest.csv"
+    path.write_text("CropID,PlotID,HarvestDate,Quantity\n" + "\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_abort_imports_nothing(harvest_file):
+    with pytest.raises(ValueError, match="Row 6: invalid Quantity"):
+        bulk_import.import_file(harvest_file, "Harvest", chunk_size=2, on_error="abort")
+    assert db.fetch_data("SELECT COUNT(*) FROM Harvest") == [(0,)]
+    assert db.fetch_data("SELECT COUNT(*) FROM MonthlyHarvestSummary") == [(0,)]
+    assert db.fetch_data("SELECT Deferred FROM RollupControl") == [(0,)]
+
+
+def test_skip_imports_the_valid_rows(harvest_file):
+    report = bulk_import.import_file(harvest_file, "Harvest", chunk_size=2)
+    assert (report["rows_inserted"], report["rows_rejected"]) == (5, 1)
+    assert report["errors"] == [{"row": 6, "error": "invalid Quantity"}]
+    assert db.fetch_data("SELECT SUM(TotalQuantity), SUM(HarvestCount) FROM MonthlyHarvestSummary") == [(15, 5)]
+
+
+# Throughput floor for a 100k-row harvest sheet, set well under what a laptop
+# does so that only a real regression (a per-row trigger or a refresh that
+# scans the whole table) fails it; raise it on a known machine
+MIN_ROWS_PER_SECOND = float(os.environ.get("FARMFLOW_IMPORT_MIN_ROWS_PER_SECOND", "15000"))
+
+
+@pytest.fixture
+def large_harvest_file(farm_db, tmp_path):
+    for crop in ("Maize", "Rice", "Beans"):
+        db.add_record("Crop", {"Name": crop, "Type": "Grain", "GrowthDuration": 90})
+        db.add_record("Plot", {"Location": crop, "Size": 2.0})
+        db.add_record("MarketInfo", {"CropID": 1, "MarketDate": "2019-01-01", "PricePerUnit": 3.0})
+    rng = np.random.default_rng(0)
+    rows = 100000
+    days = np.datetime64("2019-01-01") + rng.integers(0, 2000, rows).astype("timedelta64[D]")
+    pd.DataFrame({"CropID": rng.integers(1, 4, rows), "PlotID": rng.integers(1, 4, rows),
+                  "HarvestDate": np.datetime_as_string(days), "Quantity": rng.integers(1, 500, rows)}
+                 ).to_csv(tmp_path / "large.csv", index=False)
+    return str(tmp_path / "large.csv")
+
+
+def test_import_throughput(large_harvest_file):
+    bulk_import.import_file(large_harvest_file, "Harvest")
+    # The second import goes into a table that is no longer empty
+    report = bulk_import.import_file(large_harvest_file, "Harvest")
+    assert report["rows_inserted"] == 100000
+    assert report["rows_per_second"] >= MIN_ROWS_PER_SECOND
+
+
+def test_form_writes_go_through_during_an_import(large_harvest_file, monkeypatch):
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_MS", 200)
+    db.close_connections()
+    importing = threading.Thread(target=bulk_import.import_file, args=(large_harvest_file, "Harvest"),
+                                 kwargs={"chunk_size": 10000, "on_error": "abort"})
+    importing.start()
+    while importing.is_alive():
+        db.add_record("Crop", {"Name": "Yam", "Type": "Root", "GrowthDuration": 240})
+        time.sleep(0.05)
+    importing.join()
+    assert db.fetch_data("SELECT COUNT(*) FROM Harvest") == [(100000,)]
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from charts import downsample, lttb
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 2, 3, 10, 999])
+def test_lttb_keeps_at_most_threshold_points_in_order(threshold):
+    rng = np.random.default_rng(7)
+    x = np.arange(1000)
+    kept = lttb(x, rng.normal(size=1000), threshold)
+    assert len(kept) == threshold
+    assert (np.diff(kept) > 0).all()
+    if threshold >= 2:
+        assert kept[0] == 0 and kept[-1] == 999
+
+
+def test_lttb_returns_short_series_unchanged():
+    assert lttb([1, 2, 3], [5.0, 1.0, 4.0], 3).tolist() == [0, 1, 2]
+    assert lttb([1, 2, 3], [5.0, 1.0, 4.0], 1000).tolist() == [0, 1, 2]
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(10000)
+    y[[1234, 6789]] = [50.0, -80.0]
+    kept = lttb(np.arange(10000), y, 20)
+    assert {1234, 6789} <= set(kept.tolist())
+
+
+def test_downsample_reduces_each_series_on_its_own():
+    days = pd.date_range("2020-01-01", periods=5000, freq="D")
+    df = pd.DataFrame({"Period": days, "Income": np.sin(np.arange(5000) / 50), "Expenses": np.nan})
+    df.loc[2500, "Income"] = 10.0
+    points = downsample(df, "Period", ["Income", "Expenses"], max_points=100)
+    income = points[points["Series"] == "Income"]
+    assert len(income) == 100 and len(points) == 200
+    assert income["Period"].iloc[0] == days[0] and income["Period"].iloc[-1] == days[-1]
+    assert income["Value"].max() == 10.0
+    assert (points.loc[points["Series"] == "Expenses", "Value"] == 0).all()
@@ -0,0 +1,27 @@
+import pytest
+import analytics
+import columnar
+import db
+
+
+def _harvests(*dates):
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    db.add_record("Plot", {"Location": "North", "Size": 2.0})
+    db.add_record("Planting", {"CropID": 1, "PlotID": 1, "PlantingDate": "2024-01-01", "Quantity": 10})
+    for date in dates:
+        db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": date, "Quantity": 5})
+
+
+def test_iso_dates_become_timestamps(farm_db):
+    _harvests("2024-02-29", "2024-03-01")
+    df = columnar.fetch_frame("SELECT HarvestDate FROM Harvest ORDER BY HarvestID")
+    assert df["HarvestDate"].dt.strftime("%Y-%m-%d").tolist() == ["2024-02-29", "2024-03-01"]
+
+
+@pytest.mark.parametrize("stored", ["2024-13-05", "2024-02-30"])
+def test_dates_that_do_not_exist_stay_as_stored(farm_db, stored):
+    _harvests("2024-05-01", stored)
+    df = columnar.fetch_frame("SELECT HarvestDate FROM Harvest ORDER BY HarvestID")
+    assert df["HarvestDate"].astype(str).tolist() == ["2024-05-01", stored]
+    # The analytics skip the row instead of failing
+    assert analytics.yield_analytics()["harvests"] == 1
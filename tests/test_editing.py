@@ -0,0 +1,68 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import db
+from editing import _cell, _load, grid_changes
+
+
+def _crops():
+    db.add_records("Crop", ["Name", "Type", "GrowthDuration"],
+                   [("Maize", "Grain", 90), ("Beans", "Legume", 60), ("Cassava", "Root", 300)])
+    return _load("Crop", "CropID", 1)
+
+
+# The grid as st.data_editor returns it, and the editor state it keeps: the
+# first row renamed, the third deleted and one row added
+def _edit(rows):
+    edited = rows.copy()
+    edited.at[0, "Name"] = "Sorghum"
+    edited = edited.drop(index=2)
+    edited.loc[3] = {"CropID": None, "Name": "Yam", "Type": "Root", "GrowthDuration": np.int64(240),
+                     "RowVersion": None}
+    state = {"edited_rows": {0: {"Name": "Sorghum"}},
+             "added_rows": [{"Name": "Yam", "Type": "Root", "GrowthDuration": 240}],
+             "deleted_rows": [2]}
+    return edited, state
+
+
+def test_grid_changes_are_the_edited_cells_and_the_added_and_deleted_rows(farm_db):
+    rows = _crops()
+    versions = dict(zip(rows["CropID"], rows["RowVersion"]))
+    inserts, updates, deletes = grid_changes(rows, *_edit(rows), "CropID")
+    assert inserts == [{"Name": "Yam", "Type": "Root", "GrowthDuration": 240}]
+    assert updates == [(1, versions[1], {"Name": "Sorghum"})]
+    assert deletes == [(3, versions[3])]
+
+    db.apply_changes("Crop", "CropID", inserts, updates, deletes)
+    assert db.fetch_data("SELECT CropID, Name, RowVersion FROM Crop ORDER BY CropID") == [
+        (1, "Sorghum", versions[1] + 1), (2, "Beans", versions[2]), (4, "Yam", 1)]
+
+
+def test_unchanged_grid_has_no_changes(farm_db):
+    rows = _crops()
+    state = {"edited_rows": {}, "added_rows": [], "deleted_rows": []}
+    assert grid_changes(rows, rows.copy(), state, "CropID") == ([], [], [])
+
+
+def test_grid_edited_by_someone_else_meanwhile_saves_nothing(farm_db):
+    rows = _crops()
+    inserts, updates, deletes = grid_changes(rows, *_edit(rows), "CropID")
+    db.update_record("Crop", {"GrowthDuration": 95}, {"CropID": 1})
+    with pytest.raises(db.WriteConflict) as conflict:
+        db.apply_changes("Crop", "CropID", inserts, updates, deletes)
+    assert conflict.value.keys == [1]
+    assert db.fetch_data("SELECT Name, GrowthDuration FROM Crop ORDER BY CropID") == [
+        ("Maize", 95), ("Beans", 60), ("Cassava", 300)]
+
+
+@pytest.mark.parametrize("value, stored", [
+    (pd.Timestamp("2024-05-07"), "2024-05-07"),
+    (datetime.date(2024, 5, 7), "2024-05-07"),
+    (pd.NaT, None),
+    (float("nan"), None),
+    (np.int64(3), 3),
+    ("Maize", "Maize"),
+])
+def test_cells_are_stored_as_sqlite_values(value, stored):
+    assert _cell(value) == stored
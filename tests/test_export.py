@@ -0,0 +1,32 @@
+import os
+import time
+import pyarrow.parquet as pq
+import pytest
+import db
+import export
+
+
+@pytest.fixture
+def export_dir(tmp_path, monkeypatch):
+    directory = str(tmp_path / "exports")
+    monkeypatch.setattr(export, "EXPORT_DIR", directory)
+    return directory
+
+
+def test_prepared_exports_are_swept_once_stale(farm_db, export_dir):
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    first = export.export_to_tempfile("Crop")
+    assert os.path.dirname(first) == export_dir
+    assert pq.read_table(first).column("Name").to_pylist() == ["Maize"]
+
+    stale = time.time() - export.EXPORT_MAX_AGE - 1
+    os.utime(first, (stale, stale))
+    second = export.export_to_tempfile("Crop", "csv")
+    assert os.listdir(export_dir) == [os.path.basename(second)]
+    assert export.remove_stale_exports(max_age=0) == [second]
+
+
+def test_failed_export_leaves_no_file(farm_db, export_dir):
+    with pytest.raises(ValueError):
+        export.export_to_tempfile("NoSuchTable")
+    assert os.listdir(export_dir) == []
@@ -0,0 +1,119 @@
+from streamlit.testing.v1 import AppTest
+import db
+from filters import text_search
+from pagination import fetch_ranked_page
+
+
+def _crop_pages(db_path):
+    import streamlit as st
+    import db
+    from pagination import show_paginated_table
+
+    db.use_database(db_path)
+    crop_type = st.text_input("Type")
+    show_paginated_table("crops", "Crop", "CropID", *(("Type = ?", [crop_type]) if crop_type else ()))
+
+
+def _crop_search(db_path):
+    import streamlit as st
+    import db
+    from filters import text_search
+    from pagination import show_paginated_table
+
+    db.use_database(db_path)
+    show_paginated_table("crops", "Crop", "CropID", search=text_search("Crop", st.text_input("Search")))
+
+
+def _crops(count):
+    db.add_records("Crop", ["Name", "Type", "GrowthDuration"],
+                   [(f"Crop {number}", "Grain" if number % 2 else "Legume", 90) for number in range(1, count + 1)])
+
+
+def _shown(app):
+    return app.dataframe[0].value["CropID"].tolist()
+
+
+def test_next_and_previous_pages_round_trip(farm_db):
+    _crops(60)
+    app = AppTest.from_function(_crop_pages, args=(farm_db,), default_timeout=30).run()
+    assert _shown(app) == list(range(1, 26))
+    assert app.button(key="crops_previous").disabled
+
+    app.button(key="crops_next").click().run()
+    assert _shown(app) == list(range(26, 51))
+    app.button(key="crops_next").click().run()
+    assert _shown(app) == list(range(51, 61))
+    assert app.button(key="crops_next").disabled
+    assert app.caption[0].value == "Page 3 · rows 51–60 of 60"
+
+    app.button(key="crops_previous").click().run()
+    assert _shown(app) == list(range(26, 51))
+    app.button(key="crops_previous").click().run()
+    assert _shown(app) == list(range(1, 26))
+
+
+def test_a_page_ending_on_the_last_row_has_no_next_page(farm_db):
+    _crops(50)
+    app = AppTest.from_function(_crop_pages, args=(farm_db,), default_timeout=30).run()
+    app.button(key="crops_next").click().run()
+    assert _shown(app) == list(range(26, 51))
+    assert app.button(key="crops_next").disabled
+
+
+def test_changing_the_filter_starts_again_from_the_first_page(farm_db):
+    _crops(60)
+    app = AppTest.from_function(_crop_pages, args=(farm_db,), default_timeout=30).run()
+    app.button(key="crops_next").click().run()
+    assert _shown(app) == list(range(26, 51))
+
+    app.text_input[0].input("Legume").run()
+    assert _shown(app) == list(range(2, 51, 2))
+    assert app.button(key="crops_previous").disabled
+    app.button(key="crops_next").click().run()
+    assert _shown(app) == list(range(52, 61, 2))
+    assert app.caption[0].value == "Page 2 · rows 26–30 of 30"
+
+
+def _ranked_crops():
+    # Equal names share a rank, so most pages end inside a run of ties
+    rows = [("Maize", "Grain"), ("Beans", "Legume"), ("Maize White", "Grain"), ("Maize", "Grain"),
+            ("Maize Sweet Maize", "Grain"), ("Maize", "Grain"), ("Maize White", "Grain"), ("Maize", "Grain")]
+    db.add_records("Crop", ["Name", "Type", "GrowthDuration"], [(name, kind, 90) for name, kind in rows])
+
+
+def test_ranked_pages_follow_the_rank_and_key_cursor(farm_db):
+    _ranked_crops()
+    search = text_search("Crop", "maize")
+    everything = fetch_ranked_page("Crop", "CropID", search, None, 100)
+    ranked = list(zip(everything["rank"], everything["CropID"]))
+    assert len(ranked) == 7 and ranked == sorted(ranked)
+    assert ranked[0][1] == 5  # "Maize Sweet Maize" matches twice
+
+    seen = []
+    after = None
+    while True:
+        page = fetch_ranked_page("Crop", "CropID", search, after, 2)
+        if page.empty:
+            break
+        seen.extend(zip(page["rank"], page["CropID"]))
+        after = (float(page["rank"].iloc[-1]), int(page["CropID"].iloc[-1]))
+    assert seen == ranked
+
+
+def test_search_results_page_by_relevance(farm_db, monkeypatch):
+    monkeypatch.setattr("pagination.PAGE_SIZES", [3])
+    _ranked_crops()
+    app = AppTest.from_function(_crop_search, args=(farm_db,), default_timeout=30).run()
+    app.text_input[0].input("maize").run()
+    first = _shown(app)
+    assert first[0] == 5 and "rank" not in app.dataframe[0].value.columns
+    app.button(key="crops_next").click().run()
+    second = _shown(app)
+    app.button(key="crops_next").click().run()
+    third = _shown(app)
+    assert app.button(key="crops_next").disabled
+    assert sorted(first + second + third) == [1, 3, 4, 5, 6, 7, 8]
+    assert app.caption[0].value == "Page 3 · rows 7–7 of 7"
+
+    app.button(key="crops_previous").click().run()
+    assert _shown(app) == second
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import columnar
+import db
+import query_cache
+
+
+def _write_from_another_process(db_path, statement):
+    subprocess.run([sys.executable, "-c", "import sqlite3, sys\n"
+                    "conn = sqlite3.connect(sys.argv[1])\nconn.execute(sys.argv[2])\nconn.commit()",
+                    db_path, statement], check=True)
+
+
+def test_writes_from_another_process_are_seen(farm_db):
+    assert db.fetch_data("SELECT COUNT(*) FROM Crop") == [(0,)]
+    assert columnar.fetch_table("SELECT Name FROM Crop").num_rows == 0
+    _write_from_another_process(farm_db, "INSERT INTO Crop (Name, Type, GrowthDuration) VALUES ('Maize', 'Grain', 90)")
+    assert db.fetch_data("SELECT COUNT(*) FROM Crop") == [(1,)]
+    assert columnar.fetch_table("SELECT Name FROM Crop").column("Name").to_pylist() == ["Maize"]
+
+
+def test_own_writes_keep_unrelated_entries(farm_db):
+    db.fetch_data("SELECT COUNT(*) FROM Plot")
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    hits = query_cache.cache_stats()["hits"]
+    assert db.fetch_data("SELECT COUNT(*) FROM Plot") == [(0,)]
+    assert query_cache.cache_stats()["hits"] == hits + 1
+    assert db.fetch_data("SELECT COUNT(*) FROM Crop") == [(1,)]
+
+
+def test_external_write_before_a_batch_is_not_taken_for_its_own(farm_db):
+    db.fetch_data("SELECT COUNT(*) FROM Plot")
+    _write_from_another_process(farm_db, "INSERT INTO Plot (Location, Size) VALUES ('North', 2.0)")
+    # The writer commits first, before any read has checked
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    assert db.fetch_data("SELECT COUNT(*) FROM Plot") == [(1,)]
+
+
+def test_results_are_held_within_the_byte_budget(farm_db, monkeypatch):
+    for index in range(20):
+        db.add_record("Crop", {"Name": f"Crop {index}", "Type": "Grain", "GrowthDuration": 90})
+    size = query_cache.result_size(columnar.fetch_table("SELECT * FROM Crop WHERE CropID = ?", (1,)))
+    monkeypatch.setattr(query_cache, "MAX_BYTES", size * 3)
+    monkeypatch.setattr(query_cache, "MAX_ENTRY_BYTES", size * 2)
+    query_cache.clear()
+    for index in range(1, 6):
+        columnar.fetch_table("SELECT * FROM Crop WHERE CropID = ?", (index,))
+    assert query_cache.cache_stats()["bytes"] <= size * 3
+    assert query_cache.cache_stats()["entries"] == 3
+
+    whole = columnar.fetch_table("SELECT * FROM Crop")
+    assert query_cache.result_size(whole) > size * 2
+    assert query_cache.get(farm_db, "SELECT * FROM Crop", (), kind="arrow")[1] is None
+    assert query_cache.cache_stats()["entries"] == 3
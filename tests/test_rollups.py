@@ -0,0 +1,78 @@
+import archive
+import bulk_import
+import db
+from database_setup import ROLLUP_BATCH_REFRESH
+
+
+def _revenue():
+    return dict(db.fetch_data("SELECT Month, Revenue FROM MonthlyRevenueSummary ORDER BY Month"))
+
+
+def _recomputed():
+    return dict(db.fetch_data("SELECT strftime('%Y-%m', HarvestDate) AS Month, SUM(COALESCE(Revenue, 0)) "
+                              "FROM HarvestValuation GROUP BY Month ORDER BY Month"))
+
+
+def _farm():
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    db.add_record("Plot", {"Location": "North", "Size": 2.0})
+    db.add_record("MarketInfo", {"CropID": 1, "MarketDate": "2019-05-01", "PricePerUnit": 20.0})
+    for date, quantity in (("2019-06-10", 10), ("2024-02-10", 3), ("2024-03-10", 4)):
+        db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": date, "Quantity": quantity})
+
+
+def test_bulk_price_import_keeps_archived_revenue(farm_db, tmp_path):
+    _farm()
+    archive.archive_year(2019)
+    assert _revenue() == {"2019-06": 200.0, "2024-02": 60.0, "2024-03": 80.0}
+
+    prices = tmp_path / "prices.csv"
+    prices.write_text("CropID,MarketDate,PricePerUnit\n1,2024-03-01,5.0\n")
+    report = bulk_import.import_file(str(prices), "MarketInfo")
+    assert report["rows_inserted"] == 1
+    assert _revenue() == {"2019-06": 200.0, "2024-02": 60.0, "2024-03": 20.0}
+
+
+def test_harvests_entered_after_archiving_are_valued_at_the_archived_price(farm_db):
+    _farm()
+    db.add_record("MarketInfo", {"CropID": 1, "MarketDate": "2019-02-01", "PricePerUnit": 15.0})
+    archive.archive_year(2019)
+    assert db.fetch_data("SELECT MarketDate, PricePerUnit FROM MarketInfo") == [("2019-05-01", 20.0)]
+    assert archive.fetch_table("SELECT PricePerUnit FROM MarketInfo", sort_by="PricePerUnit").column(
+        "PricePerUnit").to_pylist() == [15.0, 20.0]
+    assert 2019 not in archive.closed_years()
+
+    db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-04-10", "Quantity": 2})
+    assert _revenue() == {"2019-06": 200.0, "2024-02": 60.0, "2024-03": 80.0, "2024-04": 40.0}
+
+
+def test_bulk_price_import_matches_the_triggers(farm_db, tmp_path):
+    _farm()
+    prices = tmp_path / "prices.csv"
+    prices.write_text("CropID,MarketDate,PricePerUnit\n1,2019-01-01,1.0\n1,2024-02-15,7.5\n1,2024-01-01,2.0\n")
+    bulk_import.import_file(str(prices), "MarketInfo")
+    assert _revenue() == _recomputed() == {"2019-06": 200.0, "2024-02": 6.0, "2024-03": 30.0}
+
+
+def test_bulk_harvest_import_logs_its_rows_and_restores_the_triggers(farm_db, tmp_path):
+    _farm()
+    triggers = db.fetch_data("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name")
+    harvests = tmp_path / "harvests.csv"
+    harvests.write_text("CropID,PlotID,HarvestDate,Quantity\n1,1,2024-03-20,5\n1,1,2024-04-01,6\n")
+    bulk_import.import_file(str(harvests), "Harvest")
+    assert db.fetch_data("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name") == triggers
+    assert db.fetch_data("SELECT RowID, Operation FROM ChangeLog WHERE TableName = 'Harvest' ORDER BY Seq") == [
+        (1, "I"), (2, "I"), (3, "I"), (4, "I"), (5, "I")]
+    db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-04-02", "Quantity": 1})
+    assert db.fetch_data("SELECT Month, TotalQuantity FROM MonthlyHarvestSummary ORDER BY Month") == [
+        ("2019-06", 10), ("2024-02", 3), ("2024-03", 9), ("2024-04", 7)]
+    assert _revenue() == _recomputed()
+
+
+def test_batch_refresh_reads_only_the_new_rows(farm_db):
+    with db.get_connection() as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for statements in ROLLUP_BATCH_REFRESH.values():
+            for statement in statements:
+                plan = [row[3].split() for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}", (0,))]
+                assert not [step for step in plan if step[0] == "SCAN" and step[1] in tables], plan
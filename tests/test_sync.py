@@ -0,0 +1,77 @@
+import pytest
+import db
+import sync
+
+
+def _add_crop():
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    return db.fetch_data("SELECT CropID, RowVersion FROM Crop")[0]
+
+
+@pytest.mark.parametrize("value", [2 ** 70, -2 ** 63 - 1, True, float("nan"), float("inf"), [1], {"a": 1}])
+def test_unstorable_values_are_rejected(farm_db, value):
+    with pytest.raises(ValueError):
+        sync.apply_edits([{"table": "Crop", "op": "insert",
+                           "values": {"Name": "Maize", "Type": "Grain", "GrowthDuration": value}}])
+    assert db.fetch_data("SELECT COUNT(*) FROM Crop") == [(0,)]
+
+
+@pytest.mark.parametrize("field, value", [("key", 2 ** 64), ("key", True), ("version", 2 ** 63), ("version", 1.0)])
+def test_keys_and_versions_must_be_64_bit_integers(farm_db, field, value):
+    key, version = _add_crop()
+    edit = {"table": "Crop", "op": "update", "key": key, "version": version, "values": {"GrowthDuration": 100}}
+    edit[field] = value
+    with pytest.raises(ValueError):
+        sync.apply_edits([edit])
+    assert db.fetch_data("SELECT GrowthDuration FROM Crop") == [(90,)]
+
+
+def test_rejected_batch_does_not_stall_later_writes(farm_db):
+    key, version = _add_crop()
+    with pytest.raises(ValueError):
+        sync.apply_edits([{"table": "Crop", "op": "update", "key": key, "version": version,
+                           "values": {"GrowthDuration": 10 ** 30}}])
+    result = sync.apply_edits([{"table": "Crop", "op": "update", "key": key, "version": version,
+                                "values": {"GrowthDuration": 2 ** 63 - 1}}])
+    assert result["results"] == [{"table": "Crop", "applied": 1}]
+    assert db.fetch_data("SELECT GrowthDuration, RowVersion FROM Crop") == [(2 ** 63 - 1, version + 1)]
+
+
+def test_stale_version_is_a_conflict(farm_db):
+    key, version = _add_crop()
+    db.update_record("Crop", {"GrowthDuration": 95}, {"CropID": key})
+    result = sync.apply_edits([{"table": "Crop", "op": "delete", "key": key, "version": version}])
+    assert result["results"][0]["conflicts"] == [key]
+    assert db.fetch_data("SELECT GrowthDuration FROM Crop") == [(95,)]
+
+
+def _add_harvest():
+    _add_crop()
+    db.add_record("Plot", {"Location": "North", "Size": 2.0})
+    db.add_record("Harvest", {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-05-01", "Quantity": 10})
+    return db.fetch_data("SELECT HarvestID, RowVersion FROM Harvest")[0]
+
+
+@pytest.mark.parametrize("values, error", [({"HarvestDate": "2024-13-05"}, "invalid HarvestDate"),
+                                           ({"HarvestDate": "2024-02-30"}, "invalid HarvestDate"),
+                                           ({"HarvestDate": 20240505}, "invalid HarvestDate"),
+                                           ({"Quantity": -3}, "invalid Quantity"),
+                                           ({"Quantity": 2.5}, "invalid Quantity"),
+                                           ({"PlotID": 99}, "unknown PlotID")])
+def test_invalid_values_are_rejected_per_edit(farm_db, values, error):
+    key, version = _add_harvest()
+    result = sync.apply_edits([
+        {"table": "Harvest", "op": "update", "key": key, "version": version, "values": values},
+        {"table": "Harvest", "op": "insert",
+         "values": {"CropID": 1, "PlotID": 1, "HarvestDate": "2024-06-01", "Quantity": 4}}])
+    assert result["rejected"] == [{"edit": 0, "error": error}]
+    assert result["results"] == [{"table": "Harvest", "applied": 1}]
+    assert db.fetch_data("SELECT HarvestDate, Quantity FROM Harvest ORDER BY HarvestID") == [
+        ("2024-05-01", 10), ("2024-06-01", 4)]
+
+
+def test_edited_dates_are_stored_like_imported_ones(farm_db):
+    key, version = _add_harvest()
+    sync.apply_edits([{"table": "Harvest", "op": "update", "key": key, "version": version,
+                       "values": {"HarvestDate": "2024-5-7"}}])
+    assert db.fetch_data("SELECT HarvestDate FROM Harvest") == [("2024-05-07",)]
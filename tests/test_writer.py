@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+import time
+import pytest
+import db
+
+
+def test_unbindable_value_fails_only_its_request(farm_db):
+    with pytest.raises(OverflowError):
+        db.submit_write("Crop", "INSERT INTO Crop (Name, Type, GrowthDuration) VALUES (?, ?, ?)",
+                        ("Maize", "Grain", 2 ** 70)).result(timeout=5)
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    assert db.fetch_data("SELECT Name, GrowthDuration FROM Crop") == [("Maize", 90)]
+
+
+def test_failed_request_in_a_batch_keeps_the_others(farm_db):
+    insert = "INSERT INTO Crop (Name, Type, GrowthDuration) VALUES (?, ?, ?)"
+    futures = [db.submit_write("Crop", insert, ("Beans", "Legume", 60)),
+               db.submit_write("Crop", insert, ("Cassava", "Root", object())),
+               db.submit_write("Crop", insert, ("Yam", "Root", 240))]
+    assert futures[0].result(timeout=5) == 1
+    assert futures[1].exception(timeout=5) is not None
+    assert futures[2].result(timeout=5) == 1
+    assert [row[0] for row in db.fetch_data("SELECT Name FROM Crop ORDER BY Name")] == ["Beans", "Yam"]
+
+
+def test_bulk_rows_are_recorded_together_or_not_at_all(farm_db):
+    columns = ["Name", "Type", "GrowthDuration"]
+    with pytest.raises(sqlite3.Error):
+        db.add_records("Crop", columns, [("Beans", "Legume", 60), ("Cassava", "Root", object()), ("Yam", "Root", 240)])
+    assert db.fetch_data("SELECT Name FROM Crop") == []
+    assert db.add_records("Crop", columns, [("Beans", "Legume", 60), ("Yam", "Root", 240)]) == 2
+    assert [row[0] for row in db.fetch_data("SELECT Name FROM Crop ORDER BY Name")] == ["Beans", "Yam"]
+
+
+def test_writer_restarts_after_it_stops(farm_db):
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    requests, thread = db._writers[farm_db][:2]
+    requests.put(None)
+    thread.join(timeout=5)
+    db.add_record("Crop", {"Name": "Rice", "Type": "Grain", "GrowthDuration": 120})
+    assert len(db.fetch_data("SELECT CropID FROM Crop")) == 2
+
+
+def test_form_write_waits_for_a_long_exclusive_write(farm_db, monkeypatch):
+    # A direct write holding the lock this long would fail the form write
+    # with "database is locked"; as a job it just queues behind it
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_MS", 200)
+    db.close_connections()
+    holding = threading.Event()
+
+    def long_write(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO Crop (Name, Type, GrowthDuration) VALUES ('Wheat', 'Grain', 120)")
+        holding.set()
+        time.sleep(1)
+        conn.commit()
+
+    job = threading.Thread(target=db.run_exclusive, args=(long_write,))
+    job.start()
+    assert holding.wait(timeout=5)
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    job.join(timeout=5)
+    assert [row[0] for row in db.fetch_data("SELECT Name FROM Crop ORDER BY Name")] == ["Maize", "Wheat"]
+
+
+def test_failed_job_rolls_back_and_the_writer_carries_on(farm_db):
+    def failing(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO Crop (Name, Type, GrowthDuration) VALUES ('Wheat', 'Grain', 120)")
+        raise ValueError("stop")
+
+    with pytest.raises(ValueError):
+        db.run_exclusive(failing)
+    db.add_record("Crop", {"Name": "Maize", "Type": "Grain", "GrowthDuration": 90})
+    assert db.fetch_data("SELECT Name FROM Crop") == [("Maize",)]